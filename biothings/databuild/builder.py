@@ -1,4 +1,4 @@
-import sys, re, math
+import sys, re, math, json
 import os, glob
 import time
 import copy
@@ -15,6 +15,7 @@ from biothings.utils.common import timesofar, iter_n, get_timestamp, \
                                    dump, rmdashfr, loadobj
 from biothings.utils.mongo import doc_feeder, id_feeder
 from biothings.utils.loggers import get_logger, HipchatHandler
+from biothings.utils.fingerprint import drop_fingerprints
 from biothings.databuild.mapper import TransparentMapper
 from biothings.dataload.uploader import ResourceNotReady
 from biothings.utils.manager import BaseManager, ManagerError
@@ -293,6 +294,8 @@ class DataBuilder(object):
         for colname in to_drop:
             self.logger.info("Cleaning old archive collection '%s'" % colname)
             db[colname].drop()
+            # and its documents' fingerprints, if any
+            drop_fingerprints(db[colname])
 
     def init_mapper(self,mapper_name):
         if self.mappers[mapper_name].need_load():
@@ -403,18 +406,142 @@ class DataBuilder(object):
                     found.append(col)
         return found
 
-    def merge(self, sources=None, target_name=None, force=False, ids=None, job_manager=None, *args,**kwargs):
+    def get_previous_build(self):
+        """
+        Return the last successful build document (from src_build) for this
+        build configuration, if its target collection still exists, or None.
+        """
+        src_build = self.source_backend.build
+        target_db = self.target_backend.target_collection.database
+        cols = target_db.collection_names()
+        # "_meta" is only registered once a build is successful
+        for build in src_build.find({"build_config._id" : self.build_config["_id"],
+                                     "_meta.build_version" : {"$exists" : True}}).sort("started_at",-1):
+            if build["_id"] != self.target_backend.target_name and build["_id"] in cols:
+                return build
+        return None
+
+    def get_changed_sources(self, previous_build, sources):
+        """
+        Return source collection names from sources which may have changed
+        since previous_build: their version is different, they were uploaded
+        after previous build started, or they weren't part of it.
+        """
+        prev_versions = previous_build.get("_meta",{}).get("src_version",{})
+        prev_sources = previous_build.get("merge_stats",{})
+        changed = set([src for src in sources if not src in prev_sources])
+        for src_doc in self.source_backend.dump.find():
+            version = src_doc.get('release', src_doc.get('timestamp', None))
+            for job in src_doc.get("upload",{}).get("jobs",{}).values():
+                col_name = job.get("step")
+                if not col_name in sources:
+                    continue
+                if prev_versions.get(src_doc["_id"]) != version:
+                    changed.add(col_name)
+                elif job.get("started_at") and job["started_at"] >= previous_build["started_at"]:
+                    changed.add(col_name)
+        return sorted(changed)
+
+    def plan_incremental_merge(self, sources):
+        """
+        Determine how target can be built from previous build, given all
+        sources (collection names) involved in the build. Documents' root keys
+        from changed and removed sources are deleted from previous build's data,
+        then changed sources, and unchanged ones sharing root keys with them,
+        are merged again. Return a dict describing the plan, or None if an
+        incremental build isn't possible (no previous build, root document
+        sources changed, or sources without mapping involved).
+        """
+        previous = self.get_previous_build()
+        if not previous:
+            self.logger.info("No previous build found")
+            return None
+        changed = self.get_changed_sources(previous,sources)
+        removed = sorted(set(previous.get("merge_stats",{})).difference(sources))
+        root_sources = self.get_root_document_sources()
+        if root_sources and set(changed + removed).intersection(root_sources):
+            self.logger.info("Root document sources changed: %s" % \
+                    sorted(set(changed + removed).intersection(root_sources)))
+            return None
+        # all root keys are needed to know what to delete
+        root_keys = {}
+        for src in set(sources).union(removed):
+            root_keys[src] = self.get_source_root_keys(src)
+            if root_keys[src] is None:
+                self.logger.info("No mapping found for source '%s', can't know its root keys" % src)
+                return None
+        to_merge = set(changed)
+        deleted_keys = set()
+        for src in changed + removed:
+            deleted_keys.update(root_keys[src])
+        # unchanged sources sharing keys with changed ones lose data too,
+        # they need to be merged again (which can involve other sources)
+        found = True
+        while found:
+            found = False
+            for src in set(sources).difference(to_merge):
+                if root_keys[src].intersection(deleted_keys):
+                    to_merge.add(src)
+                    deleted_keys.update(root_keys[src])
+                    found = True
+        if root_sources and to_merge.intersection(root_sources):
+            self.logger.info("Root document sources %s share keys with changed sources" % \
+                    sorted(to_merge.intersection(root_sources)))
+            return None
+        return {"from" : previous["_id"],
+                "merge_stats" : previous.get("merge_stats",{}),
+                "changed" : changed,
+                "removed" : removed,
+                "to_merge" : sorted(to_merge),
+                "deleted_keys" : sorted(deleted_keys)}
+
+    def prepare_incremental_target(self, plan):
+        """
+        Clone previous build's target collection into target collection,
+        then delete root keys from sources to merge again (documents only
+        containing these keys are deleted). Everything is done server-side.
+        """
+        target = self.target_backend.target_collection
+        previous = target.database[plan["from"]]
+        self.logger.info("Cloning '%s' into '%s'" % (previous.name,target.name))
+        previous.aggregate([{"$match" : {}},{"$out" : target.name}],allowDiskUse=True)
+        if not plan["deleted_keys"]:
+            return {"deleted" : 0, "updated" : 0}
+        # documents with no other root key than the ones to delete, and at least one of them
+        keys = json.dumps(dict([(k,1) for k in plan["deleted_keys"]]))
+        only_deleted_keys = "function() {var keys = %s; for(var k in this) {if(k != '_id' && !(k in keys)) return false;} return true;}" % keys
+        res = target.delete_many({"$or" : [{k : {"$exists" : True}} for k in plan["deleted_keys"]],
+                                  "$where" : only_deleted_keys})
+        deleted = res.deleted_count
+        res = target.update_many({"$or" : [{k : {"$exists" : True}} for k in plan["deleted_keys"]]},
+                                 {"$unset" : dict([(k,"") for k in plan["deleted_keys"]])})
+        self.logger.info("Removed keys %s from previous build data: %d documents deleted, %d updated" % \
+                (plan["deleted_keys"],deleted,res.modified_count))
+        return {"deleted" : deleted, "updated" : res.modified_count}
+
+    def merge(self, sources=None, target_name=None, force=False, ids=None, job_manager=None,
+              incremental=False, *args,**kwargs):
+        """
+        Merge sources (all sources from build config if None) into target.
+        If incremental is True (and all sources are merged), target is built from
+        the previous successful build, merging again only sources which changed
+        since then (see plan_incremental_merge()). Falls back to a full merge if
+        not possible.
+        """
         assert job_manager
         self.t0 = time.time()
         self.check_ready(force)
         # normalize
         avail_sources = self.build_config['sources']
+        incremental_plan = None
         if sources is None:
             self.target_backend.drop()
             self.target_backend.prepare()
             sources = avail_sources # merge all
         elif isinstance(sources,str):
             sources = [sources]
+        # only when all sources are merged, otherwise the target isn't a full build
+        incremental = incremental and sources is avail_sources
 
         orig_sources = sources
         sources = self.resolve_sources(sources)
@@ -426,6 +553,13 @@ class DataBuilder(object):
             self.target_backend.set_target_name(self.target_name)
         else:
             target_name = self.target_backend.target_collection.name
+        # target is about to be written, documents' fingerprints (if any) become outdated
+        drop_fingerprints(self.target_backend.target_collection)
+        if incremental:
+            # before cleaning, previous build could be archived
+            incremental_plan = self.plan_incremental_merge(sources)
+            if incremental_plan is None:
+                self.logger.warning("Can't build incrementally, merging all sources")
         self.clean_old_collections()
 
         self.logger.info("Merging into target collection '%s'" % self.target_backend.target_collection.name)
@@ -434,9 +568,36 @@ class DataBuilder(object):
         try:
             @asyncio.coroutine
             def do():
-                job = self.merge_sources(source_names=sources, ids=ids, job_manager=job_manager,
+                merged_sources = sources
+                lineage = None
+                if incremental_plan:
+                    self.register_status("building",transient=True,init=True,
+                            job={"step":"incremental","from":incremental_plan["from"],
+                                 "changed":incremental_plan["changed"],"removed":incremental_plan["removed"]})
+                    self.logger.info("Building incrementally from '%s', changed sources: %s, removed: %s" % \
+                            (incremental_plan["from"],incremental_plan["changed"],incremental_plan["removed"]))
+                    pinfo = self.get_pinfo()
+                    pinfo["step"] = "incremental"
+                    job = yield from job_manager.defer_to_thread(pinfo,
+                            partial(self.prepare_incremental_target,incremental_plan))
+                    cleaned = yield from job
+                    self.register_status("success",job={"step":"incremental","cleaned":cleaned})
+                    # touch all sources so their versions are part of build metadata
+                    for src in sources:
+                        self.source_backend[src]
+                    merged_sources = incremental_plan["to_merge"]
+                    lineage = {"from" : incremental_plan["from"],
+                               "changed_sources" : incremental_plan["changed"],
+                               "removed_sources" : incremental_plan["removed"],
+                               "merged_sources" : merged_sources}
+                job = self.merge_sources(source_names=merged_sources, ids=ids, job_manager=job_manager,
                                          *args, **kwargs)
                 res = yield from job
+                if incremental_plan:
+                    # data from sources not merged again comes from previous build
+                    for src in set(sources).difference(merged_sources):
+                        if src in incremental_plan["merge_stats"]:
+                            self.stats[src] = incremental_plan["merge_stats"][src]
                 pinfo = self.get_pinfo()
                 pinfo["step"] = "metadata"
                 postjob = yield from job_manager.defer_to_thread(pinfo,
@@ -452,7 +613,7 @@ class DataBuilder(object):
                         # get original start dt
                         src_build = self.source_backend.build
                         build = src_build.find_one({'_id': target_name})
-                        self.register_status('success',build={
+                        build_info = {
                             "merge_stats" : self.stats,
                             "mapping" : self.mapping,
                             "_meta" : {
@@ -461,7 +622,10 @@ class DataBuilder(object):
                                 "stats" : self.metadata,
                                 "build_version" : build_version,
                                 "timestamp" : str(build["started_at"])}
-                            })
+                            }
+                        if lineage:
+                            build_info["lineage"] = lineage
+                        self.register_status('success',build=build_info)
                         self.logger.info("success %s" % strargs,extra={"notify":True})
                     except Exception as e:
                         strargs = "[sources=%s]" % sources
@@ -499,11 +663,16 @@ class DataBuilder(object):
             raise BuilderException("Found mapper named '%s' but no mapper associated" % mapper_name)
 
     @asyncio.coroutine
-    def merge_sources(self, source_names, steps=["merge","post"], batch_size=100000, ids=None, job_manager=None):
+    def merge_sources(self, source_names, steps=["merge","post"], batch_size=100000, ids=None,
+                      job_manager=None, merge_mode="ids", write_options=None, concurrency=None):
         """
         Merge resources from given source_names or from build config.
         Identify root document sources from the list to first process them.
         ids can a be list of documents to be merged in particular.
+        merge_mode and write_options are passed to merge_source() (see there for details)
+        concurrency is the max number of non-root sources merged at the same time
+        (default from build config "merge_concurrency" key, or 1). Sources are merged
+        concurrently only if they don't conflict (see get_merge_conflicts())
         """
         assert job_manager
         # check what to do
@@ -535,13 +704,38 @@ class DataBuilder(object):
 
         got_error = False
 
+        if concurrency is None:
+            concurrency = self.build_config.get("merge_concurrency",1)
+
         @asyncio.coroutine
-        def merge(src_names):
+        def merge(src_names,concurrency=1):
             jobs = []
-            for i,src_name in enumerate(src_names):
+            conflicts = concurrency > 1 and self.get_merge_conflicts(src_names) or {}
+            pending = list(src_names)
+            running = {}
+            while pending:
                 yield from asyncio.sleep(0.0)
+                src_name = None
+                if len(running) < concurrency:
+                    for i,name in enumerate(pending):
+                        # sources before in the list and conflicting must be merged first,
+                        # so conflicting sources are always merged in the same order
+                        blocking = set(running.values()).union(pending[:i])
+                        if not conflicts.get(name,set()).intersection(blocking):
+                            src_name = name
+                            break
+                if src_name is None:
+                    # wait for a slot or a conflicting source to be merged
+                    yield from asyncio.wait(list(running.keys()),return_when=asyncio.FIRST_COMPLETED)
+                    for job in [j for j in running if j.done()]:
+                        running.pop(job)
+                    if got_error:
+                        raise got_error
+                    continue
+                pending.remove(src_name)
                 job = self.merge_source(src_name, batch_size=batch_size, ids=ids,
-                                        job_manager=job_manager)
+                                        job_manager=job_manager, merge_mode=merge_mode,
+                                        write_options=write_options)
                 job = asyncio.ensure_future(job)
                 def merged(f,name,stats):
                     try:
@@ -553,7 +747,9 @@ class DataBuilder(object):
                         got_error = e
                 job.add_done_callback(partial(merged,name=src_name,stats=self.stats))
                 jobs.append(job)
-                yield from asyncio.wait([job])
+                running[job] = src_name
+                if concurrency > 1:
+                    self.logger.info("Sources currently merging: %s" % sorted(running.values()))
                 # raise error as soon as we know something went wrong
                 if got_error:
                     raise got_error
@@ -570,9 +766,9 @@ class DataBuilder(object):
 
             if other_sources:
                 self.register_status("building",transient=True,init=True,
-                        job={"step":"merge-others","sources":other_sources})
-                self.logger.info("Merging other resources: %s" % other_sources)
-                yield from merge(other_sources)
+                        job={"step":"merge-others","sources":other_sources,"concurrency":concurrency})
+                self.logger.info("Merging other resources: %s (concurrency: %s)" % (other_sources,concurrency))
+                yield from merge(other_sources,concurrency=concurrency)
                 self.register_status("success",job={"step":"merge-others","sources":other_sources})
 
             self.register_status("building",transient=True,init=True,
@@ -608,13 +804,77 @@ class DataBuilder(object):
         yield from asyncio.sleep(0.0)
         return self.stats
 
+    def get_source_root_keys(self,src_name):
+        """
+        Return the set of root keys documents from src_name contain, according
+        to the mapping registered in src_master, or None if unknown.
+        """
+        docs = self.source_backend.get_src_master_docs()
+        for master_name in docs:
+            pat = re.compile("^%s$" % master_name)
+            if pat.match(src_name):
+                mapping = docs[master_name].get("mapping")
+                if mapping:
+                    return set(mapping.keys()).difference({"_id"})
+        return None
+
+    def get_merge_conflicts(self,src_names):
+        """
+        Return a dict where keys are source names and values the set of sources
+        it can't be merged with at the same time. Documents are merged using $set
+        on root keys, so sources sharing a root key, according to their mappings, are
+        conflicting. Sources without mapping conflict with all others. Conflicts can
+        also be declared in build config, as a list of lists of source names (or regex)
+        in key "merge_conflicts", eg. [["src1","src2"],["src3","src4.*"]]
+        """
+        conflicts = dict([(src,set()) for src in src_names])
+        root_keys = dict([(src,self.get_source_root_keys(src)) for src in src_names])
+        for src1 in src_names:
+            for src2 in src_names:
+                if src1 == src2:
+                    continue
+                keys1,keys2 = root_keys[src1],root_keys[src2]
+                if keys1 is None or keys2 is None or keys1.intersection(keys2):
+                    conflicts[src1].add(src2)
+        for declared in self.build_config.get("merge_conflicts",[]):
+            group = set(self.resolve_sources(declared)).intersection(set(src_names))
+            for src in group:
+                conflicts[src].update(group.difference({src}))
+        self.logger.debug("Merge conflicts: %s" % conflicts)
+        return conflicts
+
     def clean_document_to_merge(self,doc):
         return doc
 
     @asyncio.coroutine
-    def merge_source(self, src_name, batch_size=100000, ids=None, job_manager=None):
+    def merge_source(self, src_name, batch_size=100000, ids=None, job_manager=None, merge_mode="ids",
+                     write_options=None):
+        """
+        Merge documents from source src_name into target. merge_mode defines how
+        documents are distributed to merger workers:
+        - "ids": _ids are fetched (id_feeder) and sent by batch to workers, which
+          query documents back using these _ids
+        - "range": _id split points are computed on source collection, each worker
+          is given a range of _ids and streams documents from it with a sorted cursor.
+        - "aggregate": same _id ranges as "range" mode, but each range is merged
+          server-side with an aggregation pipeline ending with a $merge stage, so
+          documents never transit through the hub. Only for sources using a
+          TransparentMapper, with source and target databases on the same server
+          (MongoDB >= 4.2), otherwise "range" mode is used. write_options are ignored.
+        When a specific list of ids is passed, or when source _ids are of different
+        types (can't be split in ranges, see mongo.get_id_boundaries()), "ids" mode is used.
+        write_options, if not None, is a dict of parameters passed to target backend's
+        bulk_update() (eg. {"batch_size":10000,"max_in_flight":4,"write_concern":{"w":1}}),
+        which then replaces the default ordered update() to store merged documents.
+        Matched/upserted counters from each batch are then summed for the whole source.
+        """
         # it's actually not optional
         assert job_manager
+        if not merge_mode in ["ids","range","aggregate"]:
+            raise BuilderException("Unknown merge mode '%s'" % merge_mode)
+        if merge_mode == "aggregate" and not ids and not self.can_merge_server_side(src_name):
+            self.logger.warning("Can't merge '%s' server-side, using 'range' merge mode" % src_name)
+            merge_mode = "range"
         _query = self.generate_document_query(src_name)
         # Note: no need to check if there's an existing document with _id (we want to merge only with an existing document)
         # if the document doesn't exist then the update() call will silently fail.
@@ -631,55 +891,112 @@ class DataBuilder(object):
         bnum = 1
         cnt = 0
         got_error = False
-        # grab ids only, so we can get more, let's say 10 times more
-        id_batch_size = batch_size * 10
-        if ids:
-            self.logger.info("Merging '%s' specific list of _ids, create merger job with batch_size=%d" % (src_name, batch_size))
-            id_provider = [ids]
-        else:
-            self.logger.info("Fetch _ids from '%s' with batch_size=%d, and create merger job with batch_size=%d" % (src_name, id_batch_size, batch_size))
-            id_provider = id_feeder(self.source_backend[src_name], batch_size=id_batch_size)
-        id_provider = ids and [ids] or id_feeder(self.source_backend[src_name],
-                                                 batch_size=id_batch_size,logger=self.logger)
-        for big_doc_ids in id_provider:
-            for doc_ids in iter_n(big_doc_ids,batch_size):
-                # try to put some async here to give control back
-                # (but everybody knows it's a blocking call: doc_feeder)
-                yield from asyncio.sleep(0.1)
-                cnt += len(doc_ids)
+
+        def batch_merged(f,batch_num):
+            nonlocal got_error
+            if not type(f.result()) in (int,dict):
+                got_error = Exception("Batch #%s failed while merging source '%s' [%s]" % (batch_num,src_name,f.result()))
+
+        splits = None
+        if merge_mode in ["range","aggregate"] and not ids:
+            self.logger.info("Computing _id ranges for '%s' with batch_size=%d" % (src_name, batch_size))
+            splits = mongo.get_id_boundaries(self.source_backend[src_name],
+                                             batch_size=batch_size,logger=self.logger)
+            if splits is None:
+                self.logger.warning("Can't merge '%s' by _id ranges, using 'ids' merge mode" % src_name)
+        if splits is not None:
+            # first range has no lower bound, last one no upper bound
+            id_ranges = list(zip([None] + splits, splits + [None]))
+            btotal = len(id_ranges)
+            for id_range in id_ranges:
+                yield from asyncio.sleep(0.0)
                 pinfo = self.get_pinfo()
                 pinfo["step"] = src_name
-                pinfo["description"] = "#%d/%d (%.1f%%)" % (bnum,btotal,(cnt/total*100))
-                self.logger.info("Creating merger job #%d/%d, to process '%s' %d/%d (%.1f%%)" % \
-                        (bnum,btotal,src_name,cnt,total,(cnt/total*100.)))
-                job = yield from job_manager.defer_to_process(
-                        pinfo,
-                        partial(merger_worker,
+                pinfo["description"] = "#%d/%d (%.1f%%)" % (bnum,btotal,(bnum/btotal*100))
+                self.logger.info("Creating %s merger job #%d/%d, to process '%s' %s" % \
+                        (merge_mode,bnum,btotal,src_name,repr(id_range)))
+                if merge_mode == "aggregate":
+                    worker = partial(aggregate_merger_worker,
+                            self.source_backend[src_name].name,
+                            self.target_backend.target_name,
+                            id_range,
+                            upsert,
+                            bnum)
+                else:
+                    worker = partial(range_merger_worker,
                             self.source_backend[src_name].name,
                             self.target_backend.target_name,
-                            doc_ids,
+                            id_range,
                             self.get_mapper_for_source(src_name,init=False),
                             upsert,
-                            bnum))
-                def batch_merged(f,batch_num):
-                    nonlocal got_error
-                    if type(f.result()) != int:
-                        got_error = Exception("Batch #%s failed while merging source '%s' [%s]" % (batch_num,src_name,f.result()))
+                            bnum,
+                            write_options)
+                job = yield from job_manager.defer_to_process(pinfo,worker)
                 job.add_done_callback(partial(batch_merged,batch_num=bnum))
                 jobs.append(job)
                 bnum += 1
                 # raise error as soon as we know
                 if got_error:
                     raise got_error
+        else:
+            # grab ids only, so we can get more, let's say 10 times more
+            id_batch_size = batch_size * 10
+            if ids:
+                self.logger.info("Merging '%s' specific list of _ids, create merger job with batch_size=%d" % (src_name, batch_size))
+                id_provider = [ids]
+            else:
+                self.logger.info("Fetch _ids from '%s' with batch_size=%d, and create merger job with batch_size=%d" % (src_name, id_batch_size, batch_size))
+                id_provider = id_feeder(self.source_backend[src_name], batch_size=id_batch_size,
+                                        logger=self.logger)
+            for big_doc_ids in id_provider:
+                for doc_ids in iter_n(big_doc_ids,batch_size):
+                    # try to put some async here to give control back
+                    # (but everybody knows it's a blocking call: doc_feeder)
+                    yield from asyncio.sleep(0.1)
+                    cnt += len(doc_ids)
+                    pinfo = self.get_pinfo()
+                    pinfo["step"] = src_name
+                    pinfo["description"] = "#%d/%d (%.1f%%)" % (bnum,btotal,(cnt/total*100))
+                    self.logger.info("Creating merger job #%d/%d, to process '%s' %d/%d (%.1f%%)" % \
+                            (bnum,btotal,src_name,cnt,total,(cnt/total*100.)))
+                    job = yield from job_manager.defer_to_process(
+                            pinfo,
+                            partial(merger_worker,
+                                self.source_backend[src_name].name,
+                                self.target_backend.target_name,
+                                doc_ids,
+                                self.get_mapper_for_source(src_name,init=False),
+                                upsert,
+                                bnum,
+                                write_options))
+                    job.add_done_callback(partial(batch_merged,batch_num=bnum))
+                    jobs.append(job)
+                    bnum += 1
+                    # raise error as soon as we know
+                    if got_error:
+                        raise got_error
         self.logger.info("%d jobs created for merging step" % len(jobs))
         tasks = asyncio.gather(*jobs)
         def done(f):
             nonlocal got_error
+            nonlocal cnt
             if None in f.result():
                 got_error = Exception("Some batches failed")
                 return
             # compute overall inserted/updated records
-            cnt = sum(f.result())
+            cnt = 0
+            write_stats = {}
+            for res in f.result():
+                if type(res) == dict:
+                    # from bulk_update(), roll up counters
+                    for k in ["matched","upserted","unacknowledged"]:
+                        write_stats[k] = write_stats.get(k,0) + res.get(k,0)
+                    write_stats["sub_batches"] = write_stats.get("sub_batches",0) + len(res.get("batches",[]))
+                    cnt += res.get("matched",0) + res.get("upserted",0) + res.get("unacknowledged",0)
+                else:
+                    cnt += res
+            if write_stats:
+                self.logger.info("Write stats for source '%s': %s" % (src_name,write_stats))
 
         tasks.add_done_callback(done)
         yield from tasks
@@ -688,6 +1005,29 @@ class DataBuilder(object):
         else:
             return {"%s" % src_name : cnt}
 
+    def can_merge_server_side(self, src_name):
+        """
+        Return True if src_name can be merged with an aggregation pipeline
+        ($merge stage): documents aren't transformed (TransparentMapper), source
+        and target databases are on the same server, which supports $merge
+        """
+        mapper = self.get_mapper_for_source(src_name,init=False)
+        if not isinstance(mapper,TransparentMapper):
+            self.logger.info("Source '%s' has mapper '%s', documents need to be processed by the hub" % \
+                    (src_name,mapper))
+            return False
+        src_server = (btconfig.DATA_SRC_SERVER,btconfig.DATA_SRC_PORT)
+        target_server = (btconfig.DATA_TARGET_SERVER,btconfig.DATA_TARGET_PORT)
+        if src_server != target_server:
+            self.logger.info("Source and target databases aren't on the same server (%s != %s)" % \
+                    (src_server,target_server))
+            return False
+        version = self.source_backend[src_name].database.client.server_info()["versionArray"]
+        if version[:2] < [4,2]:
+            self.logger.info("MongoDB server version %s doesn't support $merge" % version)
+            return False
+        return True
+
     def post_merge(self, source_names, batch_size, job_manager):
         pass
 
@@ -695,7 +1035,25 @@ class DataBuilder(object):
 from biothings.utils.backend import DocMongoBackend
 import biothings.utils.mongo as mongo
 
-def merger_worker(col_name,dest_name,ids,mapper,upsert,batch_num):
+def dump_merger_exception(e,dest_name,col_name,batch_num):
+    logger_name = "build_%s_%s_batch_%s" % (dest_name,col_name,batch_num)
+    logger = get_logger(logger_name, btconfig.LOG_FOLDER)
+    logger.exception(e)
+    exc_fn = os.path.join(btconfig.LOG_FOLDER,"%s.pick" % logger_name)
+    pickle.dump(e,open(exc_fn,"wb"))
+    logger.info("Exception was dumped in pickle file '%s'" % exc_fn)
+
+def store_merged_docs(dest,docs,upsert,write_options=None):
+    """
+    Store docs in dest backend, using the default ordered update()
+    or bulk_update() if write_options are passed (see DataBuilder.merge_source)
+    """
+    if write_options is None:
+        return dest.update(docs, upsert=upsert)
+    else:
+        return dest.bulk_update(docs, upsert=upsert, **write_options)
+
+def merger_worker(col_name,dest_name,ids,mapper,upsert,batch_num,write_options=None):
     try:
         src = mongo.get_src_db()
         tgt = mongo.get_target_db()
@@ -706,15 +1064,70 @@ def merger_worker(col_name,dest_name,ids,mapper,upsert,batch_num):
         cur = doc_feeder(col, step=len(ids), inbatch=False, query={'_id': {'$in': ids}})
         mapper.load()
         docs = mapper.process(cur)
-        cnt = dest.update(docs, upsert=upsert)
+        cnt = store_merged_docs(dest, docs, upsert, write_options)
         return cnt
     except Exception as e:
-        logger_name = "build_%s_%s_batch_%s" % (dest_name,col_name,batch_num)
-        logger = get_logger(logger_name, btconfig.LOG_FOLDER)
-        logger.exception(e)
-        exc_fn = os.path.join(btconfig.LOG_FOLDER,"%s.pick" % logger_name)
-        pickle.dump(e,open(exc_fn,"wb"))
-        logger.info("Exception was dumped in pickle file '%s'" % exc_fn)
+        dump_merger_exception(e,dest_name,col_name,batch_num)
+        raise
+
+def range_merger_worker(col_name,dest_name,id_range,mapper,upsert,batch_num,write_options=None,step=10000):
+    """
+    Merge documents from col_name which _id is within id_range, a tuple
+    (start,end) where start is inclusive, end exclusive. None means no bound.
+    """
+    try:
+        src = mongo.get_src_db()
+        tgt = mongo.get_target_db()
+        col = src[col_name]
+        dest = DocMongoBackend(tgt,tgt[dest_name])
+        start,end = id_range
+        id_query = {}
+        if not start is None:
+            id_query["$gte"] = start
+        if not end is None:
+            id_query["$lt"] = end
+        query = id_query and {"_id" : id_query} or {}
+        # sorted on _id so the range is walked along the _id index
+        cur = col.find(query,no_cursor_timeout=True).sort("_id",1).batch_size(step)
+        try:
+            mapper.load()
+            docs = mapper.process(cur)
+            cnt = store_merged_docs(dest, docs, upsert, write_options)
+        finally:
+            cur.close()
+        return cnt
+    except Exception as e:
+        dump_merger_exception(e,dest_name,col_name,batch_num)
+        raise
+
+def aggregate_merger_worker(col_name,dest_name,id_range,upsert,batch_num):
+    """
+    Merge documents from col_name which _id is within id_range (see
+    range_merger_worker()) into dest_name, server-side: root keys are merged
+    into existing documents like update() does with $set, and documents are
+    inserted only if upsert is True. Return the number of documents processed
+    from the source range, $merge doesn't report matched/inserted counts.
+    """
+    try:
+        src = mongo.get_src_db()
+        tgt = mongo.get_target_db()
+        col = src[col_name]
+        start,end = id_range
+        id_query = {}
+        if not start is None:
+            id_query["$gte"] = start
+        if not end is None:
+            id_query["$lt"] = end
+        query = id_query and {"_id" : id_query} or {}
+        pipeline = [{"$match" : query},
+                    {"$merge" : {"into" : {"db" : tgt.name, "coll" : dest_name},
+                                 "on" : "_id",
+                                 "whenMatched" : "merge",
+                                 "whenNotMatched" : upsert and "insert" or "discard"}}]
+        col.aggregate(pipeline,allowDiskUse=True)
+        return col.count(query)
+    except Exception as e:
+        dump_merger_exception(e,dest_name,col_name,batch_num)
         raise
 
 
@@ -10,9 +10,9 @@ import glob, random
 
 from biothings.utils.common import timesofar, iter_n, get_timestamp, \
                                    dump, rmdashfr, loadobj, md5sum
-from biothings.utils.mongo import id_feeder, get_src_build
+from biothings.utils.mongo import id_feeder, sorted_id_feeder, get_src_build
 from biothings.utils.loggers import get_logger, HipchatHandler
-from biothings.utils.diff import diff_docs_jsonpatch, generate_diff_folder
+from biothings.utils.diff import diff_docs_jsonpatch, generate_diff_folder, merge_join_ids
 from biothings import config as btconfig
 from biothings.utils.manager import BaseManager, ManagerError
 from biothings.databuild.backend import create_backend
@@ -21,6 +21,8 @@ import biothings.utils.aws as aws
 from biothings.databuild.syncer import SyncerManager
 from biothings.utils.jsondiff import make as jsondiff
 from biothings.utils.hub import publish_data_version
+from biothings.utils.fingerprint import has_fingerprints, store_fingerprints, changed_ids
+import biothings.utils.diffstream as diffstream
 
 logging = btconfig.logger
 
@@ -64,7 +66,8 @@ class BaseDiffer(object):
         return self.logger
 
     @asyncio.coroutine
-    def diff_cols(self,old_db_col_names, new_db_col_names, batch_size=100000, steps=["count","content","mapping"], mode=None, exclude=[]):
+    def diff_cols(self,old_db_col_names, new_db_col_names, batch_size=100000, steps=["count","content","mapping"], mode=None, exclude=[],
+                  fingerprints=False):
         """
         Compare new with old collections and produce diff files. Root keys can be excluded from
         comparison with "exclude" parameter.
@@ -82,6 +85,9 @@ class BaseDiffer(object):
                'content' will perform diff on actual content.
                'mapping' will perform diff on ES mappings (if target collection involved)
         mode: 'purge' will remove any existing files for this comparison.
+        fingerprints: if True (MongoDB collections only), documents' fingerprints (see
+               biothings.utils.fingerprint) are compared first, and only documents with different
+               fingerprints are diffed. Missing fingerprints are computed and stored.
         """
         new = create_backend(new_db_col_names)
         old = create_backend(old_db_col_names)
@@ -117,7 +123,9 @@ class BaseDiffer(object):
                         "exclude": exclude,
                         "steps": steps,
                         "mode": mode,
-                        "batch_size": batch_size
+                        "batch_size": batch_size,
+                        "fingerprints": fingerprints,
+                        "file_format": getattr(btconfig,"DIFF_FILE_FORMAT","btdiff")
                         }
                     },
                 "old": {
@@ -227,6 +235,34 @@ class BaseDiffer(object):
             yield from tasks
             self.logger.info("Finished counting keys in the new collection: %s" % diff_stats["root_keys"])
 
+        if "content" in steps and fingerprints:
+            if not (isinstance(old,DocMongoBackend) and isinstance(new,DocMongoBackend)):
+                self.logger.warning("Fingerprints are only supported for MongoDB collections, ignored")
+                fingerprints = False
+            elif exclude:
+                self.logger.warning("Fingerprints are computed on whole documents, ignored as 'exclude' is set")
+                fingerprints = False
+        if "content" in steps and fingerprints:
+            for (backend,db_col_names) in [(old,old_db_col_names),(new,new_db_col_names)]:
+                if has_fingerprints(backend.target_collection):
+                    self.logger.info("Found fingerprints for '%s'" % backend.target_name)
+                    continue
+                self.logger.info("Computing fingerprints for '%s'" % backend.target_name)
+                pinfo = {"category" : "diff",
+                         "source" : "%s vs %s" % (new.target_name,old.target_name),
+                         "step" : "fingerprints: %s" % backend.target_name,
+                         "description" : ""}
+                jobs = []
+                cnt = 0
+                for ids in id_feeder(backend, batch_size=batch_size):
+                    cnt += 1
+                    pinfo["description"] = "batch #%s" % cnt
+                    job = yield from self.job_manager.defer_to_process(pinfo,
+                            partial(fingerprint_worker, ids, db_col_names))
+                    jobs.append(job)
+                res = yield from asyncio.gather(*jobs)
+                self.logger.info("%d fingerprints stored for '%s'" % (sum(res),backend.target_name))
+
         if "content" in steps:
             skip = 0
             cnt = 0
@@ -235,46 +271,77 @@ class BaseDiffer(object):
                      "source" : "%s vs %s" % (new.target_name,old.target_name),
                      "step" : "content: new vs old",
                      "description" : ""}
-            data_new = id_feeder(new, batch_size=batch_size)
             selfcontained = "selfcontained" in self.diff_type
-            for id_list_new in data_new:
-                cnt += 1
-                pinfo["description"] = "batch #%s" % cnt
-                def diffed(f):
-                    res = f.result()
-                    diff_stats["update"] += res["update"]
-                    diff_stats["add"] += res["add"]
-                    if res.get("diff_file"):
-                        metadata["diff"]["files"].append(res["diff_file"])
-                    self.logger.info("(Updated: {}, Added: {})".format(res["update"], res["add"]))
-                self.logger.info("Creating diff worker for batch #%s" % cnt)
-                job = yield from self.job_manager.defer_to_process(pinfo,
-                        partial(diff_worker_new_vs_old, id_list_new, old_db_col_names,
-                                new_db_col_names, cnt , diff_folder, self.diff_func, exclude, selfcontained))
-                job.add_done_callback(diffed)
-                jobs.append(job)
-            yield from asyncio.gather(*jobs)
-            self.logger.info("Finished calculating diff for the new collection. Total number of docs updated: {}, added: {}".format(diff_stats["update"], diff_stats["add"]))
-
-            data_old = id_feeder(old, batch_size=batch_size)
-            jobs = []
-            pinfo["step"] = "content: old vs new"
-            for id_list_old in data_old:
-                cnt += 1
-                pinfo["description"] = "batch #%s" % cnt
-                def diffed(f):
-                    res = f.result()
-                    diff_stats["delete"] += res["delete"]
-                    if res.get("diff_file"):
-                        metadata["diff"]["files"].append(res["diff_file"])
-                    self.logger.info("(Deleted: {})".format(res["delete"]))
-                self.logger.info("Creating diff worker for batch #%s" % cnt)
-                job = yield from self.job_manager.defer_to_process(pinfo,
-                        partial(diff_worker_old_vs_new, id_list_old, new_db_col_names, cnt , diff_folder))
-                job.add_done_callback(diffed)
-                jobs.append(job)
-            yield from asyncio.gather(*jobs)
-            self.logger.info("Finished calculating diff for the old collection. Total number of docs deleted: {}".format(diff_stats["delete"]))
+            if isinstance(old,DocMongoBackend) and isinstance(new,DocMongoBackend):
+                # _ids can be fetched sorted from both collections: added, deleted and
+                # common _ids are found in one pass, only common ones need to be compared
+                pinfo["step"] = "content: merge-join"
+                id_batches = merge_join_ids(sorted_id_feeder(old, batch_size=batch_size, logger=self.logger),
+                                            sorted_id_feeder(new, batch_size=batch_size, logger=self.logger),
+                                            batch_size=batch_size)
+                for id_batch in id_batches:
+                    yield from asyncio.sleep(0.0)
+                    cnt += 1
+                    pinfo["description"] = "batch #%s" % cnt
+                    def diffed(f):
+                        res = f.result()
+                        diff_stats["update"] += res["update"]
+                        diff_stats["add"] += res["add"]
+                        diff_stats["delete"] += res["delete"]
+                        if res.get("diff_file"):
+                            metadata["diff"]["files"].append(res["diff_file"])
+                        self.logger.info("(Updated: {}, Added: {}, Deleted: {})".format(res["update"], res["add"], res["delete"]))
+                    self.logger.info("Creating diff worker for batch #%s" % cnt)
+                    job = yield from self.job_manager.defer_to_process(pinfo,
+                            partial(diff_worker_merge_join, id_batch, old_db_col_names,
+                                    new_db_col_names, cnt , diff_folder, self.diff_func, exclude, selfcontained,
+                                    fingerprints))
+                    job.add_done_callback(diffed)
+                    jobs.append(job)
+                yield from asyncio.gather(*jobs)
+                self.logger.info("Finished calculating diff. Total number of docs updated: {}, added: {}, deleted: {}".format(
+                    diff_stats["update"], diff_stats["add"], diff_stats["delete"]))
+            else:
+                data_new = id_feeder(new, batch_size=batch_size)
+                for id_list_new in data_new:
+                    cnt += 1
+                    pinfo["description"] = "batch #%s" % cnt
+                    def diffed(f):
+                        res = f.result()
+                        diff_stats["update"] += res["update"]
+                        diff_stats["add"] += res["add"]
+                        if res.get("diff_file"):
+                            metadata["diff"]["files"].append(res["diff_file"])
+                        self.logger.info("(Updated: {}, Added: {})".format(res["update"], res["add"]))
+                    self.logger.info("Creating diff worker for batch #%s" % cnt)
+                    job = yield from self.job_manager.defer_to_process(pinfo,
+                            partial(diff_worker_new_vs_old, id_list_new, old_db_col_names,
+                                    new_db_col_names, cnt , diff_folder, self.diff_func, exclude, selfcontained,
+                                    fingerprints))
+                    job.add_done_callback(diffed)
+                    jobs.append(job)
+                yield from asyncio.gather(*jobs)
+                self.logger.info("Finished calculating diff for the new collection. Total number of docs updated: {}, added: {}".format(diff_stats["update"], diff_stats["add"]))
+
+                data_old = id_feeder(old, batch_size=batch_size)
+                jobs = []
+                pinfo["step"] = "content: old vs new"
+                for id_list_old in data_old:
+                    cnt += 1
+                    pinfo["description"] = "batch #%s" % cnt
+                    def diffed(f):
+                        res = f.result()
+                        diff_stats["delete"] += res["delete"]
+                        if res.get("diff_file"):
+                            metadata["diff"]["files"].append(res["diff_file"])
+                        self.logger.info("(Deleted: {})".format(res["delete"]))
+                    self.logger.info("Creating diff worker for batch #%s" % cnt)
+                    job = yield from self.job_manager.defer_to_process(pinfo,
+                            partial(diff_worker_old_vs_new, id_list_old, new_db_col_names, cnt , diff_folder))
+                    job.add_done_callback(diffed)
+                    jobs.append(job)
+                yield from asyncio.gather(*jobs)
+                self.logger.info("Finished calculating diff for the old collection. Total number of docs deleted: {}".format(diff_stats["delete"]))
 
         self.logger.info("Summary: (Updated: {}, Added: {}, Deleted: {}, Mapping changed: {})".format(
             diff_stats["update"], diff_stats["add"], diff_stats["delete"], diff_stats["mapping_changed"]))
@@ -285,9 +352,11 @@ class BaseDiffer(object):
         self.logger.info("success %s" % strargs,extra={"notify":True})
         return diff_stats
 
-    def diff(self,old_db_col_names, new_db_col_names, batch_size=100000, steps=["count","content","mapping"], mode=None, exclude=[]):
+    def diff(self,old_db_col_names, new_db_col_names, batch_size=100000, steps=["count","content","mapping"], mode=None, exclude=[],
+             fingerprints=False):
         """wrapper over diff_cols() coroutine, return a task"""
-        job = asyncio.ensure_future(self.diff_cols(old_db_col_names, new_db_col_names, batch_size, steps, mode, exclude))
+        job = asyncio.ensure_future(self.diff_cols(old_db_col_names, new_db_col_names, batch_size, steps, mode, exclude,
+                                                   fingerprints))
         return job
 
 
@@ -303,17 +372,36 @@ class SelfContainedJsonDiffer(JsonDiffer):
     diff_type = "jsondiff-selfcontained"
 
 
+def dump_diff(diff, diff_folder, batch_num):
+    """
+    Write diff in diff_folder, as a ".btdiff" stream or a ".pyobj" file
+    depending on DIFF_FILE_FORMAT ("btdiff" by default), and return diff file
+    information stored in metadata
+    """
+    if getattr(btconfig,"DIFF_FILE_FORMAT","btdiff") == "pyobj":
+        file_name = os.path.join(diff_folder,"%s.pyobj" % str(batch_num))
+        dump(diff, file_name)
+    else:
+        file_name = os.path.join(diff_folder,"%s%s" % (batch_num,diffstream.EXTENSION))
+        diffstream.write_diff(diff, file_name, compression=getattr(btconfig,"DIFF_FILE_COMPRESSION",None))
+    # compute md5 so when downloaded, users can check integreity
+    md5 = md5sum(file_name)
+    return {"name" : os.path.basename(file_name),
+            "md5sum" : md5}
+
 def diff_worker_new_vs_old(id_list_new, old_db_col_names, new_db_col_names,
-                           batch_num, diff_folder, diff_func, exclude=[], selfcontained=False):
+                           batch_num, diff_folder, diff_func, exclude=[], selfcontained=False,
+                           fingerprints=False):
     new = create_backend(new_db_col_names)
     old = create_backend(old_db_col_names)
     docs_common = old.mget_from_ids(id_list_new)
     ids_common = [_doc['_id'] for _doc in docs_common]
     id_in_new = list(set(id_list_new) - set(ids_common))
     _updates = []
+    if fingerprints and len(ids_common) > 0:
+        ids_common = changed_ids(old.target_collection, new.target_collection, ids_common)
     if len(ids_common) > 0:
         _updates = diff_func(old, new, list(ids_common), exclude_attrs=exclude)
-    file_name = os.path.join(diff_folder,"%s.pyobj" % str(batch_num))
     _result = {'add': id_in_new,
                'update': _updates,
                'delete': [],
@@ -323,13 +411,36 @@ def diff_worker_new_vs_old(id_list_new, old_db_col_names, new_db_col_names,
         _result["add"] = new.mget_from_ids(id_in_new)
     summary = {"add" : len(id_in_new), "update" : len(_updates), "delete" : 0}
     if len(_updates) != 0 or len(id_in_new) != 0:
-        dump(_result, file_name)
-        # compute md5 so when downloaded, users can check integreity
-        md5 = md5sum(file_name)
-        summary["diff_file"] = {
-                "name" : os.path.basename(file_name),
-                "md5sum" : md5
-                }
+        summary["diff_file"] = dump_diff(_result, diff_folder, batch_num)
+
+    return summary
+
+def diff_worker_merge_join(id_batch, old_db_col_names, new_db_col_names,
+                           batch_num, diff_folder, diff_func, exclude=[], selfcontained=False,
+                           fingerprints=False):
+    """
+    Diff worker for a batch of _ids produced by merge_join_ids(): added and
+    deleted _ids are already known, only common _ids are compared (only the
+    ones with different fingerprints if "fingerprints" is True).
+    """
+    new = create_backend(new_db_col_names)
+    old = create_backend(old_db_col_names)
+    _updates = []
+    ids_common = id_batch["common"]
+    if fingerprints and len(ids_common) > 0:
+        ids_common = changed_ids(old.target_collection, new.target_collection, ids_common)
+    if len(ids_common) > 0:
+        _updates = diff_func(old, new, ids_common, exclude_attrs=exclude)
+    _result = {'add': id_batch["add"],
+               'update': _updates,
+               'delete': id_batch["delete"],
+               'source': new.target_name,
+               'timestamp': get_timestamp()}
+    if selfcontained:
+        _result["add"] = new.mget_from_ids(id_batch["add"])
+    summary = {"add" : len(id_batch["add"]), "update" : len(_updates), "delete" : len(id_batch["delete"])}
+    if len(_updates) != 0 or len(id_batch["add"]) != 0 or len(id_batch["delete"]) != 0:
+        summary["diff_file"] = dump_diff(_result, diff_folder, batch_num)
 
     return summary
 
@@ -338,7 +449,6 @@ def diff_worker_old_vs_new(id_list_old, new_db_col_names, batch_num, diff_folder
     docs_common = new.mget_from_ids(id_list_old)
     ids_common = [_doc['_id'] for _doc in docs_common]
     id_in_old = list(set(id_list_old)-set(ids_common))
-    file_name = os.path.join(diff_folder,"%s.pyobj" % str(batch_num))
     _result = {'delete': id_in_old,
                'add': [],
                'update': [],
@@ -346,17 +456,16 @@ def diff_worker_old_vs_new(id_list_old, new_db_col_names, batch_num, diff_folder
                'timestamp': get_timestamp()}
     summary = {"add" : 0, "update": 0, "delete" : len(id_in_old)}
     if len(id_in_old) != 0:
-        dump(_result, file_name)
-        # compute md5 so when downloaded, users can check integreity
-        md5 = md5sum(file_name)
-        summary["diff_file"] = {
-                "name" : os.path.basename(file_name),
-                "md5sum" : md5
-                }
+        summary["diff_file"] = dump_diff(_result, diff_folder, batch_num)
 
     return summary
 
 
+def fingerprint_worker(id_list, db_col_names):
+    col = create_backend(db_col_names)
+    return store_fingerprints(col.target_collection, id_list)
+
+
 def diff_worker_count(id_list, db_col_names, batch_num):
     col = create_backend(db_col_names)
     docs = col.mget_from_ids(id_list)
@@ -427,6 +536,7 @@ class DiffReportTxt(DiffReportRendererBase):
             txt += "Batch size: %s\n" % report["metadata"]["diff"]["info"].get("batch_size")
             txt += "Steps: %s\n" % report["metadata"]["diff"]["info"].get("steps")
             txt += "Key(s) excluded: %s\n" % report["metadata"]["diff"]["info"].get("exclude")
+            txt += "Diff file format: %s\n" % report["metadata"]["diff"]["info"].get("file_format","pyobj")
             txt += "Diff generated on: %s\n" % report["metadata"]["diff"]["info"].get("generated_on")
         else:
             txt+= "No metadata found in report\n"
@@ -528,13 +638,15 @@ class DifferManager(BaseManager):
         pclass = BaseManager.__getitem__(self,diff_type)
         return pclass()
 
-    def diff(self, diff_type, old_db_col_names, new_db_col_names, batch_size=100000, steps=["count","content","mapping"], mode=None, exclude=[]):
+    def diff(self, diff_type, old_db_col_names, new_db_col_names, batch_size=100000, steps=["count","content","mapping"], mode=None, exclude=[],
+             fingerprints=False):
         """
         Run a diff to compare old vs. new collections. using differ algorithm diff_type. Results are stored in
         a diff folder.
         Steps can be passed to choose what to do:
         - count: will count root keys in new collections and stores them as statistics.
         - content: will diff the content between old and new. Results (diff files) format depends on diff_type
+        If fingerprints is True, only documents with different content fingerprints are diffed.
         """
         try:
             differ = self[diff_type]
@@ -542,7 +654,8 @@ class DifferManager(BaseManager):
                               batch_size=batch_size,
                               steps=steps,
                               mode=mode,
-                              exclude=exclude)
+                              exclude=exclude,
+                              fingerprints=fingerprints)
             return job
         except KeyError as e:
             raise DifferException("No such differ '%s' (error: %s)" % (diff_type,e))
@@ -618,52 +731,53 @@ class DifferManager(BaseManager):
                 raise Exception("Can't perform detailed analysis without a metadata file")
 
         def analyze(diff_file, detailed):
-            data = loadobj(diff_file)
-            sources[data["source"]] = 1
+            header = diffstream.read_header(diff_file)
+            sources[header["source"]] = 1
             if detailed:
                 # TODO: if self-contained, no db connection needed
                 new_col = create_backend(metadata["new"]["backend"])
                 old_col = create_backend(metadata["old"]["backend"])
-            if len(adds) < max_reported_ids:
-                if detailed:
-                    # look for which root keys were added in new collection
-                    for _id in data["add"]:
+            # diff operations are streamed from file
+            for (op,val) in diffstream.iter_diff(diff_file):
+                if op == "add":
+                    if len(adds) < max_reported_ids:
                         # selfcontained = dict for whole doc (see TODO above)
-                        if type(_id) == dict:
-                            _id = _id["_id"]
-                        doc = new_col.get_from_id(_id)
-                        rkeys = sorted(doc.keys())
-                        adds["ids"].append([_id,rkeys])
+                        _id = val["_id"] if type(val) == dict else val
+                        if detailed:
+                            # look for which root keys were added in new collection
+                            doc = new_col.get_from_id(_id)
+                            rkeys = sorted(doc.keys())
+                            adds["ids"].append([_id,rkeys])
+                        else:
+                            adds["ids"].append(_id)
+                    adds["count"] += 1
+                elif op == "delete":
+                    if len(dels) < max_reported_ids:
+                        if detailed:
+                            # look for which root keys were deleted in old collection
+                            doc = old_col.get_from_id(val)
+                            rkeys = sorted(doc.keys())
+                            dels["ids"].append([val,rkeys])
+                        else:
+                            dels["ids"].append(val)
+                    dels["count"] += 1
                 else:
-                    if data["add"] and type(data["add"][0]) == dict:
-                        adds["ids"].extend([d["_id"] for d in data["add"]])
-                    else:
-                        adds["ids"].extend(data["add"])
-            adds["count"] += len(data["add"])
-            if len(dels) < max_reported_ids:
-                if detailed:
-                    # look for which root keys were deleted in old collection
-                    for _id in data["delete"]:
-                        doc = old_col.get_from_id(_id)
-                        rkeys = sorted(doc.keys())
-                        dels["ids"].append([_id,rkeys])
-                else:
-                    dels["ids"].extend(data["delete"])
-            dels["count"] += len(data["delete"])
-            for up in data["update"]:
-                for patch in up["patch"]:
-                    update_details[patch["op"]].setdefault(patch["path"],{"count": 0, "ids": []})
-                    if len(update_details[patch["op"]][patch["path"]]["ids"]) < max_reported_ids:
-                        update_details[patch["op"]][patch["path"]]["ids"].append(up["_id"])
-                    update_details[patch["op"]][patch["path"]]["count"] += 1
-            update_details["count"] += len(data["update"])
+                    for patch in val["patch"]:
+                        update_details[patch["op"]].setdefault(patch["path"],{"count": 0, "ids": []})
+                        if len(update_details[patch["op"]][patch["path"]]["ids"]) < max_reported_ids:
+                            update_details[patch["op"]][patch["path"]]["ids"].append(val["_id"])
+                        update_details[patch["op"]][patch["path"]]["count"] += 1
+                    update_details["count"] += 1
 
             assert len(sources) == 1, "Should have one datasource from diff files, got: %s" % [s for s in sources]
 
         # we randomize files order b/c we randomly pick some examples from those
         # files. If files contains data in order (like chrom 1, then chrom 2)
         # we won't have a representative sample
-        files = glob.glob(os.path.join(data_folder,"*.pyobj"))
+        files = glob.glob(os.path.join(data_folder,"*.pyobj")) + \
+                glob.glob(os.path.join(data_folder,"*%s" % diffstream.EXTENSION))
+        # mapping diff isn't a content diff file
+        files = [f for f in files if os.path.basename(f) != "mapping.pyobj"]
         random.shuffle(files)
         for f in files:
             logging.info("Running report worker for '%s'" % f)
@@ -674,23 +788,16 @@ class DifferManager(BaseManager):
 
     def reset_synced(self,diff_folder,backend=None):
         """
-        Remove "synced" flag from any pyobj file in diff_folder
+        Remove "synced" flag from any diff file in diff_folder
         """
-        diff_files = glob.glob(os.path.join(diff_folder,"*.pyobj"))
+        diff_files = glob.glob(os.path.join(diff_folder,"*.pyobj")) + \
+                     glob.glob(os.path.join(diff_folder,"*%s" % diffstream.EXTENSION))
         for diff in diff_files:
-            pyobj = loadobj(diff)
-            try:
-                if pyobj.get("synced"):
-                    if backend:
-                        self.logger.info("Removing synced flag from '%s' for backend '%s'" % (diff,backend))
-                        pyobj["synced"].pop(backend,None)
-                    else:
-                        self.logger.info("Removing synced flag from '%s'" % diff)
-                        pyobj.pop("synced")
-                    dump(pyobj,diff)
-            except AttributeError:
-                # pyobj not a dict
-                continue
+            if diffstream.reset_synced(diff,backend):
+                if backend:
+                    self.logger.info("Removed synced flag from '%s' for backend '%s'" % (diff,backend))
+                else:
+                    self.logger.info("Removed synced flag from '%s'" % diff)
 
     def upload_diff(self, old_db_col_names=None, new_db_col_names=None, diff_folder=None, steps=["reset","upload","meta"]):
         # check what to do
@@ -717,7 +824,7 @@ class DifferManager(BaseManager):
                 # first we need to reset "synced" flag in diff files to make
                 # sure all of them will be applied by client
                 pinfo["step"] = "reset synced"
-                self.logger.info("Resetting 'synced' flag in pyobj files located in folder '%s'" % diff_folder)
+                self.logger.info("Resetting 'synced' flag in diff files located in folder '%s'" % diff_folder)
                 job = yield from self.job_manager.defer_to_thread(pinfo,partial(self.reset_synced,diff_folder))
                 yield from job
                 jobs.append(job)
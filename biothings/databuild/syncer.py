@@ -11,16 +11,18 @@ from functools import partial
 from elasticsearch.helpers import BulkIndexError
 from elasticsearch.exceptions import NotFoundError, ConflictError
 
-from biothings.utils.common import timesofar, iter_n, loadobj, dump
+from biothings.utils.common import timesofar, iter_n, loadobj
 from biothings.utils.mongo import doc_feeder, get_target_db, get_src_build, invalidate_cache
 from biothings.utils.loggers import get_logger, HipchatHandler
 from biothings import config as btconfig
 from biothings.utils.manager import BaseManager, ManagerError
 from biothings.databuild.backend import create_backend
 from biothings.dataload.storage import UpsertStorage
-from biothings.utils.es import ESIndexer
+from biothings.utils.es import ESIndexer, patch_to_script
 import biothings.utils.jsonpatch as jsonpatch
 from biothings.utils.diff import generate_diff_folder
+from biothings.utils.fingerprint import drop_fingerprints
+import biothings.utils.diffstream as diffstream
 
 logging = btconfig.logger
 
@@ -228,84 +230,105 @@ class ESJsonDiffSelfContainedSyncer(BaseSyncer):
     target_backend = "es"
 
 
-# TODO: refactor workers (see sync_es_...)
 def sync_mongo_jsondiff_worker(diff_file, old_db_col_names, new_db_col_names, batch_size, cnt,
         force=False, selfcontained=False, metadata={}):
     """Worker to sync data between a new and an old mongo collection"""
     new = create_backend(new_db_col_names)
     old = create_backend(old_db_col_names)
     storage = UpsertStorage(get_target_db(),old.target_collection.name,logging)
-    diff = loadobj(diff_file)
+    header = diffstream.read_header(diff_file)
     res = {"added": 0, "updated": 0, "deleted": 0, "skipped": 0}
     # check if diff files was already synced
-    if not force and diff.get("synced",{}).get("mongo") == True:
+    if not force and diffstream.is_synced(diff_file,"mongo"):
         logging.info("Diff file '%s' already synced, skip it" % diff_file)
-        res["skipped"] += len(diff["add"]) + len(diff["delete"]) + len(diff["update"])
+        res["skipped"] += sum(header["count"].values())
         return res
-    assert new.target_collection.name == diff["source"], "Source is different in diff file '%s': %s" % (diff_file,diff["source"])
-
-    # add: get ids from "new" 
-    if selfcontained:
-        # diff["add"] contains all documents, not mongo needed
-        for docs in iter_n(diff["add"],batch_size):
-            res["added"] += storage.process((d for d in docs),batch_size)
-    else:
-        cur = doc_feeder(new.target_collection, step=batch_size, inbatch=False, query={'_id': {'$in': diff["add"]}})
-        for docs in iter_n(cur,batch_size):
-            # use generator otherwise process/doc_iterator will require a dict (that's bad...)
-            res["added"] += storage.process((d for d in docs),batch_size)
-
-    # update: get doc from "old" and apply diff
-    batch = []
-    for patch_info in diff["update"]:
-        doc = old.get_from_id(patch_info["_id"])
-        try:
-            doc = jsonpatch.apply_patch(doc,patch_info["patch"])
-            batch.append(doc)
-        except jsonpatch.JsonPatchConflict:
-            # assuming already applieda
-            res["skipped"] += 1
-            continue
-        if len(batch) >= batch_size:
+    assert new.target_collection.name == header["source"], "Source is different in diff file '%s': %s" % (diff_file,header["source"])
+
+    def add(ids):
+        # add: get ids from "new"
+        if selfcontained:
+            # ids are actually whole documents, no mongo needed
+            docs = ids
+        else:
+            docs = doc_feeder(new.target_collection, step=batch_size, inbatch=False, query={'_id': {'$in': ids}})
+        # use generator otherwise process/doc_iterator will require a dict (that's bad...)
+        res["added"] += storage.process((d for d in docs),batch_size)
+
+    def update(patches):
+        # update: get docs from "old" (one query for the whole batch) and apply diff
+        t0 = time.time()
+        docs = dict([(d["_id"],d) for d in old.mget_from_ids([p["_id"] for p in patches],asiter=True)])
+        fetch_time = time.time() - t0
+        docs_patches = []
+        for patch_info in patches:
+            doc = docs.pop(patch_info["_id"],None)
+            if doc is None:
+                logging.warning("Can't find document '%s' to patch in '%s', skip it" % \
+                        (patch_info["_id"],old.target_collection.name))
+                res["skipped"] += 1
+                continue
+            docs_patches.append((doc,patch_info["patch"]))
+        # docs were just fetched, no need to work on copies
+        batch, conflicts, stats = jsonpatch.apply_patches(docs_patches)
+        # assuming already applied
+        res["skipped"] += len(conflicts)
+        logging.info("Patched %s documents (%s operations) from '%s': fetch %.2fs, compile %.2fs, apply %.2fs" % \
+                (stats["docs"],stats["operations"],diff_file,fetch_time,stats["compile_time"],stats["apply_time"]))
+        if batch:
             res["updated"] += storage.process((d for d in batch),batch_size)
-            batch = []
-    if batch:
-        res["updated"] += storage.process((d for d in batch),batch_size)
 
-    # delete: remove from "old"
-    for ids in iter_n(diff["delete"],batch_size):
+    def delete(ids):
+        # delete: remove from "old"
         res["deleted"] += old.remove_from_ids(ids)
 
+    # diff operations are read from the file as they're applied, by batch
+    actions = {"add": add, "update": update, "delete": delete}
+    for (op,batch) in diffstream.iter_diff_batches(diff_file,batch_size):
+        actions[op](batch)
+
     # we potentially modified the "old" collection so invalidate cache just to make sure
     invalidate_cache(old.target_collection.name,"target")
+    # same for documents' fingerprints, collection's timestamp didn't change
+    drop_fingerprints(old.target_collection)
     logging.info("Done applying diff from file '%s': %s" % (diff_file,res))
-    diff.setdefault("synced",{}).setdefault("mongo",True)
-    dump(diff,diff_file)
+    diffstream.mark_synced(diff_file,"mongo")
     return res
 
 
+def is_script_error(error):
+    """Return True if ES error (from a bulk item) was raised while running an update script"""
+    while isinstance(error,dict):
+        if error.get("type") in ("script_exception","illegal_argument_exception"):
+            return True
+        error = error.get("caused_by")
+    return False
+
+
 def sync_es_jsondiff_worker(diff_file, es_config, new_db_col_names, batch_size, cnt,
         force=False, selfcontained=False, metadata={}):
     """Worker to sync data between a new mongo collection and an elasticsearch index"""
     new = create_backend(new_db_col_names) # mongo collection to sync from
     indexer = create_backend(es_config).target_esidxer
-    diff = loadobj(diff_file)
+    header = diffstream.read_header(diff_file)
     res = {"added": 0, "updated": 0, "deleted": 0, "skipped": 0}
     # check if diff files was already synced
-    if not force and diff.get("synced",{}).get("es") == True:
+    if not force and diffstream.is_synced(diff_file,"es"):
         logging.info("Diff file '%s' already synced, skip it" % diff_file)
-        res["skipped"] += len(diff["add"]) + len(diff["delete"]) + len(diff["update"])
+        res["skipped"] += sum(header["count"].values())
         return res
-    assert new.target_collection.name == diff["source"], "Source is different in diff file '%s': %s" % (diff_file,diff["source"])
+    assert new.target_collection.name == header["source"], "Source is different in diff file '%s': %s" % (diff_file,header["source"])
 
+    # translate patches to partial updates instead of reindexing whole docs
+    partial_updates = getattr(btconfig,"ES_SYNC_PARTIAL_UPDATES",False)
     errors = []
-    # add: get ids from "new" 
-    if selfcontained:
-        # diff["add"] contains all documents, no mongo needed
-        cur = diff["add"]
-    else:
-        cur = doc_feeder(new.target_collection, step=batch_size, inbatch=False, query={'_id': {'$in': diff["add"]}})
-    for docs in iter_n(cur,batch_size):
+    def add(ids):
+        # add: get ids from "new"
+        if selfcontained:
+            # ids are actually whole documents, no mongo needed
+            docs = ids
+        else:
+            docs = list(doc_feeder(new.target_collection, step=batch_size, inbatch=False, query={'_id': {'$in': ids}}))
         try:
             res["added"] += indexer.index_bulk(docs,batch_size,action="create")[0]
         except BulkIndexError:
@@ -324,38 +347,68 @@ def sync_es_jsondiff_worker(diff_file, es_config, new_db_col_names, batch_size,
                     pickle.dump(errors,open("errors","wb"))
                     raise
 
-    # update: get doc from indexer and apply diff
-    batch = []
-    ids = [p["_id"] for p in diff["update"]]
-    for i,doc in enumerate(indexer.get_docs(ids)):
-        try:
-            patch_info = diff["update"][i] # same order as what's return by get_doc()...
-            assert patch_info["_id"] == doc["_id"] # ... but just make sure
-            newdoc = jsonpatch.apply_patch(doc,patch_info["patch"])
-            if newdoc == doc:
-                # already applied
+    def update(patches):
+        if partial_updates:
+            # send patches as update scripts when possible, so ES updates docs in place
+            scripts = []
+            full_patches = []
+            for patch_info in patches:
+                script = patch_to_script(patch_info["patch"])
+                if script is None:
+                    full_patches.append(patch_info)
+                else:
+                    scripts.append({"_id" : patch_info["_id"], "script" : script})
+            if scripts:
+                updated, script_errors = indexer.update_docs(scripts,step=batch_size,script=True,raise_on_error=False)
+                res["updated"] += updated
+                patches_by_id = dict([(p["_id"],p) for p in patches])
+                for error in script_errors:
+                    info = error["update"]
+                    if info.get("status") == 404:
+                        # document not in index
+                        res["skipped"] += 1
+                    elif info.get("status") == 400 and is_script_error(info.get("error")):
+                        # patch couldn't be applied by the script (already applied, missing
+                        # intermediate path, ...): like a conflict, let whole doc patching decide
+                        full_patches.append(patches_by_id[info["_id"]])
+                    else:
+                        raise SyncerException("Failed to update document '%s' from file '%s': %s" % \
+                                (info.get("_id"),diff_file,info.get("error")))
+            # other patches require whole docs (list elements in patch, script errors)
+            patches = full_patches
+            if not patches:
+                return
+        # update: get doc from indexer and apply diff
+        batch = []
+        patches = dict([(p["_id"],p["patch"]) for p in patches])
+        for doc in indexer.get_docs(list(patches.keys())):
+            try:
+                newdoc = jsonpatch.apply_patch(doc,patches[doc["_id"]])
+                if newdoc == doc:
+                    # already applied
+                    res["skipped"] += 1
+                    continue
+                batch.append(newdoc)
+            except jsonpatch.JsonPatchConflict:
+                # assuming already applieda
                 res["skipped"] += 1
                 continue
-            batch.append(newdoc)
-        except jsonpatch.JsonPatchConflict:
-            # assuming already applieda
-            res["skipped"] += 1
-            continue
-        if len(batch) >= batch_size:
+        if batch:
             res["updated"] += indexer.index_bulk(batch,batch_size)[0]
-            batch = []
-    if batch:
-        res["updated"] += indexer.index_bulk(batch,batch_size)[0]
 
-    # delete: remove from "old"
-    for ids in iter_n(diff["delete"],batch_size):
+    def delete(ids):
+        # delete: remove from "old"
         del_skip = indexer.delete_docs(ids)
         res["deleted"] += del_skip[0]
         res["skipped"] += del_skip[1]
 
+    # diff operations are read from the file as they're applied, by batch
+    actions = {"add": add, "update": update, "delete": delete}
+    for (op,batch) in diffstream.iter_diff_batches(diff_file,batch_size):
+        actions[op](batch)
+
     logging.info("Done applying diff from file '%s': %s" % (diff_file,res))
-    diff.setdefault("synced",{}).setdefault("es",True)
-    dump(diff,diff_file)
+    diffstream.mark_synced(diff_file,"es")
     return res
 
 
@@ -265,7 +265,8 @@ class Indexer(object):
                                  es_host=self.host,
                                  step=batch_size,
                                  number_of_shards=self.num_shards,
-                                 number_of_replicas=self.num_replicas)
+                                 number_of_replicas=self.num_replicas,
+                                 bulk_options=getattr(btconfig,"ES_BULK_OPTIONS",{}))
             # instantiate one here for index creation
             es_idxer = partial_idxer()
             if es_idxer.exists_index():
@@ -308,6 +309,9 @@ class Indexer(object):
                     res = f.result()
                     if type(res) != tuple or type(res[0]) != int:
                         got_error = Exception("Batch #%s failed while indexing collection '%s' [result:%s]" % (batch_num,self.target_name,repr(f.result())))
+                    elif len(res) > 2 and res[2]:
+                        # bulk throughput stats
+                        self.logger.info("Batch #%s indexed: %s" % (batch_num,res[2]))
                 job.add_done_callback(partial(batch_indexed,batch_num=bnum))
                 jobs.append(job)
                 bnum += 1
@@ -324,6 +328,13 @@ class Indexer(object):
                 # compute overall inserted/updated records
                 # returned values looks like [(num,[]),(num,[]),...]
                 cnt = sum([val[0] for val in f.result()])
+                stats = [val[2] for val in f.result() if len(val) > 2 and val[2]]
+                if stats:
+                    total_time = sum([st["time"] for st in stats])
+                    self.logger.info("Bulk indexing: %d docs, %d chunks, %d retries, %d rejected, %.1f docs/s per worker" % \
+                            (sum([st["docs"] for st in stats]),sum([st["chunks"] for st in stats]),
+                             sum([st["retries"] for st in stats]),sum([st["rejected"] for st in stats]),
+                             sum([st["docs"] for st in stats]) / total_time if total_time else 0))
                 self.logger.info("Index '%s' successfully created" % index_name,extra={"notify":True})
             tasks.add_done_callback(done)
             yield from tasks
@@ -1,10 +1,15 @@
 import types, copy, datetime, time
+import os, shutil, tempfile
+import shelve, pickle
+import heapq, itertools
 import logging
+from collections import OrderedDict
 
 import asyncio
 from pymongo.errors import DuplicateKeyError, BulkWriteError
 
 from biothings.utils.common import timesofar, iter_n
+from biothings.utils.dataload import merge_struct
 from biothings.utils.mongo import get_src_db
 
 
@@ -74,50 +79,58 @@ class MergerStorage(BasicStorage):
     Since data is here read line by line, the merge is done while storing
     """
 
+    def insert_merge(self, doc_li, aslistofdict=None):
+        """
+        Insert documents from doc_li, documents already stored with the same _id
+        are merged. Return the number of inserted/merged documents.
+        """
+        nbinsert = 0
+        try:
+            bob = self.temp_collection.initialize_unordered_bulk_op()
+            for d in doc_li:
+                bob.insert(d)
+            res = bob.execute()
+            nbinsert += res["nInserted"]
+        except BulkWriteError as e:
+            inserted = e.details["nInserted"]
+            nbinsert += inserted
+            self.logger.info("Fixing %d records " % len(e.details["writeErrors"]))
+            ids = [d["op"]["_id"] for d in e.details["writeErrors"]]
+            # build hash of existing docs
+            docs = self.temp_collection.find({"_id" : {"$in" : ids}})
+            hdocs = {}
+            for doc in docs:
+                hdocs[doc["_id"]] = doc
+            bob2 = self.temp_collection.initialize_unordered_bulk_op()
+            for err in e.details["writeErrors"]:
+                errdoc = err["op"]
+                existing = hdocs[errdoc["_id"]]
+                assert "_id" in existing
+                _id = errdoc.pop("_id")
+                merged = merge_struct(errdoc, existing,aslistofdict=aslistofdict)
+                bob2.find({"_id" : _id}).update_one({"$set" : merged})
+                # update previously fetched doc. if several errors are about the same doc id,
+                # we would't merged things properly without an updated document
+                assert "_id" in merged
+                hdocs[_id] = merged
+                nbinsert += 1
+
+            res = bob2.execute()
+        return nbinsert
+
     def process(self, doc_d, batch_size):
         self.logger.info("Uploading to the DB...")
         t0 = time.time()
         tinner = time.time()
-        aslistofdict = None
         total = 0
         for doc_li in self.doc_iterator(doc_d, batch=True, batch_size=batch_size):
             toinsert = len(doc_li)
-            nbinsert = 0
             self.logger.info("Inserting %s records ... " % toinsert)
-            try:
-                bob = self.temp_collection.initialize_unordered_bulk_op()
-                for d in doc_li:
-                    aslistofdict = d.pop("__aslistofdict__",None)
-                    bob.insert(d)
-                res = bob.execute()
-                nbinsert += res["nInserted"]
-                self.logger.info("OK [%s]" % timesofar(tinner))
-            except BulkWriteError as e:
-                inserted = e.details["nInserted"]
-                nbinsert += inserted
-                self.logger.info("Fixing %d records " % len(e.details["writeErrors"]))
-                ids = [d["op"]["_id"] for d in e.details["writeErrors"]]
-                # build hash of existing docs
-                docs = self.temp_collection.find({"_id" : {"$in" : ids}})
-                hdocs = {}
-                for doc in docs:
-                    hdocs[doc["_id"]] = doc
-                bob2 = self.temp_collection.initialize_unordered_bulk_op()
-                for err in e.details["writeErrors"]:
-                    errdoc = err["op"]
-                    existing = hdocs[errdoc["_id"]]
-                    assert "_id" in existing
-                    _id = errdoc.pop("_id")
-                    merged = merge_struct(errdoc, existing,aslistofdict=aslistofdict)
-                    bob2.find({"_id" : _id}).update_one({"$set" : merged})
-                    # update previously fetched doc. if several errors are about the same doc id,
-                    # we would't merged things properly without an updated document
-                    assert "_id" in merged
-                    hdocs[_id] = merged
-                    nbinsert += 1
-
-                res = bob2.execute()
-                self.logger.info("OK [%s]" % timesofar(tinner))
+            aslistofdict = None
+            for d in doc_li:
+                aslistofdict = d.pop("__aslistofdict__",None)
+            nbinsert = self.insert_merge(doc_li,aslistofdict)
+            self.logger.info("OK [%s]" % timesofar(tinner))
             assert nbinsert == toinsert, "nb %s to %s" % (nbinsert,toinsert)
             # end of loop so it counts the time spent in doc_iterator
             tinner = time.time()
@@ -130,6 +143,188 @@ class MergerStorage(BasicStorage):
         return total
 
 
+class CoalescingMergerStorage(MergerStorage):
+    """
+    Same as MergerStorage, but documents with the same _id are merged (merge_struct)
+    in memory before being sent to the database: within a batch, and across batches
+    with a buffer holding the "buffer_size" most recently updated documents (older
+    ones are written by batches). If "spill_size" is set, documents leaving the buffer
+    are first moved to a disk store (shelve) holding up to "spill_size" documents, and
+    can still be merged from there. Only duplicates of documents already written reach
+    the database merge path (see MergerStorage).
+    """
+    buffer_size = 100000
+    spill_size = 0
+
+    def __init__(self,*args,**kwargs):
+        super(CoalescingMergerStorage,self).__init__(*args,**kwargs)
+        self.buffer = OrderedDict()
+        self.spilled = OrderedDict()
+        self.spill_store = None
+        self.aslistofdict = None
+
+    def open_spill_store(self):
+        folder = tempfile.mkdtemp(prefix="%s_" % self.temp_collection.name)
+        self.spill_store = shelve.open(os.path.join(folder,"spill"))
+        self.spill_folder = folder
+
+    def close_spill_store(self):
+        if self.spill_store is not None:
+            self.spill_store.close()
+            shutil.rmtree(self.spill_folder,ignore_errors=True)
+            self.spill_store = None
+
+    def add(self, doc):
+        """Add doc to buffer, return documents evicted from buffer (and spill store)"""
+        _id = doc["_id"]
+        if _id in self.buffer:
+            doc = merge_struct(doc,self.buffer.pop(_id),aslistofdict=self.aslistofdict)
+            self.merged += 1
+        elif _id in self.spilled:
+            self.spilled.pop(_id)
+            doc = merge_struct(doc,self.spill_store.pop(repr(_id)),aslistofdict=self.aslistofdict)
+            self.merged += 1
+        self.buffer[_id] = doc
+        evicted = []
+        while len(self.buffer) > self.buffer_size:
+            _id,doc = self.buffer.popitem(last=False)
+            if self.spill_size:
+                if self.spill_store is None:
+                    self.open_spill_store()
+                self.spill_store[repr(_id)] = doc
+                self.spilled[_id] = None
+                if len(self.spilled) > self.spill_size:
+                    _id,_ = self.spilled.popitem(last=False)
+                    evicted.append(self.spill_store.pop(repr(_id)))
+            else:
+                evicted.append(doc)
+        return evicted
+
+    def flush(self, doc_li):
+        if not doc_li:
+            return 0
+        self.logger.info("Inserting %s records ... " % len(doc_li))
+        nbinsert = self.insert_merge(doc_li,self.aslistofdict)
+        assert nbinsert == len(doc_li), "nb %s to %s" % (nbinsert,len(doc_li))
+        return nbinsert
+
+    def process(self, doc_d, batch_size):
+        self.logger.info("Uploading to the DB...")
+        t0 = time.time()
+        tinner = time.time()
+        total = 0
+        self.merged = 0
+        towrite = []
+        try:
+            for doc_li in self.doc_iterator(doc_d, batch=True, batch_size=batch_size):
+                for d in doc_li:
+                    self.aslistofdict = d.pop("__aslistofdict__",None)
+                    towrite.extend(self.add(d))
+                if len(towrite) >= batch_size:
+                    total += self.flush(towrite)
+                    self.logger.info("OK [%s]" % timesofar(tinner))
+                    towrite = []
+                    tinner = time.time()
+            # what's remaining on disk first (oldest), then in memory
+            if self.spill_store is not None:
+                towrite.extend([self.spill_store[repr(_id)] for _id in self.spilled])
+            towrite.extend(self.buffer.values())
+            for doc_li in iter_n(towrite,batch_size):
+                total += self.flush(doc_li)
+        finally:
+            self.buffer.clear()
+            self.spilled.clear()
+            self.close_spill_store()
+        self.logger.info("%d duplicated records merged before writing" % self.merged)
+        self.logger.info('Done[%s]' % timesofar(t0))
+
+        # like MergerStorage, merged records count as processed ones
+        return total + self.merged
+
+
+class ExternalSortStorage(MergerStorage):
+    """
+    Storage for sources which need documents to be grouped by _id (like MergerStorage)
+    but are too big to be grouped in memory. Documents are spilled to sorted
+    (by _id) runs on disk of "run_size" documents, runs are then merged (k-way), and
+    documents with the same _id are merged together (merge_struct, in the order they
+    were produced) before being inserted. Memory usage only depends on run_size.
+    Documents already stored with the same _id (eg. by another upload job) are
+    merged like MergerStorage does. _ids must be comparable to each others (eg. all
+    strings). Runs are stored in a temp folder, within "tmp_folder" if specified.
+    """
+    run_size = 500000
+    tmp_folder = None
+
+    def write_run(self, docs, folder, num):
+        # sorted on _id, then order of production
+        docs.sort(key=lambda e: e[:2])
+        run_file = os.path.join(folder,"run_%05d" % num)
+        with open(run_file,"wb") as fobj:
+            for entry in docs:
+                pickle.dump(entry,fobj,protocol=pickle.HIGHEST_PROTOCOL)
+        return run_file
+
+    def read_run(self, run_file):
+        with open(run_file,"rb") as fobj:
+            while True:
+                try:
+                    yield pickle.load(fobj)
+                except EOFError:
+                    break
+
+    def grouped_docs(self, runs, aslistofdict=None):
+        """Merge sorted runs, yielding documents merged by _id"""
+        merged = heapq.merge(*[self.read_run(run) for run in runs])
+        for _id,entries in itertools.groupby(merged,key=lambda e: e[0]):
+            doc = next(entries)[2]
+            for entry in entries:
+                doc = merge_struct(entry[2],doc,aslistofdict=aslistofdict)
+            yield doc
+
+    def process(self, doc_d, batch_size):
+        self.logger.info("Uploading to the DB...")
+        t0 = time.time()
+        tinner = time.time()
+        total = 0
+        folder = tempfile.mkdtemp(prefix="%s_" % self.temp_collection.name,dir=self.tmp_folder)
+        try:
+            runs = []
+            aslistofdict = None
+            docs = []
+            seq = 0
+            for doc_li in self.doc_iterator(doc_d, batch=True, batch_size=batch_size):
+                for d in doc_li:
+                    aslistofdict = d.pop("__aslistofdict__",None)
+                    docs.append((d["_id"],seq,d))
+                    seq += 1
+                if len(docs) >= self.run_size:
+                    runs.append(self.write_run(docs,folder,len(runs)))
+                    self.logger.info("Sorted run #%d written (%d records) [%s]" % \
+                            (len(runs),len(docs),timesofar(tinner)))
+                    docs = []
+                    tinner = time.time()
+            if docs:
+                runs.append(self.write_run(docs,folder,len(runs)))
+                docs = []
+            self.logger.info("%d records sorted in %d run(s), now merging [%s]" % \
+                    (seq,len(runs),timesofar(t0)))
+            tinner = time.time()
+            for doc_li in iter_n(self.grouped_docs(runs,aslistofdict),batch_size):
+                nbinsert = self.insert_merge(doc_li,aslistofdict)
+                assert nbinsert == len(doc_li), "nb %s to %s" % (nbinsert,len(doc_li))
+                total += nbinsert
+                self.logger.info("Inserted %s records [%s]" % (nbinsert,timesofar(tinner)))
+                tinner = time.time()
+        finally:
+            shutil.rmtree(folder,ignore_errors=True)
+        self.logger.info("%d records merged into %d documents" % (seq,total))
+        self.logger.info('Done[%s]' % timesofar(t0))
+
+        # like MergerStorage, merged records count as processed ones
+        return seq
+
+
 class IgnoreDuplicatedStorage(BasicStorage):
 
     def process(self, iterable, batch_size):
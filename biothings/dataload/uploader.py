@@ -1,4 +1,4 @@
-import time, sys, os, copy
+import time, sys, os, copy, glob
 import datetime, pprint
 import asyncio
 import logging as loggingmod
@@ -7,6 +7,7 @@ from functools import wraps, partial
 from biothings.utils.common import get_timestamp, get_random_string, timesofar, iter_n
 from biothings.utils.mongo import get_src_conn, get_src_dump
 from biothings.utils.dataload import merge_struct
+import biothings.utils.filesplit as filesplit
 from biothings.utils.manager import BaseSourceManager, \
                                     ManagerError, ResourceNotFound
 from .storage import IgnoreDuplicatedStorage, MergerStorage, \
@@ -42,6 +43,27 @@ def upload_worker(name, storage_class, loaddata_func, col_name,
         raise
 
 
+def index_worker(col_name, indexes, background=False):
+    """
+    Create indexes on collection col_name (see BaseSourceUploader.indexes
+    for specs format). Return the list of index names.
+    """
+    col = get_src_conn()[config.DATA_SRC_DATABASE][col_name]
+    names = []
+    for spec in indexes:
+        if isinstance(spec,dict):
+            options = copy.deepcopy(spec)
+            keys = options.pop("keys")
+        else:
+            options = {}
+            keys = spec
+        if isinstance(keys,str):
+            keys = [(keys,1)]
+        options.setdefault("background",background)
+        names.append(col.create_index(keys,**options))
+    return names
+
+
 class DocSourceMaster(dict):
     '''A class to manage various doc data sources.'''
     # TODO: fix this delayed import
@@ -83,6 +105,12 @@ class BaseSourceUploader(object):
 
     keep_archive = 10 # number of archived collection to keep. Oldest get dropped first.
 
+    # indexes created on temp collection before it's switched to the actual
+    # collection, so the collection is indexed as soon as it's used. Each index
+    # is a field name, a list of (field,direction) keys, or a dict with "keys"
+    # and create_index() options, eg. ["symbol",{"keys":[("chrom",1),("pos",1)],"unique":True}]
+    indexes = []
+
     def __init__(self, db_conn_info, data_root, collection_name=None, log_folder=None, *args, **kwargs):
         """db_conn_info is a database connection info tuple (host,port) to fetch/store 
         information about the datasource's state data_root is the root folder containing
@@ -240,6 +268,19 @@ class BaseSourceUploader(object):
         else:
             raise ResourceError("No temp collection (or it's empty)")
 
+    @asyncio.coroutine
+    def build_indexes(self, job_manager, background=False):
+        """
+        Start building indexes declared in self.indexes on temp collection,
+        in a thread. Return the job (future).
+        """
+        pinfo = self.get_pinfo()
+        pinfo["step"] = "index"
+        self.logger.info("Building indexes %s on '%s'" % (self.indexes,self.temp_collection_name))
+        job = yield from job_manager.defer_to_thread(pinfo,
+                partial(index_worker,self.temp_collection_name,self.indexes,background))
+        return job
+
     def post_update_data(self, steps, force, batch_size, job_manager, **kwargs):
         """Override as needed to perform operations after
            data has been uploaded"""
@@ -275,6 +316,9 @@ class BaseSourceUploader(object):
         yield from job
         if got_error:
             raise got_error
+        if self.indexes:
+            job = yield from self.build_indexes(job_manager)
+            yield from job
         self.switch_collection()
 
     def generate_doc_src_master(self):
@@ -488,10 +532,42 @@ class DummySourceUploader(BaseSourceUploader):
 
 class ParallelizedSourceUploader(BaseSourceUploader):
 
+    # indexes (see BaseSourceUploader.indexes) are built in background on temp
+    # collection once only index_overlap upload jobs remain, in parallel with them
+    index_overlap = 1
+
+    # automatic input file splitting (see jobs()): glob pattern (or list of),
+    # relative to data_folder, of files to split in chunks of about split_size
+    # bytes, aligned on records ending with split_record_sep, ignoring
+    # split_header first lines
+    split_files = None
+    split_size = 256 * 1024 * 1024
+    split_record_sep = "\n"
+    split_header = 0
+
     def jobs(self):
         """Return list of (*arguments) passed to self.load_data, in order. for
-        each parallelized jobs. Ex: [(x,1),(y,2),(z,3)]"""
-        raise NotImplementedError("implement me in subclass")
+        each parallelized jobs. Ex: [(x,1),(y,2),(z,3)]
+        If split_files is defined, default implementation splits these files
+        and returns (filename, start, end) byte ranges, load_data(filename, start, end)
+        can then read its part with biothings.utils.filesplit.open_range(filename, start, end)
+        (compressed files are first decompressed in chunks, see biothings.utils.filesplit).
+        Ranges don't contain header lines: load_data must parse them with header=0, eg.
+        tabfile_feeder(open_range(filename, start, end), header=0), as default header=1
+        would drop the first record of every range."""
+        if not self.split_files:
+            raise NotImplementedError("implement me in subclass")
+        patterns = type(self.split_files) == str and [self.split_files] or self.split_files
+        filenames = []
+        for pattern in patterns:
+            filenames.extend(sorted(glob.glob(os.path.join(self.data_folder,pattern))))
+        if not filenames:
+            raise ResourceError("No file to split found in '%s' (%s)" % (self.data_folder,self.split_files))
+        ranges = filesplit.split_files(filenames,self.split_size,
+                                       sep=self.split_record_sep.encode(),header=self.split_header)
+        self.logger.info("Split %d file(s) into %d parts of about %d bytes" % \
+                (len(filenames),len(ranges),self.split_size))
+        return ranges
 
     @asyncio.coroutine
     def update_data(self, batch_size, job_manager=None):
@@ -503,6 +579,11 @@ class ParallelizedSourceUploader(BaseSourceUploader):
         storage_class = copy.deepcopy(self.__class__.storage_class)
         load_data = copy.deepcopy(self.load_data)
         temp_collection_name = copy.deepcopy(self.temp_collection_name)
+        # same for indexes built while last jobs are running
+        indexes = copy.deepcopy(self.indexes)
+        index_overlap = self.index_overlap
+        index_pinfo = self.get_pinfo()
+        index_pinfo["step"] = "index"
         state = self.unprepare()
         # important: within this loop, "self" should never be used to make sure we don't 
         # instantiate unpicklable attributes (via via autoset attributes, see prepare())
@@ -554,9 +635,24 @@ class ParallelizedSourceUploader(BaseSourceUploader):
 
             job.add_done_callback(partial(batch_uploaded,name=fullname,batch_num=bnum))
         if jobs:
-            yield from asyncio.gather(*jobs)
-            if got_error:
-                raise got_error
+            index_job = None
+            pending = set(jobs)
+            while pending:
+                # pending jobs may not be pickled yet, "self" still can't be used here
+                if indexes and index_job is None and len(pending) <= index_overlap:
+                    index_job = yield from job_manager.defer_to_thread(index_pinfo,
+                            partial(index_worker,temp_collection_name,indexes,True))
+                done,pending = yield from asyncio.wait(pending,return_when=asyncio.FIRST_COMPLETED)
+                if got_error:
+                    if index_job:
+                        # don't leave an orphaned index build behind
+                        yield from asyncio.wait([index_job])
+                    raise got_error
+            if self.indexes and index_job is None:
+                index_job = yield from self.build_indexes(job_manager)
+            if index_job:
+                # collection is switched only once indexes are ready
+                yield from index_job
             self.switch_collection()
             self.clean_archived_collections()
 
@@ -0,0 +1,74 @@
+"""
+Benchmark of jsondiff.make() engines: default one, and structural hashing
+(hashed=True), with and without list operations, on variant-like documents
+with long lists of sub-documents and on v2.json/v3.json documents.
+Patches are checked by applying them with jsonpatch.apply_patch().
+
+Usage: python bench_jsondiff.py [number of list elements]
+"""
+import os, sys
+import copy
+import json
+import random
+import timeit
+
+from biothings.utils.jsondiff import make
+from biothings.utils.jsonpatch import apply_patch
+
+ENGINES = [("default", {}),
+           ("default, list ops", {"use_list_ops": True}),
+           ("hashed", {"hashed": True}),
+           ("hashed, list ops", {"hashed": True, "use_list_ops": True}),
+           ("hashed, list ops, rsid key", {"hashed": True, "use_list_ops": True, "list_keys": ["rsid"]})]
+
+
+def make_variant(size=2000, seed=42):
+    ''' Generate a variant-like document, with a long list of sub-documents '''
+    rand = random.Random(seed)
+    return {"_id": "chr1:g.1000A>C",
+            "chrom": "1",
+            "vcf": {"ref": "A", "alt": "C", "position": "1000"},
+            "annotations": [{"rsid": "rs%d" % i,
+                             "gene": {"symbol": "GENE%d" % rand.randint(0, 100), "id": rand.randint(0, 1e6)},
+                             "af": {"all": rand.random(), "afr": rand.random(), "eur": rand.random()},
+                             "clinsig": rand.choice(["benign", "pathogenic", "uncertain"])}
+                            for i in range(size)]}
+
+
+def scenarios(size):
+    old = make_variant(size)
+    # one element added in the middle of the list
+    new = copy.deepcopy(old)
+    new["annotations"].insert(size // 2, {"rsid": "rs_new", "gene": {"symbol": "NEW", "id": 0},
+                                          "af": {"all": 0.5}, "clinsig": "benign"})
+    yield ("1 element added", old, new)
+    # a few fields modified
+    new = copy.deepcopy(old)
+    for i in range(0, size, size // 10 or 1):
+        new["annotations"][i]["af"]["all"] = 0.0
+    yield ("10 elements modified", old, new)
+    # elements removed and added
+    new = copy.deepcopy(old)
+    del new["annotations"][10:20]
+    new["annotations"].append({"rsid": "rs_last", "af": {"all": 0.1}})
+    yield ("10 removed, 1 appended", old, new)
+    folder = os.path.dirname(os.path.abspath(__file__))
+    if os.path.exists(os.path.join(folder, "v2.json")):
+        yield ("v2.json vs v3.json", json.load(open(os.path.join(folder, "v2.json"))),
+               json.load(open(os.path.join(folder, "v3.json"))))
+
+
+def bench(size=2000, number=3):
+    for (name, old, new) in scenarios(size):
+        print(name)
+        for (engine, options) in ENGINES:
+            func = lambda: make(old, new, **options)
+            patch = func()
+            assert apply_patch(old, patch) == new, "Patch from engine '%s' is invalid" % engine
+            timing = min(timeit.repeat(func, number=number, repeat=3))
+            print("  %-28s %10.2f ms %6d ops %10d bytes" % (engine, timing * 1000 / number,
+                                                          len(patch), len(json.dumps(patch))))
+
+
+if __name__ == "__main__":
+    bench(*[int(arg) for arg in sys.argv[1:2]])
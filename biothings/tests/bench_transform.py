@@ -0,0 +1,106 @@
+"""
+Micro-benchmark of ESResultTransformer document flattening (dotfield=true) and
+sorting (default output), against the previous recursive implementation.
+
+Usage: python bench_transform.py [number of runs]
+"""
+import sys
+import random
+import timeit
+from collections import OrderedDict
+
+from biothings.utils.common import is_seq
+from biothings.utils.common import dotdict
+from biothings.www.api.es.transform import ESResultTransformer
+
+
+class RecursiveESResultTransformer(ESResultTransformer):
+    ''' Previous (recursive) implementation, for reference '''
+
+    def _flatten_doc(self, doc, outfield_sep='.', context_sep='.', sort=True):
+        def _recursion_helper(d, ret, path, out):
+            if isinstance(d, dict):
+                for key in d:
+                    new_path_key = key if not path else context_sep.join([path, key])
+                    new_out_key = self._alias_output_keys(new_path_key, key) if not out else outfield_sep.join(
+                                                            [out, self._alias_output_keys(new_path_key, key)])
+                    _recursion_helper(d[key], ret, new_path_key, new_out_key)
+            elif is_seq(d):
+                for obj in d:
+                    _recursion_helper(obj, ret, path, out)
+            else:
+                if out in ret:
+                    if isinstance(ret[out], list):
+                        ret[out].append(d)
+                    else:
+                        ret[out] = [ret[out], d]
+                else:
+                    ret[out] = d
+        ret = {}
+        _recursion_helper(doc, ret, '', '')
+        return OrderedDict([(k,v) for (k,v) in sorted(ret.items(), key=lambda x: x[0])])
+
+    def _sort_and_annotate_doc(self, doc, sort=True, data_src=False, field_sep='.'):
+        def _recursion_helper(doc, path):
+            if is_seq(doc):
+                return [_recursion_helper(_doc, path) for _doc in doc]
+            elif isinstance(doc, dict):
+                if data_src and path in self.data_sources:
+                    doc['@sources'] = self.data_sources[path]['@sources']
+                if sort:
+                    _doc = sorted(doc)
+                else:
+                    _doc = doc.keys()
+                this_list = []
+                for key in _doc:
+                    new_path = key if not path else field_sep.join([path, key])
+                    this_list.append((self._alias_output_keys(new_path, key), _recursion_helper(doc[key], new_path)))
+                if sort:
+                    return OrderedDict(this_list)
+                else:
+                    return dict(this_list)
+            else:
+                return doc
+
+        return _recursion_helper(doc, '')
+
+
+def make_doc(width=8, depth=4, seed=42):
+    ''' Generate a variant-like document, with nested fields and lists of sub-documents '''
+    rand = random.Random(seed)
+    def _make(level):
+        doc = {}
+        for i in range(width):
+            key = "field_%d_%d" % (level, rand.randint(0, 1000))
+            r = rand.random()
+            if level < depth and r < 0.3:
+                doc[key] = _make(level + 1)
+            elif level < depth and r < 0.4:
+                doc[key] = [_make(level + 1) for _ in range(2)]
+            elif r < 0.5:
+                doc[key] = [rand.random() for _ in range(3)]
+            else:
+                doc[key] = rand.choice([rand.random(), rand.randint(0, 1e6), "val%d" % i])
+        return doc
+    return _make(0)
+
+
+def bench(number=200):
+    doc = make_doc()
+    aliases = {"field_0_%d" % i: "alias_%d" % i for i in range(0, 1000, 7)}
+    for (name, options) in [("sort", {'_sorted': True}), ("flatten", {'_sorted': True, 'dotfield': True}),
+                            ("flatten, _sorted=false", {'_sorted': False, 'dotfield': True})]:
+        results = {}
+        for klass in [RecursiveESResultTransformer, ESResultTransformer]:
+            # handlers create a transformer per request
+            func = lambda: klass(options=dotdict(options), host="localhost", output_aliases=aliases
+                                 )._form_doc({'_id': '1', '_source': doc}, score=False)
+            results[klass.__name__] = func()
+            timing = min(timeit.repeat(func, number=number, repeat=3))
+            print("%-24s %-30s %.2f ms/doc" % (name, klass.__name__, timing * 1000 / number))
+        assert results["RecursiveESResultTransformer"] == results["ESResultTransformer"], \
+            "Transformers output differ for '%s'" % name
+
+
+if __name__ == "__main__":
+    bench(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,65 @@
+import os
+import tempfile
+
+from nose.tools import eq_, assert_raises
+import utils.dataload as dataload
+
+
+class FastTabfileTest(object):
+
+    __test__ = True
+
+    def setUp(self):
+        fd, self.datafile = tempfile.mkstemp(suffix=".tsv")
+        os.close(fd)
+
+    def tearDown(self):
+        os.unlink(self.datafile)
+
+    def write(self, content):
+        with open(self.datafile, "w") as fobj:
+            fobj.write(content)
+
+    def test_same_rows(self):
+        for content in ["h\th\na\tb\nd\te\n",
+                        "h\th\na\tb\nd\te\n\n",         # trailing blank line
+                        "h\th\na\tb\n\nd\te\n",         # blank line
+                        "h\th\th\na\tb\nd\te\tf",       # ragged rows
+                        "h\th\th\na\tb\tc\nd\te\n",
+                        "h\th\na\t\"b c\"\nd\te\n"]:
+            self.write(content)
+            for block_size in [3, 1024]:
+                eq_(list(dataload.tabfile_feeder(self.datafile)),
+                    list(dataload.fast_tabfile_feeder(self.datafile, engine="python",
+                                                      block_size=block_size)))
+
+    def test_same_dict(self):
+        for content in ["h\th\th\na\t1\tx\na\t2\ty\nb\t3\tz\n",
+                        "h\th\th\na\t1\tx\na\t2\ty\tw\nb\t3\tz\n",  # ragged rows
+                        "h\th\na\t1\na\t2\nb\t3\n"]:
+            self.write(content)
+            for cols, key in [((0, 1), 0), ((1, 0), 1)]:
+                for alwayslist in [False, True]:
+                    eq_(dataload.tab2dict(self.datafile, cols, key, alwayslist=alwayslist),
+                        dataload.fast_tab2dict(self.datafile, cols, key, alwayslist=alwayslist,
+                                               engine="python"))
+                    eq_(list(dataload.tab2dict_iter(self.datafile, cols, key, alwayslist=alwayslist)),
+                        list(dataload.fast_tab2dict_iter(self.datafile, cols, key, alwayslist=alwayslist,
+                                                         engine="python")))
+
+    def columns(self, **kwargs):
+        # concatenate column batches
+        columns = None
+        for batch in dataload.tabfile_column_feeder(self.datafile, engine="python", **kwargs):
+            columns = columns and [c1 + c2 for c1, c2 in zip(columns, batch)] or batch
+        return columns
+
+    def test_columns(self):
+        # empty rows are skipped
+        self.write("h\th\na\tb\nd\te\n\n")
+        eq_(self.columns(), [["a", "d"], ["b", "e"]])
+        # ragged rows can't be read as columns, except if selected columns exist
+        self.write("h\th\na\tb\nd\te\tf")
+        assert_raises(ValueError, self.columns)
+        eq_(self.columns(cols=(1, 0)), [["b", "e"], ["a", "d"]])
+        assert_raises(ValueError, self.columns, cols=(2,))
@@ -0,0 +1,82 @@
+import os, types
+import shutil, tempfile
+import datetime
+
+from nose.tools import eq_, ok_
+from nose.plugins.skip import SkipTest
+from pymongo import MongoClient
+from pymongo.errors import ConnectionFailure
+
+import biothings
+
+# MongoDB server used for these tests, databases are dropped once done
+MONGO_HOST = os.environ.get("BT_TEST_MONGO_HOST","localhost")
+MONGO_PORT = int(os.environ.get("BT_TEST_MONGO_PORT",27017))
+SRC_DB = "biothings_test_src"
+TARGET_DB = "biothings_test_target"
+
+config = types.ModuleType("test_fingerprint_config")
+config.__file__ = __file__
+config.DATA_SRC_SERVER = config.DATA_TARGET_SERVER = MONGO_HOST
+config.DATA_SRC_PORT = config.DATA_TARGET_PORT = MONGO_PORT
+config.DATA_SRC_SERVER_USERNAME = config.DATA_SRC_SERVER_PASSWORD = None
+config.DATA_TARGET_SERVER_USERNAME = config.DATA_TARGET_SERVER_PASSWORD = None
+config.DATA_SRC_DATABASE = SRC_DB
+config.DATA_TARGET_DATABASE = TARGET_DB
+config.DATA_SRC_BUILD_COLLECTION = "src_build"
+biothings.config_for_app(config)
+
+from biothings.utils.fingerprint import has_fingerprints, store_fingerprints, \
+                                        get_fingerprint_collection
+from biothings.utils.diff import diff_docs_jsonpatch
+from biothings.databuild.differ import diff_worker_merge_join
+from biothings.databuild.syncer import sync_mongo_jsondiff_worker
+
+
+class FingerprintSyncTest(object):
+
+    __test__ = True
+
+    def setUp(self):
+        self.client = MongoClient(MONGO_HOST,MONGO_PORT,serverSelectionTimeoutMS=1000)
+        try:
+            self.client.server_info()
+        except ConnectionFailure:
+            raise SkipTest("No MongoDB server on %s:%s" % (MONGO_HOST,MONGO_PORT))
+        self.db = self.client[TARGET_DB]
+        self.diff_folder = tempfile.mkdtemp()
+        self.batch_num = 0
+        for name in ["old","new","newer"]:
+            self.client[SRC_DB]["src_build"].insert_one({"_id": name, "started_at": datetime.datetime.now()})
+
+    def tearDown(self):
+        for db_name in [SRC_DB,TARGET_DB,get_fingerprint_collection(self.db["old"]).database.name]:
+            self.client.drop_database(db_name)
+        shutil.rmtree(self.diff_folder)
+
+    def diff(self, old, new):
+        # same as differ's "content" step, with fingerprints
+        ids = [d["_id"] for d in self.db[new].find({},{"_id": 1})]
+        for name in [old,new]:
+            if not has_fingerprints(self.db[name]):
+                store_fingerprints(self.db[name],ids)
+        self.batch_num += 1
+        return diff_worker_merge_join({"add": [], "delete": [], "common": ids},old,new,
+                                      self.batch_num,self.diff_folder,diff_docs_jsonpatch,
+                                      fingerprints=True)
+
+    def test_diff_after_sync(self):
+        self.db["old"].insert_many([{"_id": "a", "v": 1}, {"_id": "b", "v": 1}])
+        self.db["new"].insert_many([{"_id": "a", "v": 2}, {"_id": "b", "v": 1}])
+        self.db["newer"].insert_many([{"_id": "a", "v": 1}, {"_id": "b", "v": 1}])
+        summary = self.diff("old","new")
+        eq_(summary["update"],1)
+        diff_file = os.path.join(self.diff_folder,summary["diff_file"]["name"])
+        res = sync_mongo_jsondiff_worker(diff_file,"old","new",100,0)
+        eq_(res["updated"],1)
+        eq_(self.db["old"].find_one({"_id": "a"})["v"],2)
+        # document count didn't change, but fingerprints computed before sync are outdated
+        ok_(not has_fingerprints(self.db["old"]))
+        # "a" changed back in "newer"
+        summary = self.diff("old","newer")
+        eq_(summary["update"],1)
@@ -0,0 +1,80 @@
+import os
+import gzip
+import shutil, tempfile
+
+from nose.tools import eq_, ok_, assert_raises
+import utils.idcache as idcache
+
+
+class IdCacheTest(object):
+
+    __test__ = True
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.cache_file = os.path.join(self.folder,"col.mmap")
+        self.ids = ["id_%d" % i for i in range(1000)] + ["ïdé", "a", "b" * 300]
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write(self, ids, batch_size=100):
+        writer = idcache.IdCacheWriter(self.cache_file)
+        for i in range(0,len(ids),batch_size):
+            writer.write(ids[i:i + batch_size])
+        writer.close()
+
+    def test_roundtrip(self):
+        # spill offsets to disk several times
+        orig_size = idcache.OFFSETS_BUFFER_SIZE
+        idcache.OFFSETS_BUFFER_SIZE = 64
+        try:
+            self.write(self.ids)
+        finally:
+            idcache.OFFSETS_BUFFER_SIZE = orig_size
+        ok_(idcache.is_id_cache(self.cache_file))
+        with idcache.IdCache(self.cache_file) as cache:
+            eq_(len(cache),len(self.ids))
+            eq_(cache[:],self.ids)
+            eq_([i for b in cache.iter_batches(7) for i in b],self.ids)
+
+    def test_slicing(self):
+        self.write(self.ids)
+        with idcache.IdCache(self.cache_file) as cache:
+            eq_(cache[0],self.ids[0])
+            eq_(cache[-1],self.ids[-1])
+            eq_(cache[1000],"ïdé")
+            eq_(cache[10:20],self.ids[10:20])
+            eq_(cache[995:],self.ids[995:])
+            eq_(cache[-5:-2],self.ids[-5:-2])
+            eq_(cache[0:50:3],self.ids[0:50:3])
+            eq_(cache[20:10],[])
+            eq_(cache.get_batch(990,2000),self.ids[990:])
+            assert_raises(IndexError,lambda: cache[len(self.ids)])
+            # batches starting at an offset
+            batches = list(cache.iter_batches(100,start=900))
+            eq_([len(b) for b in batches],[100,3])
+            eq_(batches[0],self.ids[900:1000])
+
+    def test_empty(self):
+        self.write([])
+        with idcache.IdCache(self.cache_file) as cache:
+            eq_(len(cache),0)
+            eq_(cache[:],[])
+            eq_(list(cache.iter_batches(10)),[])
+        open(self.cache_file,"wb").close()
+        assert_raises(idcache.IdCacheError,idcache.IdCache,self.cache_file)
+
+    def test_convert_cache(self):
+        txtfile = os.path.join(self.folder,"col.gz")
+        with gzip.open(txtfile,"wb") as fout:
+            fout.write(("\n".join(self.ids) + "\n\n").encode())
+        # cache is older than its collection, converting doesn't make it valid
+        os.utime(txtfile,(1000000,1000000))
+        outfile = idcache.convert_cache(txtfile,batch_size=64)
+        eq_(outfile,os.path.join(self.folder,"col.mmap"))
+        eq_(os.path.getmtime(outfile),os.path.getmtime(txtfile))
+        ok_(not idcache.is_id_cache(txtfile))
+        with idcache.IdCache(outfile) as cache:
+            eq_(cache[:],self.ids)
+            eq_(cache[500:600],self.ids[500:600])
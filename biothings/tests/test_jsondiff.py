@@ -57,6 +57,39 @@ class JsonDiffTest(object):
         new_new_right = jsonpatch.apply_patch(new_right,patch,ignore_conflicts=True,verify=True)
         eq_(right,new_new_right)
 
+    def test_hashed_array(self):
+        left = {"a":[1,2,3,{"b":1}]}
+        right = {"a":[0,1,2,3,{"b":2},4]}
+        patch = jsondiff.make(left,right,hashed=True,use_list_ops=True)
+        new_right = jsonpatch.apply_patch(left,patch)
+        eq_(right,new_right)
+        # one element added in head, modified dict is patched, not replaced
+        eq_(patch,[{"op":"add","path":"/a/0","value":0},
+                   {"op":"replace","path":"/a/4/b","value":2},
+                   {"op":"add","path":"/a/5","value":4}])
+        # no list ops: whole list replaced
+        patch = jsondiff.make(left,right,hashed=True)
+        eq_(patch,[{"op":"replace","path":"/a","value":right["a"]}])
+
+    def test_hashed_list_keys(self):
+        left = {"v":[{"rsid":"rs1","af":0.1},{"rsid":"rs2","af":0.2},{"rsid":"rs3","af":0.3}]}
+        right = {"v":[{"rsid":"rs0","af":0.0},{"rsid":"rs1","af":0.1},{"rsid":"rs3","af":0.4}]}
+        patch = jsondiff.make(left,right,hashed=True,use_list_ops=True,list_keys=["rsid"])
+        new_right = jsonpatch.apply_patch(left,patch)
+        eq_(right,new_right)
+        # rs3 element matched by key, only its changed field is patched
+        eq_(patch,[{"op":"add","path":"/v/0","value":{"rsid":"rs0","af":0.0}},
+                   {"op":"remove","path":"/v/2"},
+                   {"op":"replace","path":"/v/2/af","value":0.4}])
+
+    def test_hashed_smalldoc(self):
+        left = {'a':[9,8,3],'b':'B','c':{'1':1,'2':2,'3':3}}
+        right = {'c':{'5':5,'4':4,'1':1},'B':'capitalB','a':[1,2,3,4,5],'b':'bbb'}
+        for use_list_ops in [False,True]:
+            patch = jsondiff.make(left,right,hashed=True,use_list_ops=use_list_ops)
+            new_right = jsonpatch.apply_patch(left,patch)
+            eq_(right,new_right)
+
     def test_bigdoc(self):
         os.chdir(os.path.dirname(sys.argv[1]))
         v2 = json.load(open("v2.json"))
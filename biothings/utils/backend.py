@@ -1,5 +1,10 @@
 ''' Backend access class. '''
+import concurrent.futures
+from pymongo import UpdateOne
+from pymongo.write_concern import WriteConcern
 from biothings.utils.es import ESIndexer
+from biothings.utils.common import iter_n
+from biothings.utils.fingerprint import drop_fingerprints
 from biothings import config as btconfig
 from elasticsearch.exceptions import NotFoundError
 
@@ -154,6 +159,43 @@ class DocMongoBackend(DocBackendBase):
         else:
             return 0
 
+    def bulk_update(self, docs, upsert=False, batch_size=10000, max_in_flight=4, write_concern=None):
+        '''Same as update() but documents are sent with unordered bulk_write() calls,
+           by sub-batches of "batch_size" docs. Up to "max_in_flight" sub-batches are
+           sent concurrently. "write_concern" is an optional dict passed to pymongo's
+           WriteConcern (eg. {"w":1,"j":False}).
+           Return a dict with matched/upserted counters summed over all sub-batches,
+           and the same counters for each sub-batch in "batches". With an unacknowledged
+           write concern (w=0), number of docs sent is counted as "unacknowledged".
+        '''
+        col = self.target_collection
+        if write_concern:
+            col = col.with_options(write_concern=WriteConcern(**write_concern))
+        def write(ops):
+            res = col.bulk_write(ops,ordered=False)
+            if res.acknowledged:
+                return {"matched" : res.matched_count, "upserted" : res.upserted_count}
+            else:
+                return {"unacknowledged" : len(ops)}
+        stats = {"matched" : 0, "upserted" : 0, "unacknowledged" : 0, "batches" : []}
+        def collect(futures):
+            for f in futures:
+                # raise BulkWriteError if any
+                res = f.result()
+                for k in res:
+                    stats[k] += res[k]
+                stats["batches"].append(res)
+        pending = set()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+            for batch in iter_n(docs,batch_size):
+                ops = [UpdateOne({'_id':doc["_id"]},{"$set":doc},upsert=upsert) for doc in batch]
+                if len(pending) >= max_in_flight:
+                    done,pending = concurrent.futures.wait(pending,return_when=concurrent.futures.FIRST_COMPLETED)
+                    collect(done)
+                pending.add(executor.submit(write,ops))
+            collect(concurrent.futures.as_completed(pending))
+        return stats
+
     def update_diff(self, diff, extra={}):
         '''update a doc based on the diff returned from diff.diff_doc
             "extra" can be passed (as a dictionary) to add common fields to the
@@ -172,6 +214,8 @@ class DocMongoBackend(DocBackendBase):
 
     def drop(self):
         self.target_collection.drop()
+        # documents' fingerprints, if any, are now outdated
+        drop_fingerprints(self.target_collection)
 
     def get_id_list(self):
         return [x['_id'] for x in self.target_collection.find(projection=[], manipulate=False)]
@@ -272,8 +316,10 @@ class DocESBackend(DocBackendBase):
         conn.indices.refresh()
         self.target_esidxer.optimize()
 
-    def get_id_list(self,step=None):
-        return self.target_esidxer.get_id_list(step=step)
+    def get_id_list(self,step=None,slices=None):
+        '''Iterate over all _ids. If slices is not None, a sliced scroll is used
+        (ES >= 5, slices=0 means one slice per shard)'''
+        return self.target_esidxer.get_id_list(step=step,slices=slices)
 
     def get_from_id(self, id):
         return self.target_esidxer.get(id)
@@ -286,9 +332,14 @@ class DocESBackend(DocBackendBase):
         self.target_esidxer.delete_docs(ids, step=step)
 
     def query(self, query=None, verbose=False, step=10000, scroll="10m", 
-              only_source=True, **kwargs):
-        ''' Function that takes a query and returns an iterator to query results. '''
+              only_source=True, slices=None, **kwargs):
+        ''' Function that takes a query and returns an iterator to query results.
+        If slices is not None, results are fetched concurrently with a sliced scroll
+        (slices=0 means one slice per shard) and order is not predictable. '''
         try:
+            if slices is not None:
+                return self.target_esidxer.sliced_doc_feeder(query=query, slices=slices, step=step, scroll=scroll,
+                                                             only_source=only_source, **kwargs)
             return self.target_esidxer.doc_feeder(query=query, verbose=verbose, step=step, scroll=scroll, only_source=only_source, **kwargs)
         except Exception as e:
             pass
@@ -6,14 +6,25 @@ mapping to JSON, cleaning.
 #from __future__ import unicode_literals
 import itertools
 import csv
+import io
 import os, os.path
 import json
 import collections
 
-from .common import open_anyfile, is_str, ask, safewfile, anyfile
+from .common import open_anyfile, is_str, ask, safewfile, anyfile, is_filehandle
+
+try:
+    import pyarrow
+    import pyarrow.csv
+    SUPPORT_ARROW = True
+except ImportError:
+    SUPPORT_ARROW = False
 
 csv.field_size_limit(10000000)   # default is 131072, too small for some big files
 
+# text read at once by tabfile_column_feeder()
+TABFILE_BLOCK_SIZE = 16 * 1024 * 1024
+
 
 # remove keys whos values are ".", "-", "", "NA", "none", " "
 # and remove empty dictionaries
@@ -331,9 +342,10 @@ def tabfile_feeder(datafile, header=1, sep='\t',
                    includefn=None,
                    coerce_unicode=True,
                    assert_column_no=None):
-    '''a generator for each row in the file.'''
+    '''a generator for each row in the file.
+       datafile can also be a file object (eg. from filesplit.open_range()).'''
 
-    in_f = anyfile(datafile)
+    in_f = is_filehandle(datafile) and datafile or anyfile(datafile)
     reader = csv.reader(in_f, delimiter=sep)
     lineno = 0
     try:
@@ -415,6 +427,245 @@ def tab2dict_iter(datafile, cols, key, alwayslist=False, **kwargs):
         return {}
 
 
+def _parse_block(block, sep):
+    """Return rows (lists of fields) from block of lines"""
+    if '"' in block:
+        # quoted fields, let csv module deal with them, like tabfile_feeder()
+        return list(csv.reader(io.StringIO(block), delimiter=sep))
+    if block.endswith("\n"):
+        block = block[:-1]
+    return [line and line.split(sep) or [] for line in block.split("\n")]
+
+
+def _parse_block_columns(block, sep):
+    """
+    Return columns (lists of fields) from block of lines, without building
+    rows, or None if not possible (quoted fields, rows of different lengths)
+    """
+    if '"' in block:
+        return None
+    if block.endswith("\n"):
+        block = block[:-1]
+    if block.startswith("\n") or "\n\n" in block:
+        # empty rows
+        return None
+    lines = block.split("\n")
+    counts = set([line.count(sep) for line in lines])
+    if len(counts) != 1 or not lines[0]:
+        return None
+    ncols = counts.pop() + 1
+    fields = block.replace("\n", sep).split(sep)
+    return [fields[i::ncols] for i in range(ncols)]
+
+
+def _python_blocks(datafile, header, sep, block_size):
+    """Yield blocks of text from datafile, ending on line boundaries"""
+    in_f = is_filehandle(datafile) and datafile or anyfile(datafile)
+    try:
+        for i in range(header):
+            in_f.readline()
+        rest = ""
+        while True:
+            data = in_f.read(block_size)
+            if not data:
+                break
+            data = rest + data
+            end = data.rfind("\n")
+            if end == -1:
+                rest = data
+                continue
+            rest = data[end + 1:]
+            yield data[:end + 1]
+        if rest:
+            yield rest
+    finally:
+        in_f.close()
+
+
+def _arrow_column_blocks(datafile, header, sep, block_size):
+    with open_anyfile(datafile) as in_f:
+        for i in range(header):
+            in_f.readline()
+        ncols = len(in_f.readline().rstrip("\n").split(sep))
+    # keep all values as strings, like tabfile_feeder()
+    names = ["f%d" % i for i in range(ncols)]
+    reader = pyarrow.csv.open_csv(datafile,
+            read_options=pyarrow.csv.ReadOptions(skip_rows=header, column_names=names,
+                                                 block_size=block_size),
+            parse_options=pyarrow.csv.ParseOptions(delimiter=sep),
+            convert_options=pyarrow.csv.ConvertOptions(
+                column_types=dict([(name, pyarrow.string()) for name in names])))
+    for batch in reader:
+        yield [col.to_pylist() for col in batch.columns]
+
+
+def _tabfile_blocks(datafile, header, sep, includefn, assert_column_no, engine, block_size):
+    """
+    Yield (columns, rows) for each block parsed from datafile, only one of them
+    being set: columns when all rows in block have the same (non-zero) number
+    of fields, rows (lists of fields, like tabfile_feeder()) otherwise
+    """
+    if engine is None:
+        engine = SUPPORT_ARROW and is_str(datafile) and \
+                 not datafile.lower().endswith(".zip") and "arrow" or "python"
+    if engine == "arrow":
+        blocks = _arrow_column_blocks(datafile, header, sep, block_size)
+    elif engine == "python":
+        blocks = _python_blocks(datafile, header, sep, block_size)
+    else:
+        raise ValueError("Unknown engine '%s'" % engine)
+    for block in blocks:
+        if engine == "arrow":
+            columns = block and block[0] and block or None
+            if columns is None:
+                continue
+        else:
+            columns = not includefn and _parse_block_columns(block, sep) or None
+        if columns is not None and not includefn and \
+                (not assert_column_no or len(columns) == assert_column_no):
+            yield columns, None
+            continue
+        # need rows
+        if engine == "arrow":
+            rows = [list(row) for row in zip(*columns)]
+        else:
+            rows = _parse_block(block, sep)
+        if assert_column_no:
+            for ld in rows:
+                if len(ld) != assert_column_no:
+                    err = "Unexpected column number:" \
+                          " got {}, should be {}".format(len(ld), assert_column_no)
+                    raise ValueError(err)
+        if includefn:
+            rows = [ld for ld in rows if includefn(ld)]
+        if rows:
+            yield None, rows
+
+
+def tabfile_column_feeder(datafile, cols=None, header=1, sep='\t',
+                          includefn=None,
+                          coerce_unicode=True,
+                          assert_column_no=None,
+                          engine=None,
+                          block_size=TABFILE_BLOCK_SIZE):
+    '''A generator of column batches from datafile: the file is parsed by large blocks,
+       each batch being a list of columns (lists of str values), restricted to
+       column indexes cols (in that order) if specified. Same parameters as tabfile_feeder()
+       (values are always str, coerce_unicode is ignored).
+       engine can be "arrow" (pyarrow.csv, if installed, datafile must be a path)
+       or "python" (blocks of lines are split into columns at once, blocks with quotes
+       are parsed with csv module, quoted fields can't contain new lines). Default is
+       "arrow" if possible. Empty rows are skipped. If cols isn't specified, all rows
+       must have the same number of fields, otherwise rows must have at least the
+       fields in cols (ValueError is raised).'''
+    width = None    # number of fields, from first block
+    for columns, rows in _tabfile_blocks(datafile, header, sep, includefn,
+                                         assert_column_no, engine, block_size):
+        if columns is not None:
+            widths = set([len(columns)])
+        else:
+            rows = [ld for ld in rows if ld]
+            if not rows:
+                continue
+            widths = set([len(ld) for ld in rows])
+        if cols is None:
+            width = width or min(widths)
+            if widths != set([width]):
+                raise ValueError("Rows with different numbers of fields %s, " % sorted(widths.union([width])) + \
+                                 "can't be read as columns (use fast_tabfile_feeder())")
+        elif min(widths) <= max(cols):
+            raise ValueError("Rows with %d fields found, can't get columns %s" % (min(widths), list(cols)))
+        if columns is not None:
+            yield cols is None and columns or [columns[i] for i in cols]
+        else:
+            yield [[ld[i] for ld in rows] for i in (cols is None and range(width) or cols)]
+
+
+def fast_tabfile_feeder(datafile, header=1, sep='\t',
+                        includefn=None,
+                        coerce_unicode=True,
+                        assert_column_no=None,
+                        engine=None,
+                        block_size=TABFILE_BLOCK_SIZE):
+    '''Same as tabfile_feeder() but parsing datafile by blocks (see tabfile_column_feeder()
+       for extra parameters), yielding rows (lists). With "arrow" engine, empty rows
+       are skipped and all rows must have the same number of fields.'''
+    for columns, rows in _tabfile_blocks(datafile, header, sep, includefn,
+                                         assert_column_no, engine, block_size):
+        if columns is not None:
+            for row in zip(*columns):
+                yield list(row)
+        else:
+            for row in rows:
+                yield row
+
+
+def _column_key_values(columns, key):
+    """Return (keys, values) iterables from columns, like list2dict() from rows"""
+    if isinstance(key, int):
+        keys = columns[key]
+        others = columns[:key] + columns[key + 1:]
+    else:
+        keys = zip(*[columns[i] for i in key])
+        others = [col for i, col in enumerate(columns) if i not in key]
+    if len(others) == 1:      # single value
+        values = others[0]
+    else:
+        values = zip(*others)
+    return keys, values
+
+
+def fast_tab2dict(datafile, cols, key, alwayslist=False, **kwargs):
+    '''Same as tab2dict() but dict is built from column batches
+       (see tabfile_column_feeder() for extra parameters).'''
+    if isinstance(datafile, tuple):
+        _datafile = datafile[0]
+    else:
+        _datafile = datafile
+    if not os.path.exists(_datafile):
+        print('Error: missing "%s". Skipped!' % os.path.split(_datafile)[1])
+        return {}
+    _dict = {}
+    for columns in tabfile_column_feeder(datafile, cols=cols, **kwargs):
+        keys, values = _column_key_values(columns, key)
+        for k, value in zip(keys, values):
+            if k not in _dict:
+                _dict[k] = alwayslist and [value] or value
+            else:
+                current_value = _dict[k]
+                if not isinstance(current_value, list):
+                    current_value = [current_value]
+                    _dict[k] = current_value
+                current_value.append(value)
+    return _dict
+
+
+def fast_tab2dict_iter(datafile, cols, key, alwayslist=False, **kwargs):
+    '''Same as tab2dict_iter() but using column batches: yield a dict for each
+       group of consecutive rows with same key (see tabfile_column_feeder()
+       for extra parameters).'''
+    if isinstance(datafile, tuple):
+        _datafile = datafile[0]
+    else:
+        _datafile = datafile
+    if not os.path.exists(_datafile):
+        print('Error: missing "%s". Skipped!' % os.path.split(_datafile)[1])
+        return
+    prev_key = None
+    group = []
+    for columns in tabfile_column_feeder(datafile, cols=cols, **kwargs):
+        keys, values = _column_key_values(columns, key)
+        for k, value in zip(keys, values):
+            if group and k != prev_key:
+                yield {prev_key: (alwayslist or len(group) > 1) and group or group[0]}
+                group = []
+            prev_key = k
+            group.append(value)
+    # flush remaining group
+    if group:
+        yield {prev_key: (alwayslist or len(group) > 1) and group or group[0]}
+
+
 def file_merge(infiles, outfile=None, header=1, verbose=1):
     '''merge a list of input files with the same format.
        if header will be removed from the 2nd files in the list.
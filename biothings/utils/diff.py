@@ -3,6 +3,7 @@ Utils to compare two list of gene documents
 '''
 import os
 import time
+import datetime
 import os.path
 from .common import timesofar, dump, get_timestamp, filter_dict
 from .backend import DocMongoDBBackend
@@ -76,6 +77,69 @@ def full_diff_doc(doc_1, doc_2, exclude_attrs=['_timestamp']):
     if diff_d['update'] or diff_d['delete'] or diff_d['add']:
         return diff_d
 
+def _id_sort_key(_id):
+    """
+    Sort key for _id, following MongoDB's order across types (BSON comparison
+    order: null < numbers < strings < ObjectId < booleans < dates), as _ids are
+    sorted server-side (see biothings.utils.mongo.sorted_id_feeder). Other
+    types (documents, arrays, binary, ...) aren't supported (ValueError)
+    """
+    if _id is None:
+        return (1, 0)
+    elif isinstance(_id, bool):
+        return (8, _id)
+    elif isinstance(_id, (int, float)):
+        return (2, _id)
+    elif isinstance(_id, str):
+        return (3, _id)
+    elif type(_id).__name__ == "ObjectId":
+        return (7, _id)
+    elif isinstance(_id, datetime.datetime):
+        return (9, _id)
+    raise ValueError("Can't compare _id %r of type %s with a merge-join" % (_id, type(_id).__name__))
+
+
+def merge_join_ids(old_ids, new_ids, batch_size=10000):
+    """
+    Compare two iterables of _ids, both sorted in ascending order (see
+    biothings.utils.mongo.sorted_id_feeder), in one single pass. Yield dicts
+    like {"add": [...], "delete": [...], "common": [...]}, holding batch_size
+    _ids at most: "add" are _ids only found in new_ids, "delete" only in old_ids.
+    """
+    sentinel = object()
+    def checked(ids, name):
+        prev = sentinel
+        for _id in ids:
+            if prev is not sentinel and not _id_sort_key(prev) < _id_sort_key(_id):
+                raise ValueError("_ids from %s are not sorted (or not unique): %r >= %r" % (name, prev, _id))
+            prev = _id
+            yield _id
+    old_it = checked(old_ids, "old")
+    new_it = checked(new_ids, "new")
+    batch = {"add": [], "delete": [], "common": []}
+    cnt = 0
+    old_id = next(old_it, sentinel)
+    new_id = next(new_it, sentinel)
+    while old_id is not sentinel or new_id is not sentinel:
+        if new_id is sentinel or (old_id is not sentinel and _id_sort_key(old_id) < _id_sort_key(new_id)):
+            batch["delete"].append(old_id)
+            old_id = next(old_it, sentinel)
+        elif old_id is sentinel or _id_sort_key(new_id) < _id_sort_key(old_id):
+            batch["add"].append(new_id)
+            new_id = next(new_it, sentinel)
+        else:
+            batch["common"].append(new_id)
+            old_id = next(old_it, sentinel)
+            new_id = next(new_it, sentinel)
+        cnt += 1
+        if cnt >= batch_size:
+            yield batch
+            batch = {"add": [], "delete": [], "common": []}
+            cnt = 0
+    if cnt:
+        yield batch
+
+
 def two_docs_iterator(b1, b2, id_list, step=10000, verbose=False):
     t0 = time.time()
     n = len(id_list)
@@ -129,7 +193,11 @@ def _diff_doc_inner_worker(b1, b2, ids, fastdiff=False, diff_func=full_diff_doc)
 def diff_docs_jsonpatch(b1, b2, ids, fastdiff=False, exclude_attrs=[]):
     '''if fastdiff is True, only compare the whole doc,
        do not traverse into each attributes.
+       Options passed to jsondiff (eg. {"hashed": True, "use_list_ops": True,
+       "list_keys": ["_id"]}) can be set in JSONDIFF_OPTIONS config.
     '''
+    from biothings import config as btconfig
+    jsondiff_options = getattr(btconfig,"JSONDIFF_OPTIONS",{})
     _updates = []
     for doc1, doc2 in two_docs_iterator(b1, b2, ids):
         assert doc1['_id'] == doc2['_id'], "Different ids: '%s' != '%s'" % \
@@ -141,7 +209,7 @@ def diff_docs_jsonpatch(b1, b2, ids, fastdiff=False, exclude_attrs=[]):
             if doc1 != doc2:
                 _updates.append(doc1['_id'])
         else:
-            _patch = jsondiff(doc1, doc2)
+            _patch = jsondiff(doc1, doc2, **jsondiff_options)
             if _patch:
                 _diff = {}
                 _diff['patch'] = _patch
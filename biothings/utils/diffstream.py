@@ -0,0 +1,332 @@
+"""
+Streamable diff file format (".btdiff"), an alternative to gzip-pickled
+".pyobj" diff files.
+
+A diff file is a (compressed) stream of length-prefixed records:
+
+    MAGIC (6 bytes) + version (1 byte) + serializer (1 byte: "M"sgpack or "J"son)
+    then for each record: length (4 bytes, big endian) + serialized record
+
+The first record is a header, {"source": ..., "timestamp": ..., "count": {"add": n, ...}},
+followed by one record per diff operation: ["add", _id or doc], ["update", {"_id": ..., "patch": [...]}],
+or ["delete", _id]. Records can be applied while the file is read, there's no need
+to load the whole file in memory. msgpack is used if installed (JSON otherwise), and
+the stream is compressed using zstd or lz4 if installed (gzip otherwise). Compression is
+detected when reading, from file signature.
+
+Datetimes (naive, as returned by pymongo) are stored as a msgpack extension type
+(DATETIME_EXT) or as {"$datetime": "..."} in JSON, and restored as such when read.
+Other values which can't be serialized raise a TypeError.
+
+Contrary to ".pyobj" files, "synced" flags aren't stored in the diff file itself
+(which would change its md5 once applied) but in a "<diff file>.synced" side file.
+"""
+import os
+import json, struct
+import datetime
+import gzip
+from contextlib import contextmanager
+
+try:
+    import msgpack
+    SUPPORT_MSGPACK = True
+except ImportError:
+    SUPPORT_MSGPACK = False
+try:
+    import zstandard
+    SUPPORT_ZSTD = True
+except ImportError:
+    SUPPORT_ZSTD = False
+try:
+    import lz4.frame
+    SUPPORT_LZ4 = True
+except ImportError:
+    SUPPORT_LZ4 = False
+
+from biothings.utils.common import loadobj, dump
+
+EXTENSION = ".btdiff"
+SYNCED_SUFFIX = ".synced"
+MAGIC = b"BTDIFF"
+VERSION = 2
+DATETIME_EXT = 1
+DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+OPERATIONS = ["add","update","delete"]
+
+_LENGTH = struct.Struct(">I")
+# compression => file signature
+SIGNATURES = {
+        "zstd" : b"\x28\xb5\x2f\xfd",
+        "lz4" : b"\x04\x22\x4d\x18",
+        "gzip" : b"\x1f\x8b",
+        }
+
+
+def is_diff_stream(filename):
+    return filename.endswith(EXTENSION)
+
+
+def default_compression():
+    if SUPPORT_ZSTD:
+        return "zstd"
+    elif SUPPORT_LZ4:
+        return "lz4"
+    else:
+        return "gzip"
+
+
+def _datetime_str(obj):
+    if obj.tzinfo is not None:
+        raise TypeError("Can't store timezone-aware datetime %r in diff file" % obj)
+    return obj.strftime(DATETIME_FORMAT)
+
+
+def _msgpack_default(obj):
+    if isinstance(obj,datetime.datetime):
+        return msgpack.ExtType(DATETIME_EXT,_datetime_str(obj).encode("ascii"))
+    raise TypeError("Can't store %r (type %s) in diff file" % (obj,type(obj).__name__))
+
+
+def _msgpack_ext_hook(code, data):
+    if code == DATETIME_EXT:
+        return datetime.datetime.strptime(data.decode("ascii"),DATETIME_FORMAT)
+    return msgpack.ExtType(code,data)
+
+
+def _json_default(obj):
+    if isinstance(obj,datetime.datetime):
+        return {"$datetime" : _datetime_str(obj)}
+    raise TypeError("Can't store %r (type %s) in diff file" % (obj,type(obj).__name__))
+
+
+def _json_object_hook(obj):
+    # "$" keys can't be used in documents, no ambiguity
+    if len(obj) == 1 and "$datetime" in obj:
+        return datetime.datetime.strptime(obj["$datetime"],DATETIME_FORMAT)
+    return obj
+
+
+def _packer(serializer):
+    if serializer == b"M":
+        return lambda obj: msgpack.packb(obj,use_bin_type=True,default=_msgpack_default)
+    else:
+        return lambda obj: json.dumps(obj,default=_json_default).encode("utf-8")
+
+
+def _unpacker(serializer):
+    if serializer == b"M":
+        if not SUPPORT_MSGPACK:
+            raise ImportError("Please install msgpack to read this diff file")
+        return lambda data: msgpack.unpackb(data,raw=False,ext_hook=_msgpack_ext_hook)
+    else:
+        return lambda data: json.loads(data.decode("utf-8"),object_hook=_json_object_hook)
+
+
+@contextmanager
+def _open_stream(filename, mode, compression=None):
+    if mode == "wb":
+        compression = compression or default_compression()
+        if compression == "zstd":
+            with open(filename,"wb") as fh, zstandard.ZstdCompressor().stream_writer(fh) as fobj:
+                yield fobj
+        elif compression == "lz4":
+            with lz4.frame.open(filename,"wb") as fobj:
+                yield fobj
+        elif compression == "gzip":
+            # favor speed over size
+            with gzip.open(filename,"wb",compresslevel=1) as fobj:
+                yield fobj
+        else:
+            raise ValueError("Unknown compression '%s'" % compression)
+    else:
+        with open(filename,"rb") as fh:
+            sig = fh.read(4)
+        if sig == SIGNATURES["zstd"]:
+            if not SUPPORT_ZSTD:
+                raise ImportError("Please install zstandard to read this diff file")
+            with open(filename,"rb") as fh, zstandard.ZstdDecompressor().stream_reader(fh) as fobj:
+                yield fobj
+        elif sig == SIGNATURES["lz4"]:
+            if not SUPPORT_LZ4:
+                raise ImportError("Please install lz4 to read this diff file")
+            with lz4.frame.open(filename,"rb") as fobj:
+                yield fobj
+        elif sig[:2] == SIGNATURES["gzip"]:
+            with gzip.open(filename,"rb") as fobj:
+                yield fobj
+        else:
+            raise ValueError("Unknown compression for diff file '%s'" % filename)
+
+
+def _read_exactly(fobj, size):
+    # some decompressing streams can return less than what's asked
+    data = fobj.read(size)
+    while len(data) < size:
+        chunk = fobj.read(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+def write_diff(diff, filename, compression=None):
+    """
+    Write diff (dict with "add", "update", "delete", "source" and "timestamp" keys,
+    as produced by differ workers) in filename. Return filename.
+    """
+    serializer = SUPPORT_MSGPACK and b"M" or b"J"
+    pack = _packer(serializer)
+    header = {"source" : diff["source"],
+              "timestamp" : diff["timestamp"],
+              "count" : dict([(op,len(diff[op])) for op in OPERATIONS])}
+    with _open_stream(filename,"wb",compression) as fobj:
+        fobj.write(MAGIC + bytes([VERSION]) + serializer)
+        def write_record(rec):
+            data = pack(rec)
+            fobj.write(_LENGTH.pack(len(data)))
+            fobj.write(data)
+        write_record(header)
+        for op in OPERATIONS:
+            for val in diff[op]:
+                write_record([op,val])
+    return filename
+
+
+def _iter_stream(filename):
+    with _open_stream(filename,"rb") as fobj:
+        start = _read_exactly(fobj,len(MAGIC) + 2)
+        if start[:len(MAGIC)] != MAGIC:
+            raise ValueError("'%s' is not a diff file" % filename)
+        if start[len(MAGIC)] > VERSION:
+            raise ValueError("Unsupported diff file version %s in '%s'" % (start[len(MAGIC)],filename))
+        unpack = _unpacker(start[-1:])
+        while True:
+            size = _read_exactly(fobj,_LENGTH.size)
+            if not size:
+                break
+            if len(size) != _LENGTH.size:
+                raise ValueError("Truncated diff file '%s'" % filename)
+            (size,) = _LENGTH.unpack(size)
+            data = _read_exactly(fobj,size)
+            if len(data) != size:
+                raise ValueError("Truncated diff file '%s'" % filename)
+            yield unpack(data)
+
+
+def read_header(filename):
+    """
+    Return diff file header: {"source": ..., "timestamp": ..., "count": {"add": n, "update": n, "delete": n}}
+    (".pyobj" diff files are supported)
+    """
+    if is_diff_stream(filename):
+        for header in _iter_stream(filename):
+            return header
+    else:
+        diff = loadobj(filename)
+        return {"source" : diff["source"],
+                "timestamp" : diff["timestamp"],
+                "count" : dict([(op,len(diff[op])) for op in OPERATIONS])}
+
+
+def iter_diff(filename):
+    """
+    Iterate over diff operations found in filename, yielding (operation, value)
+    tuples, operation being "add", "update" or "delete". ".pyobj" diff files are
+    supported, though fully loaded in memory.
+    """
+    if is_diff_stream(filename):
+        records = _iter_stream(filename)
+        next(records) # header
+        for (op,val) in records:
+            yield (op,val)
+    else:
+        diff = loadobj(filename)
+        for op in OPERATIONS:
+            for val in diff[op]:
+                yield (op,val)
+
+
+def iter_diff_batches(filename, batch_size):
+    """
+    Same as iter_diff() but group consecutive values of a same operation,
+    yielding (operation, [values]) tuples, with at most batch_size values.
+    """
+    batch = []
+    current = None
+    for (op,val) in iter_diff(filename):
+        if batch and (op != current or len(batch) >= batch_size):
+            yield (current,batch)
+            batch = []
+        current = op
+        batch.append(val)
+    if batch:
+        yield (current,batch)
+
+
+def load_diff(filename):
+    """
+    Load whole diff file content, as a dict with the same structure as ".pyobj"
+    diff files ("synced" flags excepted)
+    """
+    if not is_diff_stream(filename):
+        return loadobj(filename)
+    diff = read_header(filename)
+    diff.pop("count")
+    for op in OPERATIONS:
+        diff[op] = []
+    for (op,val) in iter_diff(filename):
+        diff[op].append(val)
+    return diff
+
+
+def is_synced(filename, backend):
+    if is_diff_stream(filename):
+        try:
+            return json.load(open(filename + SYNCED_SUFFIX)).get(backend) == True
+        except FileNotFoundError:
+            return False
+    else:
+        return loadobj(filename).get("synced",{}).get(backend) == True
+
+
+def mark_synced(filename, backend):
+    if is_diff_stream(filename):
+        synced = {}
+        if os.path.exists(filename + SYNCED_SUFFIX):
+            synced = json.load(open(filename + SYNCED_SUFFIX))
+        synced[backend] = True
+        json.dump(synced,open(filename + SYNCED_SUFFIX,"w"))
+    else:
+        diff = loadobj(filename)
+        diff.setdefault("synced",{}).setdefault(backend,True)
+        dump(diff,filename)
+
+
+def reset_synced(filename, backend=None):
+    """
+    Remove "synced" flag for backend, or all of them if None, from diff file.
+    Return True if flags were found.
+    """
+    if is_diff_stream(filename):
+        synced_file = filename + SYNCED_SUFFIX
+        if not os.path.exists(synced_file):
+            return False
+        synced = {}
+        if backend:
+            synced = json.load(open(synced_file))
+            synced.pop(backend,None)
+        if synced:
+            json.dump(synced,open(synced_file,"w"))
+        else:
+            os.unlink(synced_file)
+        return True
+    else:
+        diff = loadobj(filename)
+        if not isinstance(diff,dict) or not diff.get("synced"):
+            return False
+        if backend:
+            diff["synced"].pop(backend,None)
+        else:
+            diff.pop("synced")
+        dump(diff,filename)
+        return True
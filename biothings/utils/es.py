@@ -1,6 +1,8 @@
-import time, copy
+import time
 import json
-from elasticsearch import Elasticsearch, NotFoundError, RequestError, TransportError
+import queue, threading
+import concurrent.futures
+from elasticsearch import Elasticsearch, NotFoundError, RequestError, TransportError, ConnectionTimeout
 from elasticsearch import helpers
 import logging
 import itertools
@@ -63,9 +65,189 @@ def wrapper(func):
 
 class IndexerException(Exception): pass
 
+
+# Painless script applying "add", "replace" and "remove" jsonpatch operations,
+# paths given as lists of keys (see patch_to_script())
+PATCH_SCRIPT = """
+for (def op : params.ops) {
+    def obj = ctx._source;
+    for (int i = 0; i < op.path.size() - 1; i++) {
+        obj = obj[op.path[i]];
+    }
+    if (op.op == 'remove') {
+        obj.remove(op.path[op.path.size() - 1]);
+    } else {
+        obj[op.path[op.path.size() - 1]] = op.value;
+    }
+}
+"""
+
+def patch_to_script(patch):
+    '''Translate a jsonpatch (list of operations) to a Painless update script, so
+       a document can be partially updated in place. Return None if the patch
+       can't be translated: operations other than add/replace/remove, operations
+       on the whole document, or touching list elements (any numeric or "-" key
+       in path is considered as a list index).
+    '''
+    ops = []
+    for op in patch:
+        if not op["op"] in ("add","replace","remove"):
+            return None
+        path = [k.replace("~1","/").replace("~0","~") for k in op["path"].split("/")[1:]]
+        if not path or [k for k in path if k.isdigit() or k == "-"]:
+            return None
+        _op = {"op" : op["op"], "path" : path}
+        if op["op"] != "remove":
+            _op["value"] = op["value"]
+        ops.append(_op)
+    return {"lang" : "painless", "inline" : PATCH_SCRIPT, "params" : {"ops" : ops}}
+
+
+class AdaptiveBulkIndexer(object):
+    """
+    Send documents to ES with bulk requests, adapting to the cluster's load:
+    - bulk requests are limited by number of docs (chunk_size) and by size
+      in bytes (max_chunk_bytes)
+    - items (or whole requests) rejected by the cluster (429, bulk queue full)
+      are retried with exponential backoff, up to max_retries times
+    - chunk size is halved when a request is rejected or takes longer than
+      target_latency seconds, and grows back (up to max_chunk_size, default
+      is the initial chunk_size) when requests are fast enough
+    Throughput figures of the last call to index() are kept in self.stats.
+    """
+
+    def __init__(self, es, chunk_size=500, max_chunk_size=None, min_chunk_size=10,
+                 max_chunk_bytes=10*1024*1024, max_retries=8, initial_backoff=2,
+                 max_backoff=120, target_latency=10, logger=logging):
+        self._es = es
+        self.chunk_size = chunk_size
+        self.max_chunk_size = max_chunk_size or chunk_size
+        self.min_chunk_size = min(min_chunk_size,chunk_size)
+        self.max_chunk_bytes = max_chunk_bytes
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.target_latency = target_latency
+        self.logger = logger
+        self.stats = {}
+
+    def serialize(self, doc, index, doc_type, action):
+        """Return (action line, source line or None) for doc"""
+        dumps = self._es.transport.serializer.dumps
+        # _id is temporarily removed from doc so it doesn't need to be copied
+        _id = doc.pop("_id",None)
+        try:
+            meta = {"_index": index, "_type": doc_type}
+            if not _id is None:
+                meta["_id"] = _id
+            src = None if action == "delete" else dumps(doc)
+        finally:
+            if not _id is None:
+                doc["_id"] = _id
+        return (dumps({action: meta}),src)
+
+    def adapt(self, elapsed, rejected):
+        if rejected or elapsed > self.target_latency:
+            new_size = max(self.min_chunk_size,self.chunk_size // 2)
+        elif elapsed < self.target_latency / 2:
+            new_size = min(self.max_chunk_size,int(self.chunk_size * 1.25) + 1)
+        else:
+            new_size = self.chunk_size
+        if new_size != self.chunk_size:
+            self.logger.debug("Bulk chunk size %d => %d (took %.1fs, %d rejected)" % \
+                    (self.chunk_size,new_size,elapsed,len(rejected)))
+            self.chunk_size = new_size
+
+    def send(self, chunk, errors):
+        """
+        Send a chunk of serialized items, retrying rejected ones. Errors
+        not related to load are appended to errors. Return number of
+        successfully processed items.
+        """
+        success = 0
+        attempt = 0
+        # items resent after a timeout, ES may have already processed them
+        timed_out = set()
+        while chunk:
+            body = "\n".join([line for item in chunk for line in item if not line is None]) + "\n"
+            t0 = time.time()
+            rejected = []
+            try:
+                res = self._es.bulk(body=body)
+                for (item,res_item) in zip(chunk,res["items"]):
+                    (op,info) = res_item.popitem()
+                    status = info.get("status",500)
+                    if 200 <= status < 300:
+                        success += 1
+                    elif status == 429:
+                        rejected.append(item)
+                    elif status == 409 and op == "create" and id(item) in timed_out:
+                        # created by the request which timed out
+                        success += 1
+                    else:
+                        errors.append({op: info})
+            except ConnectionTimeout:
+                rejected = chunk
+                timed_out.update([id(item) for item in chunk])
+            except TransportError as e:
+                if e.status_code != 429:
+                    raise
+                rejected = chunk
+            elapsed = time.time() - t0
+            self.stats["chunks"] += 1
+            self.stats["bytes"] += len(body)
+            self.adapt(elapsed,rejected)
+            if rejected:
+                attempt += 1
+                self.stats["rejected"] += len(rejected)
+                if attempt > self.max_retries:
+                    raise helpers.BulkIndexError("%i document(s) still rejected after %d retries" % \
+                            (len(rejected),self.max_retries),[item[0] for item in rejected])
+                backoff = min(self.max_backoff,self.initial_backoff * 2 ** (attempt - 1))
+                self.logger.warning("%d document(s) rejected, retrying in %ss (attempt %d/%d)" % \
+                        (len(rejected),backoff,attempt,self.max_retries))
+                self.stats["retries"] += 1
+                time.sleep(backoff)
+            chunk = rejected
+        return success
+
+    def index(self, docs, index, doc_type, action="index"):
+        """
+        Index docs (iterable) in index/doc_type, with given bulk action.
+        Return (number of processed docs, [], stats), as helpers.bulk().
+        Raises helpers.BulkIndexError if some docs failed.
+        """
+        self.stats = {"docs": 0, "bytes": 0, "chunks": 0, "retries": 0, "rejected": 0}
+        t0 = time.time()
+        success = 0
+        errors = []
+        chunk = []
+        chunk_bytes = 0
+        for doc in docs:
+            item = self.serialize(doc,index,doc_type,action)
+            # estimate size from string length (exact for ASCII), encoding only to
+            # measure it would cost as much as serializing
+            size = sum([len(line) + 1 for line in item if not line is None])
+            if chunk and (len(chunk) >= self.chunk_size or chunk_bytes + size > self.max_chunk_bytes):
+                success += self.send(chunk,errors)
+                chunk = []
+                chunk_bytes = 0
+            chunk.append(item)
+            chunk_bytes += size
+            self.stats["docs"] += 1
+        if chunk:
+            success += self.send(chunk,errors)
+        if errors:
+            raise helpers.BulkIndexError("%i document(s) failed to index." % len(errors),errors)
+        self.stats["time"] = round(time.time() - t0,2)
+        self.stats["docs_per_sec"] = round(self.stats["docs"] / self.stats["time"],1) if self.stats["time"] else None
+        self.stats["chunk_size"] = self.chunk_size
+        return (success,[],dict(self.stats))
+
+
 class ESIndexer():
     def __init__(self, index, doc_type, es_host, step=10000,
-                 number_of_shards=10, number_of_replicas=0):
+                 number_of_shards=10, number_of_replicas=0, bulk_options={}):
         self.es_host = es_host
         self._es = get_es(es_host)
         self._index = index
@@ -75,6 +257,8 @@ class ESIndexer():
         self.step = step  # the bulk size when doing bulk operation.
         self.s = None   # optionally, can specify number of records to skip,
                         # useful to continue indexing after an error.
+        self.bulk_options = bulk_options # see AdaptiveBulkIndexer
+        self._bulk_indexers = {}
 
     @wrapper
     def get_biothing(self, bid, **kwargs):
@@ -151,21 +335,15 @@ class ESIndexer():
         return self._es.index(self._index, self._doc_type, doc, id=id, params={"op_type":action})
 
     def index_bulk(self, docs, step=None, action='index'):
-        index_name = self._index
-        doc_type = self._doc_type
+        """
+        Index docs in bulk, in chunks of step docs at most (see AdaptiveBulkIndexer).
+        Return a (number of indexed docs, errors, stats) tuple.
+        """
         step = step or self.step
-
-        def _get_bulk(doc):
-            # keep original doc
-            ndoc = copy.copy(doc)
-            ndoc.update({
-                "_index": index_name,
-                "_type": doc_type,
-                "_op_type" : action,
-            })
-            return ndoc
-        actions = (_get_bulk(doc) for doc in docs)
-        return helpers.bulk(self._es, actions, chunk_size=step)
+        # keep one bulk indexer per step so chunk size adaptation persists across calls
+        if not step in self._bulk_indexers:
+            self._bulk_indexers[step] = AdaptiveBulkIndexer(self._es,chunk_size=step,**self.bulk_options)
+        return self._bulk_indexers[step].index(docs,self._index,self._doc_type,action=action)
 
     def delete_doc(self, id):
         '''delete a doc from the index based on passed id.'''
@@ -200,25 +378,31 @@ class ESIndexer():
             body['doc_as_upsert'] = True
         return self._es.update(self._index, self._doc_type, id, body)
 
-    def update_docs(self, partial_docs, upsert=True, step=None, **kwargs):
+    def update_docs(self, partial_docs, upsert=True, step=None, script=False, **kwargs):
         '''update a list of partial_docs in bulk.
            allow to set upsert=True, to insert new docs.
+           If script is True, partial_docs are {"_id": ..., "script": {...}} dicts
+           (see patch_to_script()) and docs are updated running that script
+           (upsert is then ignored).
         '''
         index_name = self._index
         doc_type = self._doc_type
         step = step or self.step
 
         def _get_bulk(doc):
-            doc = {
+            action = {
                 '_op_type': 'update',
                 "_index": index_name,
                 "_type": doc_type,
                 "_id": doc['_id'],
-                "doc": doc
             }
+            if script:
+                action["script"] = doc["script"]
+                return action
+            action["doc"] = doc
             if upsert:
-                doc['doc_as_upsert'] = True
-            return doc
+                action['doc_as_upsert'] = True
+            return action
         actions = (_get_bulk(doc) for doc in partial_docs)
         return helpers.bulk(self._es, actions, chunk_size=step, **kwargs)
 
@@ -434,10 +618,105 @@ class ESIndexer():
 
         assert cnt == n, "Error: scroll query terminated early [{}, {}], please retry.\nLast response:\n{}".format(cnt, n, res)
 
+    def _scroll_slice(self, q, slice_id, slices, step, scroll, stop, **kwargs):
+        """Iterate over pages (list of raw hits) of one slice of a scroll query"""
+        q = dict(q)
+        if slices > 1:
+            q["slice"] = {"id": slice_id, "max": slices}
+        res = self._es.search(self._index, self._doc_type, body=q,
+                              size=step, scroll=scroll, **kwargs)
+        try:
+            while res['hits']['hits'] and not stop.is_set():
+                yield res['hits']['hits']
+                res = self._es.scroll(res['_scroll_id'], scroll=scroll)
+        finally:
+            try:
+                self._es.clear_scroll(scroll_id=res['_scroll_id'])
+            except Exception:
+                pass
+
+    @wrapper
+    def sliced_doc_feeder(self, slices=None, step=None, query=None, scroll='10m', only_source=True,
+                          inbatch=False, **kwargs):
+        """
+        Iterate over docs matching query using a sliced scroll: "slices" (default
+        is the number of shards) scroll queries are run concurrently, in threads.
+        Docs are yielded as soon as they're fetched, so order is not predictable.
+        If inbatch is True, yield lists of docs, each one coming from one slice
+        (a scroll page of "step" docs at most).
+        """
+        step = step or self.step
+        q = query if query else {'query': {'match_all': {}}}
+        _q_cnt = self.count(q=q, raw=True)
+        n = _q_cnt['count']
+        slices = slices or _q_cnt['_shards']['total']
+        # bounded queue: slices wait for the consumer
+        pages = queue.Queue(maxsize=2 * slices)
+        stop = threading.Event()
+        done = object()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    pages.put(item, timeout=1)
+                    return
+                except queue.Full:
+                    pass
+
+        def run_slice(slice_id):
+            try:
+                for page in self._scroll_slice(q, slice_id, slices, step, scroll, stop, **kwargs):
+                    put(page)
+            except Exception as e:
+                put(e)
+            finally:
+                put(done)
+
+        cnt = 0
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=slices)
+        try:
+            for slice_id in range(slices):
+                executor.submit(run_slice, slice_id)
+            running = slices
+            while running:
+                page = pages.get()
+                if page is done:
+                    running -= 1
+                    continue
+                if isinstance(page, Exception):
+                    raise page
+                docs = []
+                for rawdoc in page:
+                    if rawdoc.get('_source', False) and only_source:
+                        doc = rawdoc['_source']
+                        doc["_id"] = rawdoc["_id"]
+                        docs.append(doc)
+                    else:
+                        docs.append(rawdoc)
+                cnt += len(docs)
+                if inbatch:
+                    yield docs
+                else:
+                    for doc in docs:
+                        yield doc
+        finally:
+            # also stops slices if consumer doesn't iterate until the end
+            stop.set()
+            executor.shutdown(wait=False)
+
+        assert cnt == n, "Error: sliced scroll query terminated early [{}, {}], please retry.".format(cnt, n)
+
     @wrapper
-    def get_id_list(self, step=None, verbose=True):
+    def get_id_list(self, step=None, verbose=True, slices=None):
+        """
+        Iterate over all _ids in index. If slices is not None, a sliced scroll
+        is used (slices=0 means one slice per shard, see sliced_doc_feeder())
+        """
         step = step or self.step
-        cur = self.doc_feeder(step=step, _source=False, verbose=verbose)
+        if slices is None:
+            cur = self.doc_feeder(step=step, _source=False, verbose=verbose)
+        else:
+            cur = self.sliced_doc_feeder(slices=slices, step=step, _source=False)
         for doc in cur:
             yield doc['_id']
 
@@ -0,0 +1,183 @@
+"""
+Split large flat files (TSV, VCF, ...) in byte ranges aligned on record
+boundaries, so each range can be parsed independently, by different processes.
+
+Uncompressed files are split in place: a range is a (filename, start, end) tuple,
+and open_range() returns a file object reading only this part of the file, which
+can be passed to the usual parsing helpers (tabfile_feeder, rec_handler, ...).
+Compressed files (gzip, including bgzip) can't be read from an arbitrary offset,
+they're first decompressed into chunk files ("pre-split"), each chunk being a
+range covering the whole chunk file.
+
+Header lines are never part of a range, they're skipped when splitting.
+"""
+import os, glob
+import io
+import gzip
+
+# read from files by blocks of this size
+BLOCK_SIZE = 4 * 1024 * 1024
+COMPRESSED_EXTENSIONS = [".gz",".bgz"]
+SPLIT_FOLDER_SUFFIX = ".split"
+
+
+def find_boundary(fobj, offset, sep=b"\n", block_size=BLOCK_SIZE):
+    """
+    Return position of the first record starting at or after offset in fobj
+    (binary file object), records ending with sep. Return None if there's no
+    such record (end of file reached).
+    """
+    if offset == 0:
+        return 0
+    # start a bit before so we don't miss a separator ending right at offset
+    pos = max(offset - len(sep),0)
+    fobj.seek(pos)
+    buf = b""
+    while True:
+        data = fobj.read(block_size)
+        if not data:
+            return None
+        buf += data
+        idx = buf.find(sep)
+        if idx != -1:
+            return pos + idx + len(sep)
+        # keep enough to find a separator spanning two blocks
+        keep = len(sep) - 1
+        pos += len(buf) - keep
+        buf = buf[len(buf) - keep:]
+
+
+def skip_header(fobj, header):
+    """Skip header lines from fobj (binary file object), return position after them"""
+    for i in range(header):
+        fobj.readline()
+    return fobj.tell()
+
+
+def split_file(filename, chunk_size, sep=b"\n", header=0):
+    """
+    Split uncompressed file filename in ranges of about chunk_size bytes, aligned
+    on records ending with sep. header lines are skipped. Return a list of
+    (filename, start, end) tuples (end excluded).
+    """
+    size = os.path.getsize(filename)
+    with open(filename,"rb") as fobj:
+        boundaries = [skip_header(fobj,header)]
+        offset = boundaries[0] + chunk_size
+        while offset < size:
+            boundary = find_boundary(fobj,offset,sep)
+            if boundary is None or boundary >= size:
+                break
+            boundaries.append(boundary)
+            offset = boundary + chunk_size
+    return [(filename,start,end) for start,end in zip(boundaries,boundaries[1:] + [size]) if end > start]
+
+
+def presplit_file(filename, chunk_size, sep=b"\n", header=0, split_folder=None):
+    """
+    Decompress gzip (or bgzip) file filename into chunk files of about chunk_size
+    bytes, aligned on records ending with sep, stored in split_folder (default
+    is "<filename>.split"). header lines are skipped. Chunks are reused if more
+    recent than filename and split with the same parameters (recorded in a ".done"
+    file). Return a list of (chunk_filename, 0, chunk_size) tuples.
+    """
+    split_folder = split_folder or filename + SPLIT_FOLDER_SUFFIX
+    done_file = os.path.join(split_folder,".done")
+    params = repr((chunk_size,sep,header))
+    if os.path.exists(done_file) and os.path.getmtime(done_file) >= os.path.getmtime(filename) \
+            and open(done_file).read() == params:
+        return [(chunk,0,os.path.getsize(chunk)) for chunk in sorted(glob.glob(os.path.join(split_folder,"part_*")))]
+    os.makedirs(split_folder,exist_ok=True)
+    for chunk in glob.glob(os.path.join(split_folder,"part_*")):
+        os.unlink(chunk)
+    chunks = []
+    def new_chunk():
+        chunk = os.path.join(split_folder,"part_%05d" % len(chunks))
+        chunks.append(chunk)
+        return open(chunk,"wb")
+    with gzip.open(filename,"rb") as fobj:
+        skip_header(fobj,header)
+        out = new_chunk()
+        written = 0
+        buf = b""
+        try:
+            while True:
+                data = fobj.read(BLOCK_SIZE)
+                buf += data
+                while written + len(buf) >= chunk_size:
+                    # look for the end of a record once chunk_size is reached
+                    # (a block can hold several chunks)
+                    idx = buf.find(sep,max(chunk_size - written - len(sep),0))
+                    if idx == -1:
+                        break
+                    out.write(buf[:idx + len(sep)])
+                    out.close()
+                    buf = buf[idx + len(sep):]
+                    out = new_chunk()
+                    written = 0
+                if not data:
+                    out.write(buf)
+                    break
+                # keep enough to find a separator spanning two blocks
+                keep = len(sep) - 1
+                out.write(buf[:len(buf) - keep])
+                written += len(buf) - keep
+                buf = buf[len(buf) - keep:]
+        finally:
+            out.close()
+    # last chunk can be empty if file ends right after a separator
+    if len(chunks) > 1 and os.path.getsize(chunks[-1]) == 0:
+        os.unlink(chunks.pop())
+    with open(done_file,"w") as fout:
+        fout.write(params)
+    return [(chunk,0,os.path.getsize(chunk)) for chunk in chunks]
+
+
+def split_files(filenames, chunk_size, sep=b"\n", header=0):
+    """
+    Split files in ranges (see split_file() and presplit_file(), depending on
+    compression). Return the list of all (filename, start, end) tuples.
+    """
+    ranges = []
+    for filename in filenames:
+        if os.path.splitext(filename)[1].lower() in COMPRESSED_EXTENSIONS:
+            ranges.extend(presplit_file(filename,chunk_size,sep,header))
+        else:
+            ranges.extend(split_file(filename,chunk_size,sep,header))
+    return ranges
+
+
+class FileRange(io.RawIOBase):
+    """Raw binary file object reading filename from start to end (excluded)"""
+
+    def __init__(self, filename, start, end):
+        self.fobj = open(filename,"rb")
+        self.fobj.seek(start)
+        self.remaining = end - start
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        size = min(len(b),self.remaining)
+        if size <= 0:
+            return 0
+        data = self.fobj.read(size)
+        b[:len(data)] = data
+        self.remaining -= len(data)
+        return len(data)
+
+    def close(self):
+        self.fobj.close()
+        super(FileRange,self).close()
+
+
+def open_range(filename, start, end, mode="r", encoding="utf-8"):
+    """
+    Return a file object reading filename from start to end only, in text mode
+    (default) or binary mode ("rb").
+    """
+    fobj = io.BufferedReader(FileRange(filename,start,end),buffer_size=BLOCK_SIZE)
+    if mode == "rb":
+        return fobj
+    return io.TextIOWrapper(fobj,encoding=encoding)
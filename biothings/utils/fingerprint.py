@@ -0,0 +1,92 @@
+"""
+Per-document content fingerprints: a hash of a canonical JSON serialization
+of a document (keys sorted, no whitespace). Fingerprints are stored in a side
+collection with the same name as the collection, in a dedicated database named
+"<database>_fingerprints", with documents like {"_id": <doc _id>, "fp": <fingerprint>},
+so they don't end up in the documents themselves (and in the index), nor among
+data collections (when listing or matching collection names).
+
+Comparing fingerprints first allows to deep-diff only documents which
+actually changed.
+
+Fingerprints are only valid for a given version of the collection: a marker
+document ({"_id": META_ID, "started_at": ...}) records when the collection
+started to be built/uploaded (see biothings.utils.mongo.get_collection_timestamp()),
+fingerprints with a different (or no) marker are dropped.
+"""
+import json, hashlib
+
+from pymongo import ReplaceOne
+
+from biothings.utils.common import iter_n
+
+SUFFIX = "_fingerprints"
+META_ID = "__fingerprints_meta__"
+
+
+def doc_fingerprint(doc):
+    """Return a stable hash (hex string) for doc content"""
+    data = json.dumps(doc,sort_keys=True,separators=(",",":"),ensure_ascii=False,default=str)
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+
+def get_fingerprint_collection(col):
+    """Return side collection holding fingerprints for collection col"""
+    return col.database.client[col.database.name + SUFFIX][col.name]
+
+
+def drop_fingerprints(col):
+    get_fingerprint_collection(col).drop()
+
+
+def has_fingerprints(col):
+    """
+    Return True if fingerprints were computed for all documents in col,
+    for its current version. Outdated fingerprints are dropped.
+    """
+    # delayed import, biothings.utils.mongo depends on biothings.utils.backend
+    from biothings.utils.mongo import get_collection_timestamp
+    fpcol = get_fingerprint_collection(col)
+    if not fpcol.name in fpcol.database.collection_names():
+        return False
+    meta = fpcol.find_one({"_id": META_ID})
+    timestamp = get_collection_timestamp(col)
+    if timestamp is None or meta is None or meta.get("started_at") != timestamp:
+        drop_fingerprints(col)
+        return False
+    # marker document excluded
+    return fpcol.count() - 1 == col.count()
+
+
+def store_fingerprints(col, ids, batch_size=10000):
+    """
+    Compute and store fingerprints for documents in col matching ids.
+    Return number of fingerprints stored.
+    """
+    from biothings.utils.mongo import get_collection_timestamp
+    fpcol = get_fingerprint_collection(col)
+    fpcol.replace_one({"_id": META_ID},{"_id": META_ID, "started_at": get_collection_timestamp(col)},upsert=True)
+    cnt = 0
+    for batch_ids in iter_n(ids,batch_size):
+        ops = [ReplaceOne({"_id": doc["_id"]},{"_id": doc["_id"], "fp": doc_fingerprint(doc)},upsert=True)
+               for doc in col.find({"_id": {"$in": batch_ids}})]
+        if ops:
+            fpcol.bulk_write(ops,ordered=False)
+            cnt += len(ops)
+    return cnt
+
+
+def get_fingerprints(col, ids):
+    """Return {_id: fingerprint} for ids in col (missing ones are not returned)"""
+    fpcol = get_fingerprint_collection(col)
+    return dict([(d["_id"],d["fp"]) for d in fpcol.find({"_id": {"$in": list(ids)}})])
+
+
+def changed_ids(old_col, new_col, ids):
+    """
+    Return ids (common to old_col and new_col) for which documents may have
+    changed: fingerprints differ or are missing.
+    """
+    old_fps = get_fingerprints(old_col,ids)
+    new_fps = get_fingerprints(new_col,ids)
+    return [_id for _id in ids if old_fps.get(_id) is None or old_fps.get(_id) != new_fps.get(_id)]
@@ -0,0 +1,174 @@
+"""
+Binary, memory-mapped _id cache files (see id_feeder() in biothings.utils.mongo).
+
+File layout:
+- header: magic string, number of _ids, position of offsets table
+- data: all _ids, utf-8 encoded, concatenated
+- offsets table: (number of _ids + 1) unsigned 64-bit integers, the position
+  of each _id in data section (last one is the end of data section)
+
+Any _id (or batch of _ids) can be fetched by its index without reading
+the whole file, so consumers can slice batches by offset.
+"""
+import os, mmap, struct, tempfile, shutil
+from array import array
+
+from biothings.utils.common import open_compressed_file, iter_n
+
+MAGIC = b"BTIDC001"
+HEADER = struct.Struct("<8sQQ")
+# number of offsets kept in memory before being spilled to disk
+OFFSETS_BUFFER_SIZE = 100000
+
+
+class IdCacheError(Exception):
+    pass
+
+
+class IdCacheWriter(object):
+    """
+    Write _ids to a binary cache file, in a streaming way. Offsets are
+    spilled to a temporary file while _ids are written, then appended
+    to the data once closed, so memory usage doesn't depend on the number
+    of _ids.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.out = open(filename,"wb")
+        self.out.write(HEADER.pack(MAGIC,0,0))
+        self.offsets_out = tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(filename)))
+        self.offsets = array("Q",[0])
+        self.pos = 0
+        self.count = 0
+
+    def flush_offsets(self):
+        self.offsets.tofile(self.offsets_out)
+        self.offsets = array("Q")
+
+    def write(self, ids):
+        for _id in ids:
+            data = _id.encode()
+            self.out.write(data)
+            self.pos += len(data)
+            self.count += 1
+            self.offsets.append(self.pos)
+            if len(self.offsets) >= OFFSETS_BUFFER_SIZE:
+                self.flush_offsets()
+
+    def close(self):
+        self.flush_offsets()
+        offsets_pos = self.out.tell()
+        self.offsets_out.seek(0)
+        while True:
+            chunk = self.offsets_out.read(1024*1024)
+            if not chunk:
+                break
+            self.out.write(chunk)
+        self.offsets_out.close()
+        self.out.seek(0)
+        self.out.write(HEADER.pack(MAGIC,self.count,offsets_pos))
+        self.out.close()
+
+
+class IdCache(object):
+    """
+    Read-only access to a binary _id cache file, through mmap.
+    Can be used as a context manager:
+
+        with IdCache("cache/mycol.mmap") as cache:
+            ids = cache[1000:2000]
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.fobj = open(filename,"rb")
+        try:
+            self.mm = mmap.mmap(self.fobj.fileno(),0,access=mmap.ACCESS_READ)
+        except ValueError:
+            self.fobj.close()
+            raise IdCacheError("Cache file '%s' is empty" % filename)
+        magic,self.count,offsets_pos = HEADER.unpack_from(self.mm,0)
+        if magic != MAGIC:
+            self.close()
+            raise IdCacheError("'%s' is not a binary _id cache file" % filename)
+        self.data_pos = HEADER.size
+        self.offsets = memoryview(self.mm)[offsets_pos:offsets_pos + (self.count + 1) * 8].cast("Q")
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, idx):
+        if isinstance(idx,slice):
+            start,end,step = idx.indices(self.count)
+            if step != 1:
+                return self.get_batch(start,end)[::step]
+            return self.get_batch(start,end)
+        if idx < 0:
+            idx += self.count
+        if not 0 <= idx < self.count:
+            raise IndexError(idx)
+        return self.get_batch(idx,idx + 1)[0]
+
+    def get_batch(self, start, end):
+        """Return _ids from index start (inclusive) to end (exclusive)"""
+        end = min(end,self.count)
+        if start >= end:
+            return []
+        offsets = self.offsets[start:end + 1]
+        base = offsets[0]
+        data = self.mm[self.data_pos + base:self.data_pos + offsets[-1]]
+        return [data[offsets[i] - base:offsets[i+1] - base].decode() for i in range(len(offsets) - 1)]
+
+    def iter_batches(self, batch_size, start=0):
+        """Iterate over batches of batch_size _ids, starting from index start"""
+        for pos in range(start,self.count,batch_size):
+            yield self.get_batch(pos,pos + batch_size)
+
+    def close(self):
+        if getattr(self,"offsets",None) is not None:
+            self.offsets.release()
+            self.offsets = None
+        self.mm.close()
+        self.fobj.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def is_id_cache(filename):
+    with open(filename,"rb") as fin:
+        return fin.read(len(MAGIC)) == MAGIC
+
+
+def convert_cache(infile, outfile=None, batch_size=100000):
+    """
+    Convert a text _id cache file (one _id per line, possibly compressed)
+    into a binary cache file. If outfile isn't given, it's named after infile,
+    with any compression extension replaced by ".mmap".
+    outfile gets infile's modification time, as cache validity is checked against it.
+    Return outfile name.
+    """
+    if outfile is None:
+        base,ext = os.path.splitext(infile)
+        if not ext[1:] in ["gzip","gz","bz2","xz","lzma"]:
+            base = infile
+        outfile = base + ".mmap"
+    tmpfile = "%s._tmp_" % outfile
+    writer = IdCacheWriter(tmpfile)
+    try:
+        with open_compressed_file(infile) as fin:
+            for lines in iter_n(fin,batch_size):
+                writer.write([l.strip().decode() for l in lines if l.strip()])
+        writer.close()
+    except Exception:
+        writer.close()
+        os.remove(tmpfile)
+        raise
+    # converting doesn't make an outdated cache any fresher
+    shutil.copystat(infile,tmpfile)
+    os.rename(tmpfile,outfile)
+    return outfile
@@ -23,6 +23,8 @@ SOFTWARE.
 '''
 
 
+import difflib
+
 __all__ = ["make",] 
 
 def _store_index(a, x, v):
@@ -286,7 +288,119 @@ def _compare_values(path, key, info, src, dst, use_list_ops=False):
     else:
         _item_replaced(path, key, info, dst)
 
-def make(src, dst, use_list_ops=False, **kwargs):
+class _hashed_compare(object):
+    """
+    Diff engine matching list elements by structural hash (or by one of
+    list_keys fields, for lists of dicts) using difflib.SequenceMatcher,
+    instead of pairwise comparisons. Equal subtrees are short-circuited, and
+    only list elements between common head and tail are hashed (once, hashes
+    are cached by object id). Operations are produced in application order,
+    list indexes being those of the list being patched at that point.
+    """
+
+    def __init__(self, use_list_ops=True, list_keys=None):
+        self.use_list_ops = use_list_ops
+        self.list_keys = list_keys or []
+        self.ops = []
+        # id(value) => (hash, value), value is kept so its id can't be reused
+        self.hashes = {}
+
+    def hash(self, value):
+        if isinstance(value, dict):
+            _id = id(value)
+            if not _id in self.hashes:
+                self.hashes[_id] = (hash(("dict", frozenset([(k, self.hash(v)) for (k, v) in value.items()]))), value)
+            return self.hashes[_id][0]
+        elif isinstance(value, list):
+            _id = id(value)
+            if not _id in self.hashes:
+                self.hashes[_id] = (hash(("list", tuple([self.hash(v) for v in value]))), value)
+            return self.hashes[_id][0]
+        else:
+            try:
+                return hash(value)
+            except TypeError:
+                return hash(repr(value))
+
+    def item_key(self, item):
+        if self.list_keys and isinstance(item, dict):
+            for field in self.list_keys:
+                if field in item:
+                    return ("key", field, self.hash(item[field]))
+        return ("hash", self.hash(item))
+
+    def compare_values(self, path, key, src, dst):
+        if src == dst:
+            return
+        elif isinstance(src, dict) and isinstance(dst, dict):
+            self.compare_dicts(_path_join(path, key), src, dst)
+        elif isinstance(src, list) and isinstance(dst, list):
+            self.compare_lists(_path_join(path, key), src, dst)
+        else:
+            self.ops.append({'op': 'replace', 'path': _path_join(path, key), 'value': dst})
+
+    def compare_dicts(self, path, src, dst):
+        for key in src:
+            if not key in dst:
+                self.ops.append({'op': 'remove', 'path': _path_join(path, key)})
+        for key in dst:
+            if not key in src:
+                self.ops.append({'op': 'add', 'path': _path_join(path, key), 'value': dst[key]})
+        for key in src:
+            if key in dst:
+                self.compare_values(path, key, src[key], dst[key])
+
+    def compare_lists(self, path, src, dst):
+        if not self.use_list_ops:
+            # already known to be different
+            self.ops.append({'op': 'replace', 'path': path, 'value': dst})
+            return
+        # common (equal) head and tail
+        head = 0
+        max_head = min(len(src), len(dst))
+        while head < max_head and src[head] == dst[head]:
+            head += 1
+        tail = 0
+        max_tail = max_head - head
+        while tail < max_tail and src[-tail - 1] == dst[-tail - 1]:
+            tail += 1
+        if len(src) == len(dst):
+            # elements modified in place (most of them still equal at the same
+            # position): compare them by position, no need to match them
+            changed = [idx for idx in range(head, len(src) - tail) if src[idx] != dst[idx]]
+            if len(changed) * 2 <= len(src) - tail - head:
+                for idx in changed:
+                    self.compare_values(path, idx, src[idx], dst[idx])
+                return
+        matcher = difflib.SequenceMatcher(None, [self.item_key(item) for item in src[head:len(src) - tail]],
+                                          [self.item_key(item) for item in dst[head:len(dst) - tail]],
+                                          autojunk=False)
+        for (tag, i1, i2, j1, j2) in matcher.get_opcodes():
+            # list being patched contains dst[:j1] then src[i1:] at this point
+            i1, i2, j1, j2 = i1 + head, i2 + head, j1 + head, j2 + head
+            common = min(i2 - i1, j2 - j1)
+            for k in range(common):
+                self.compare_values(path, j1 + k, src[i1 + k], dst[j1 + k])
+            for k in range(i2 - i1 - common):
+                self.ops.append({'op': 'remove', 'path': _path_join(path, j1 + common)})
+            for k in range(common, j2 - j1):
+                self.ops.append({'op': 'add', 'path': _path_join(path, j1 + k), 'value': dst[j1 + k]})
+
+def make(src, dst, use_list_ops=False, hashed=False, list_keys=None, **kwargs):
+    """
+    Return a jsonpatch (list of operations) transforming src into dst.
+    If use_list_ops is False, lists are replaced as a whole when different,
+    otherwise list elements are added/removed/replaced.
+    If hashed is True, a diff engine based on structural hashes is used (see
+    _hashed_compare), faster on big documents and long lists. Elements of lists
+    of dicts are then matched using the first field in list_keys they contain
+    (eg. ["_id","rsid"]), if any, or their content otherwise.
+    Note: patches with list operations can't be safely re-applied.
+    """
+    if hashed:
+        comp = _hashed_compare(use_list_ops=use_list_ops, list_keys=list_keys)
+        comp.compare_values('', None, src, dst)
+        return comp.ops
     info = _compare_info()
     _compare_values('', None, info, src, dst, use_list_ops=use_list_ops)
     return [op for op in info.execute()]
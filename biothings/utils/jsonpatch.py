@@ -41,6 +41,7 @@ import inspect
 import itertools
 import json
 import sys
+import time
 
 try:
     from collections.abc import MutableMapping, MutableSequence
@@ -117,6 +118,59 @@ def get_loadjson():
 json.load = get_loadjson()
 
 
+# Parsed JSON pointers are cached by path: patches produced for documents of
+# a same collection mostly share the same paths
+POINTER_CACHE_SIZE = 100000
+
+@functools.lru_cache(maxsize=POINTER_CACHE_SIZE)
+def get_pointer(path):
+    """Return a (cached) JsonPointer for path"""
+    return JsonPointer(path)
+
+
+def compile_patch(patch):
+    """Return a JsonPatch for patch (list of operations, JSON string or
+    JsonPatch), with operations parsed once, so it can be applied many times.
+    """
+    if isinstance(patch, JsonPatch):
+        return patch
+    elif isinstance(patch, basestring):
+        patch = JsonPatch.from_string(patch)
+    else:
+        patch = JsonPatch(patch)
+    # parse operations now
+    patch._ops
+    return patch
+
+
+def apply_patches(docs_patches, ignore_conflicts=False):
+    """Apply patches to documents, in place (documents are modified).
+
+    :param docs_patches: iterable of (document, patch) tuples.
+
+    :return: (patched docs, conflicting docs, stats) tuple. Documents raising
+             a conflict aren't in patched docs, and could be partially patched.
+             stats contains number of docs and operations, and time spent
+             compiling and applying patches.
+    """
+    patched = []
+    conflicts = []
+    stats = {"docs": 0, "operations": 0, "compile_time": 0.0, "apply_time": 0.0}
+    for doc, patch in docs_patches:
+        t0 = time.time()
+        patch = compile_patch(patch)
+        t1 = time.time()
+        stats["compile_time"] += t1 - t0
+        try:
+            patched.append(patch.apply(doc, in_place=True, ignore_conflicts=ignore_conflicts))
+        except JsonPatchConflict:
+            conflicts.append(doc)
+        stats["apply_time"] += time.time() - t1
+        stats["docs"] += 1
+        stats["operations"] += len(patch._ops)
+    return patched, conflicts, stats
+
+
 def apply_patch(doc, patch, in_place=False, ignore_conflicts=False, verify=False):
     """Apply list of patches to specified json document.
 
@@ -236,6 +290,8 @@ class JsonPatch(object):
     """
     def __init__(self, patch):
         self.patch = patch
+        # parsed operations, see _ops
+        self._compiled = None
 
         self.operations = {
             'remove': RemoveOperation,
@@ -344,7 +400,9 @@ class JsonPatch(object):
 
     @property
     def _ops(self):
-        return tuple(map(self._get_operation, self.patch))
+        if self._compiled is None:
+            self._compiled = tuple(map(self._get_operation, self.patch))
+        return self._compiled
 
     def apply(self, orig_obj, in_place=False, ignore_conflicts=False, verify=False):
         """Applies the patch to given object.
@@ -412,7 +470,7 @@ class PatchOperation(object):
 
     def __init__(self, operation):
         self.location = operation['path']
-        self.pointer = JsonPointer(self.location)
+        self.pointer = get_pointer(self.location)
         self.operation = operation
 
     def apply(self, obj):
@@ -514,7 +572,7 @@ class MoveOperation(PatchOperation):
 
     def apply(self, obj):
         try:
-            from_ptr = JsonPointer(self.operation['from'])
+            from_ptr = get_pointer(self.operation['from'])
         except KeyError as ex:
             raise InvalidJsonPatch(
                 "The operation does not contain a 'from' member")
@@ -579,7 +637,7 @@ class CopyOperation(PatchOperation):
 
     def apply(self, obj):
         try:
-            from_ptr = JsonPointer(self.operation['from'])
+            from_ptr = get_pointer(self.operation['from'])
         except KeyError as ex:
             raise InvalidJsonPatch(
                 "The operation does not contain a 'from' member")
@@ -3,11 +3,13 @@ import time, logging, os, io, glob, datetime
 from functools import wraps
 from pymongo import MongoClient
 from pymongo.collection import Collection
+from pymongo.errors import OperationFailure
 from functools import partial
 
 from biothings.utils.common import timesofar, get_random_string, iter_n, \
                                    open_compressed_file, get_compressed_outfile
 from biothings.utils.backend import DocESBackend, DocMongoBackend
+from biothings.utils.idcache import IdCache, IdCacheWriter, HEADER as IDCACHE_HEADER
 # stub, until set to real config module
 config = None
 
@@ -199,11 +201,33 @@ def doc_feeder(collection, step=1000, s=None, e=None, inbatch=False, query=None,
     finally:
         cur.close()
 
+@requires_config
+def get_collection_timestamp(col):
+    """
+    Return the datetime at which collection col started to be built (target
+    collection, from src_build) or uploaded (source collection, from src_dump),
+    or None if unknown
+    """
+    if isinstance(col,DocMongoBackend):
+        col = col.target_collection
+    src_db = get_src_db()
+    try:
+        if col.database.name == config.DATA_TARGET_DATABASE:
+            info = src_db["src_build"].find_one({"_id": col.name})
+            return info and info["started_at"] or None
+        elif col.database.name == config.DATA_SRC_DATABASE:
+            info = src_db["src_dump"].find_one({"$where":"function() {if(this.upload) {for(var index in this.upload.jobs) {if(this.upload.jobs[index].step == \"%s\") return this;}}}" % col.name})
+            return info and info["upload"]["jobs"][col.name]["started_at"] or None
+    except KeyError:
+        pass
+    return None
+
+
 # TODO: this func deals with different backend, should not be in bt.utils.mongo
 # and doc_feeder should do the same as this function regarding backend support
 @requires_config
 def id_feeder(col, batch_size=1000, build_cache=True, logger=logging,
-              force_use=False, force_build=False):
+              force_use=False, force_build=False, skip=0):
     """Return an iterator for all _ids in collection "col"
        Search for a valid cache file if available, if not
        return a doc_feeder for that collection. Valid cache is
@@ -215,6 +239,10 @@ def id_feeder(col, batch_size=1000, build_cache=True, logger=logging,
        it's valid of not.
        "force_build" True will build a new cache even if current one exists
        and is valid.
+       "skip" is the number of _ids to skip before returning first batch. If
+       config.CACHE_FORMAT is "mmap", cache file is a binary file (see
+       biothings.utils.idcache) and skipping is done without reading the
+       skipped _ids. Cache isn't built when skip is used.
     """
     src_db = get_src_db()
     ts = None
@@ -254,7 +282,7 @@ def id_feeder(col, batch_size=1000, build_cache=True, logger=logging,
         cache_file = get_cache_filename(col.name)
         try:
             # size of empty file differs depending on compression
-            empty_size = {None:0,"xz":32,"gzip":25,"bz2":14}
+            empty_size = {None:0,"xz":32,"gzip":25,"bz2":14,"mmap":IDCACHE_HEADER.size + 8}
             if force_build:
                 logger.warning("Force building cache file")
                 use_cache = False
@@ -275,17 +303,30 @@ def id_feeder(col, batch_size=1000, build_cache=True, logger=logging,
             pass
     if use_cache:
         logger.debug("Found valid cache file for '%s': %s" % (col.name,cache_file))
+        if cache_format == "mmap":
+            with IdCache(cache_file) as cache:
+                for ids in cache.iter_batches(batch_size,start=skip):
+                    yield ids
+            return
         with open_compressed_file(cache_file) as cache_in:
             if cache_format:
                 iocache = io.TextIOWrapper(cache_in)
             else:
                 iocache = cache_in
+            iocache = (_id.strip() for _id in iocache if _id.strip())
             for ids in iter_n(iocache,batch_size):
-                yield [_id.strip() for _id in ids if _id.strip()]
+                if skip >= len(ids):
+                    skip -= len(ids)
+                    continue
+                yield list(ids[skip:])
+                skip = 0
     else:
         logger.debug("No cache file found (or invalid) for '%s', use doc_feeder" % col.name)
         cache_out = None
         cache_temp = None
+        if skip:
+            logger.info("Skipping %d _ids, cache won't be built" % skip)
+            build_cache = False
         if getattr(config,"CACHE_FOLDER",None) and config.CACHE_FOLDER and build_cache:
             if not os.path.exists(config.CACHE_FOLDER):
                 os.makedirs(config.CACHE_FOLDER)
@@ -296,21 +337,28 @@ def id_feeder(col, batch_size=1000, build_cache=True, logger=logging,
                 os.remove(tmpcache)
             # use temp file and rename once done
             cache_temp = "%s%s" % (cache_temp,get_random_string())
-            cache_out = get_compressed_outfile(cache_temp,compress=cache_format)
+            if cache_format == "mmap":
+                cache_out = IdCacheWriter(cache_temp)
+            else:
+                cache_out = get_compressed_outfile(cache_temp,compress=cache_format)
             logger.info("Building cache file '%s'" % cache_temp)
         else:
             logger.info("Can't build cache, cache not allowed or no cache folder")
             build_cache = False
         if isinstance(col,Collection):
-            doc_feeder_func = partial(doc_feeder,col, step=batch_size, inbatch=True, fields={"_id":1})
+            doc_feeder_func = partial(doc_feeder,col, step=batch_size, s=skip, inbatch=True, fields={"_id":1})
         elif isinstance(col,DocMongoBackend):
-            doc_feeder_func = partial(doc_feeder,col.target_collection, step=batch_size, inbatch=True, fields={"_id":1})
+            doc_feeder_func = partial(doc_feeder,col.target_collection, step=batch_size, s=skip, inbatch=True, fields={"_id":1})
         elif isinstance(col,DocESBackend):
             # get_id_list directly return the _id, wrap it to match other 
             # doc_feeder_func returned vals. Also return a batch of id
             def wrap_id():
                 ids = []
-                for _id in col.get_id_list(step=batch_size):
+                # sliced scroll (ES >= 5) only if configured (0: one slice per shard)
+                slices = getattr(config,"ES_SCROLL_SLICES",None)
+                for i,_id in enumerate(col.get_id_list(step=batch_size,slices=slices)):
+                    if i < skip:
+                        continue
                     ids.append({"_id":_id})
                     if len(ids) >= batch_size:
                         yield ids
@@ -323,12 +371,15 @@ def id_feeder(col, batch_size=1000, build_cache=True, logger=logging,
         for doc_ids in doc_feeder_func():
             doc_ids = [_doc["_id"] for _doc in doc_ids]
             if build_cache:
-                strout = "\n".join(doc_ids) + "\n"
-                if cache_format:
-                    # assuming binary format (b/ccompressed)
-                    cache_out.write(strout.encode())
+                if cache_format == "mmap":
+                    cache_out.write(doc_ids)
                 else:
-                    cache_out.write(strout)
+                    strout = "\n".join(doc_ids) + "\n"
+                    if cache_format:
+                        # assuming binary format (b/ccompressed)
+                        cache_out.write(strout.encode())
+                    else:
+                        cache_out.write(strout)
             yield doc_ids
         if build_cache:
             cache_out.close()
@@ -336,6 +387,85 @@ def id_feeder(col, batch_size=1000, build_cache=True, logger=logging,
             os.rename(cache_temp,cache_final)
 
 
+def sorted_id_feeder(col, batch_size=10000, logger=logging):
+    """
+    Iterate over all _ids in collection "col", in ascending order (walking
+    the _id index), one _id at a time.
+    """
+    if isinstance(col,DocMongoBackend):
+        col = col.target_collection
+    logger.info("Fetching sorted _ids from '%s'" % col.name)
+    cur = col.find({},projection={"_id":1},no_cursor_timeout=True).sort("_id",1).batch_size(batch_size)
+    try:
+        for doc in cur:
+            yield doc["_id"]
+    finally:
+        cur.close()
+
+
+def _id_type(_id):
+    # numbers are compared to each other whatever their type
+    if isinstance(_id,(int,float)) and not isinstance(_id,bool):
+        return "number"
+    return type(_id)
+
+
+def has_mixed_id_types(col):
+    """
+    Return True if collection "col" contains _ids of different types. _ids
+    are sorted by type first, so smallest and biggest _ids are enough
+    """
+    if isinstance(col,DocMongoBackend):
+        col = col.target_collection
+    first = list(col.find({},projection={"_id":1}).sort("_id",1).limit(1))
+    last = list(col.find({},projection={"_id":1}).sort("_id",-1).limit(1))
+    if not first:
+        return False
+    return _id_type(first[0]["_id"]) != _id_type(last[0]["_id"])
+
+
+def get_id_boundaries(col, batch_size=100000, logger=logging):
+    """
+    Return a sorted list of _id split points for collection "col", such as
+    each range [split_i, split_i+1[ holds about "batch_size" documents. First
+    range starts from the smallest _id, last one ends with the biggest _id,
+    so these are not part of the list (empty list means one single range).
+    Split points are asked to the server ("splitVector" command), and if not
+    allowed, computed by walking the _id index.
+    Range queries on _id only match _ids of the bounds' type (type bracketing),
+    so if _ids are of different types (eg. numbers and strings), None is
+    returned: the collection can't be split in ranges.
+    """
+    if isinstance(col,DocMongoBackend):
+        col = col.target_collection
+    if has_mixed_id_types(col):
+        logger.warning("'%s' has _ids of different types, can't split it in _id ranges" % col.name)
+        return None
+    try:
+        stats = col.database.command("collstats",col.name)
+        # splitVector splits in half, so give room for batch_size docs
+        max_bytes = max(int(stats.get("avgObjSize",0) * batch_size * 2),1024*1024)
+        res = col.database.command("splitVector","%s.%s" % (col.database.name,col.name),
+                                   keyPattern={"_id":1},maxChunkSizeBytes=max_bytes,
+                                   maxChunkObjects=batch_size)
+        splits = [key["_id"] for key in res["splitKeys"]]
+        logger.info("Got %d split points for '%s' from server" % (len(splits),col.name))
+        return splits
+    except OperationFailure as e:
+        logger.info("Can't get split points from server for '%s' (%s), walking _id index" % (col.name,e))
+    splits = []
+    query = {}
+    while True:
+        # only _id is returned, query is covered by _id index
+        docs = list(col.find(query,projection={"_id":1}).sort("_id",1).skip(batch_size).limit(1))
+        if not docs:
+            break
+        splits.append(docs[0]["_id"])
+        query = {"_id" : {"$gte" : docs[0]["_id"]}}
+    logger.info("Found %d split points for '%s'" % (len(splits),col.name))
+    return splits
+
+
 def src_clean_archives(keep_last=1, src=None, verbose=True, noconfirm=False):
     '''clean up archive collections in src db, only keep last <kepp_last>
        number of archive.
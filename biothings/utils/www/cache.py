@@ -0,0 +1,87 @@
+''' In-process cache for web API responses. '''
+import json
+import time
+from collections import OrderedDict
+
+class ResponseCache(object):
+    ''' Size-bounded LRU cache, with a TTL, for transformed Elasticsearch responses.
+    Keys contain the index build version (from ``_meta``), which is checked at most every
+    ``version_check_interval`` seconds. When the build version of an index changes, all entries
+    for that index are dropped.
+
+    :param size: maximum number of responses kept in cache
+    :param ttl: number of seconds a response is kept in cache
+    :param version_check_interval: number of seconds between two build version checks on an index'''
+    def __init__(self, size=1000, ttl=300, version_check_interval=60):
+        self.size = size
+        self.ttl = ttl
+        self.version_check_interval = version_check_interval
+        self._cache = OrderedDict()
+        # index => (build version, last check timestamp)
+        self._versions = {}
+        self.stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evictions': 0, 'invalidations': 0}
+
+    def need_version_check(self, index):
+        ''' Return True if the build version of ``index`` needs to be checked again. '''
+        return index not in self._versions or \
+            time.time() - self._versions[index][1] > self.version_check_interval
+
+    def get_version(self, index):
+        return self._versions.get(index, (None, None))[0]
+
+    def set_version(self, index, version):
+        ''' Register the current build ``version`` of ``index``, invalidating cached
+        responses if it has changed. '''
+        if index in self._versions and self._versions[index][0] != version:
+            self.invalidate(index)
+        self._versions[index] = (version, time.time())
+
+    def make_key(self, index, *args):
+        ''' Return a cache key for ``index`` (at its current build version), from ``args`` (anything
+        JSON serializable identifying the request, like the method, path and query options).
+        Dictionaries are serialized with sorted keys, so the key doesn't depend on options order. '''
+        return (index, self.get_version(index), json.dumps(args, sort_keys=True, default=str))
+
+    def get(self, key):
+        ''' Return cached response for ``key``, None if not cached or expired. '''
+        _entry = self._cache.get(key)
+        if _entry is None:
+            self.stats['misses'] += 1
+            return None
+        (_value, _expires) = _entry
+        if _expires < time.time():
+            self._cache.pop(key)
+            self.stats['expired'] += 1
+            self.stats['misses'] += 1
+            return None
+        self._cache.move_to_end(key)
+        self.stats['hits'] += 1
+        return _value
+
+    def set(self, key, value):
+        ''' Cache response ``value`` for ``key``, evicting least recently used responses if full. '''
+        self._cache[key] = (value, time.time() + self.ttl)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.size:
+            self._cache.popitem(last=False)
+            self.stats['evictions'] += 1
+
+    def invalidate(self, index=None):
+        ''' Drop cached responses for ``index``, or all of them if ``index`` is None. '''
+        if index is None:
+            self._cache.clear()
+        else:
+            for key in [k for k in self._cache if k[0] == index]:
+                self._cache.pop(key)
+        self.stats['invalidations'] += 1
+
+    def get_stats(self):
+        ''' Return hit/miss statistics, current size, and known build versions. '''
+        _stats = dict(self.stats)
+        _total = _stats['hits'] + _stats['misses']
+        _stats['hit_ratio'] = round(_stats['hits'] / _total, 4) if _total else 0.0
+        _stats['size'] = len(self._cache)
+        _stats['max_size'] = self.size
+        _stats['ttl'] = self.ttl
+        _stats['versions'] = dict([(k, v[0]) for (k, v) in self._versions.items()])
+        return _stats
@@ -1,3 +1,5 @@
+from tornado import gen
+from tornado.concurrent import is_future
 from biothings.www.api.helper import BaseHandler
 from biothings.utils.common import dotdict, is_str
 import re
@@ -26,6 +28,17 @@ class BaseESRequestHandler(BaseHandler):
         self.ga_track(event=self.ga_event_object(ga_event_data))
         return
 
+    def _should_stream(self, data):
+        ''' Return True if ``data`` should be streamed, see ``STREAM_RESPONSE_MIN_SIZE`` setting. '''
+        _min_size = self.web_settings.STREAM_RESPONSE_MIN_SIZE
+        return bool(_min_size) and isinstance(data, list) and len(data) >= _min_size
+
+    @gen.coroutine
+    def _stream_data_and_track(self, data, ga_event_data={}):
+        ''' Same as `_return_data_and_track`, but streams ``data`` (a list) with chunked transfer.'''
+        yield self.return_json_stream(data)
+        self.ga_track(event=self.ga_event_object(ga_event_data))
+
     def return_raw_query_json(self, query):
         '''Return valid JSON if `rawquery` option is selected.
         This is necessary as queries can span multiple lines (POST)'''
@@ -108,6 +121,61 @@ class BaseESRequestHandler(BaseHandler):
         ''' Override to change doc_type for this request. '''
         return self.web_settings.ES_DOC_TYPE
 
+    def _get_es_backend(self, options):
+        ''' Instantiate ``ES_QUERY`` class for this request.  An asynchronous one (`AsyncESQuery`_) also
+        gets the thread pool from web settings.  msearch slicing settings are set as attributes, so
+        ``ES_QUERY`` constructor signature doesn't change. '''
+        from biothings.www.api.es.query import AsyncESQuery
+        _kwargs = {'client': self.web_settings.es_client, 'options': options.es_kwargs}
+        if issubclass(self.web_settings.ES_QUERY, AsyncESQuery):
+            _kwargs['executor'] = self.web_settings.es_query_executor
+        _backend = self.web_settings.ES_QUERY(**_kwargs)
+        if getattr(self.web_settings, 'ES_MSEARCH_CHUNK_SIZE', 0):
+            _backend.msearch_chunk_size = self.web_settings.ES_MSEARCH_CHUNK_SIZE
+            _backend.msearch_executor = self.web_settings.es_msearch_executor
+        return _backend
+
+    @gen.coroutine
+    def _execute_query(self, query_func, query_kwargs):
+        ''' Run ``query_func`` (an ``ES_QUERY`` function) with ``query_kwargs``.  If it returns a future
+        (asynchronous ``ES_QUERY``), wait for the result without blocking the IOLoop. '''
+        res = query_func(query_kwargs)
+        if is_future(res):
+            res = yield res
+        return res
+
+    def _get_build_version(self, res):
+        ''' Return the build version from a metadata query result. Override if stored elsewhere. '''
+        _index = next(iter(res))
+        _doc_type = next(iter(res[_index]['mappings']))
+        return res[_index]['mappings'][_doc_type].get('_meta', {}).get('build_version')
+
+    @gen.coroutine
+    def _get_cached_response(self, options, query_builder, backend):
+        ''' Return a (cache key, cached response) tuple for this request. Cached response is None if not
+        found, and both are None if the response can't be cached (cache disabled, raw query, scroll...).
+        The index build version is checked (using the metadata query) when needed, so a new build
+        invalidates cached responses. '''
+        _cache = self.web_settings.response_cache
+        if (not _cache or options.control_kwargs.rawquery or options.control_kwargs.scroll_id or
+            options.esqb_kwargs.fetch_all):
+            return (None, None)
+        _index = self._get_es_index(options)
+        if _cache.need_version_check(_index):
+            try:
+                _res = yield self._execute_query(backend.metadata_query, query_builder.metadata_query())
+                _cache.set_version(_index, self._get_build_version(_res))
+            except Exception:
+                self.log_exceptions("Error getting build version for response cache")
+                return (None, None)
+        _key = _cache.make_key(_index, self.request.method, self.request.path, options)
+        return (_key, _cache.get(_key))
+
+    def _cache_response(self, key, res):
+        ''' Store response ``res`` in cache (``key`` from `_get_cached_response`), if cacheable. '''
+        if key is not None and res:
+            self.web_settings.response_cache.set(key, res)
+
     def _pre_query_builder_GET_hook(self, options):
         ''' Override me. '''
         return options
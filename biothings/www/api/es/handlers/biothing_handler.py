@@ -1,4 +1,5 @@
 from tornado.web import HTTPError
+from tornado import gen
 from biothings.www.api.es.handlers.base_handler import BaseESRequestHandler
 from biothings.utils.www import sum_arg_dicts
 from biothings.www.api.helper import BiothingParameterTypeError
@@ -37,6 +38,7 @@ class BiothingHandler(BaseESRequestHandler):
         ''' subclass to redirect based on a regex pattern (or whatever)...'''
         pass
 
+    @gen.coroutine
     def get(self, bid=None):
         ''' Handle a GET to the annotation lookup endpoint.'''
         if not bid:
@@ -74,11 +76,20 @@ class BiothingHandler(BaseESRequestHandler):
                 regex_list=self.web_settings.ANNOTATION_ID_REGEX_LIST, index=self._get_es_index(options),
                 doc_type=self._get_es_doc_type(options), es_options=options.es_kwargs, 
                 default_scopes=self.web_settings.DEFAULT_SCOPES)
-        _backend = self.web_settings.ES_QUERY(client=self.web_settings.es_client, options=options.es_kwargs)
+        _backend = self._get_es_backend(options)
         _result_transformer = self.web_settings.ES_RESULT_TRANSFORMER(options=options.transform_kwargs, 
             host=self.request.host, doc_url_function=self.web_settings.doc_url,
             output_aliases=self.web_settings.OUTPUT_KEY_ALIASES, jsonld_context=self.web_settings._jsonld_context)
         
+        ###################################################
+        #           Check response cache
+        ###################################################
+
+        _cache_key, _cached_res = yield self._get_cached_response(options, _query_builder, _backend)
+        if _cached_res is not None:
+            self._return_data_and_track(_cached_res)
+            return
+
         ###################################################
         #                Build query    
         ###################################################
@@ -100,7 +111,7 @@ class BiothingHandler(BaseESRequestHandler):
         ###################################################
 
         try:
-            res = _backend.annotation_GET_query(_query)
+            res = yield self._execute_query(_backend.annotation_GET_query, _query)
         except Exception:
             self.log_exceptions("Error executing query")
             raise HttpError(404)
@@ -132,10 +143,13 @@ class BiothingHandler(BaseESRequestHandler):
 
         res = self._pre_finish_GET_hook(options, res)
 
+        self._cache_response(_cache_key, res)
+
         self._return_data_and_track(res)
 
     ###########################################################################
 
+    @gen.coroutine
     def post(self, ids=None):
         ''' Handle a POST to the annotation lookup endpoint '''
         
@@ -173,11 +187,20 @@ class BiothingHandler(BaseESRequestHandler):
         _query_builder = self.web_settings.ES_QUERY_BUILDER(options=options.esqb_kwargs,
             regex_list=self.web_settings.ANNOTATION_ID_REGEX_LIST, index=self._get_es_index(options),
             doc_type=self._get_es_doc_type(options), es_options=options.es_kwargs, default_scopes=self.web_settings.DEFAULT_SCOPES)
-        _backend = self.web_settings.ES_QUERY(client=self.web_settings.es_client, options=options.es_kwargs)
+        _backend = self._get_es_backend(options)
         _result_transformer = self.web_settings.ES_RESULT_TRANSFORMER(options=options.transform_kwargs, 
             host=self.request.host, doc_url_function=self.web_settings.doc_url,
             jsonld_context=self.web_settings._jsonld_context, output_aliases=self.web_settings.OUTPUT_KEY_ALIASES)
         
+        ###################################################
+        #           Check response cache
+        ###################################################
+
+        _cache_key, _cached_res = yield self._get_cached_response(options, _query_builder, _backend)
+        if _cached_res is not None:
+            self._return_data_and_track(_cached_res, ga_event_data={'qsize': len(options.control_kwargs.ids)})
+            return
+
         ###################################################
         #           Build query    
         ###################################################
@@ -202,7 +225,7 @@ class BiothingHandler(BaseESRequestHandler):
         ###################################################
 
         try:
-            res = _backend.annotation_POST_query(_query)
+            res = yield self._execute_query(_backend.annotation_POST_query, _query)
         except TypeError as e:
             self.log_exceptions("Error executing annotation POST query")
             self._return_data_and_track({'success': False, 'error': 'Error executing query'},
@@ -232,5 +255,10 @@ class BiothingHandler(BaseESRequestHandler):
  
         res = self._pre_finish_POST_hook(options, res)
 
+        self._cache_response(_cache_key, res)
+
         # return and track
-        self._return_data_and_track(res, ga_event_data={'qsize': len(options.control_kwargs.ids)})
+        if self._should_stream(res):
+            yield self._stream_data_and_track(res, ga_event_data={'qsize': len(options.control_kwargs.ids)})
+        else:
+            self._return_data_and_track(res, ga_event_data={'qsize': len(options.control_kwargs.ids)})
@@ -1,4 +1,5 @@
 from tornado.web import HTTPError
+from tornado import gen
 from biothings.www.api.es.handlers.base_handler import BaseESRequestHandler
 from biothings.utils.www import sum_arg_dicts
 import logging
@@ -19,6 +20,7 @@ class MetadataHandler(BaseESRequestHandler):
         logging.debug("MetadataHandler - {}".format(self.request.method))
         logging.debug("Kwarg settings: {}".format(self.kwarg_settings))
 
+    @gen.coroutine
     def get(self):
         ''' Handle a GET to the metadata endpoint.  Also handles /metadata/fields. '''
         kwargs = self.get_query_params()
@@ -36,7 +38,7 @@ class MetadataHandler(BaseESRequestHandler):
         # Instantiate query builder, query and transform classes
         _query_builder = self.web_settings.ES_QUERY_BUILDER(options=options.esqb_kwargs,
             index=self._get_es_index(options), doc_type=self._get_es_doc_type(options), es_options=options.es_kwargs)
-        _backend = self.web_settings.ES_QUERY(client=self.web_settings.es_client, options=options.es_kwargs)
+        _backend = self._get_es_backend(options)
         _result_transformer = self.web_settings.ES_RESULT_TRANSFORMER(options=options.transform_kwargs, 
                     host=self.request.host, app_dir=self.web_settings._app_git_repo)
 
@@ -58,7 +60,7 @@ class MetadataHandler(BaseESRequestHandler):
         _query = self._pre_query_GET_hook(options, _query)
 
         try:
-            res = _backend.metadata_query(_query)
+            res = yield self._execute_query(_backend.metadata_query, _query)
         except Exception:
             self.log_exceptions("Error running query")
             self.return_json({'success': False, 'error': 'Error executing query'})
@@ -1,4 +1,5 @@
 from tornado.web import HTTPError
+from tornado import gen
 from biothings.www.api.es.handlers.base_handler import BaseESRequestHandler
 from biothings.www.api.es.transform import ScrollIterationDone
 from biothings.www.api.es.query import BiothingScrollError, BiothingSearchError
@@ -38,6 +39,7 @@ class QueryHandler(BaseESRequestHandler):
         ''' Override me. '''
         return res
 
+    @gen.coroutine
     def get(self):
         ''' Handle a GET to the query endpoint. '''
         ###################################################
@@ -80,11 +82,20 @@ class QueryHandler(BaseESRequestHandler):
             es_options=options.es_kwargs, userquery_dir=self.web_settings.USERQUERY_DIR,
             scroll_options={'scroll': self.web_settings.ES_SCROLL_TIME, 'size': self.web_settings.ES_SCROLL_SIZE},
             default_scopes=self.web_settings.DEFAULT_SCOPES)
-        _backend = self.web_settings.ES_QUERY(client=self.web_settings.es_client, options=options.es_kwargs)
+        _backend = self._get_es_backend(options)
         _result_transformer = self.web_settings.ES_RESULT_TRANSFORMER(options=options.transform_kwargs, 
             host=self.request.host, jsonld_context=self.web_settings._jsonld_context, 
             doc_url_function=self.web_settings.doc_url, output_aliases=self.web_settings.OUTPUT_KEY_ALIASES)
 
+        ###################################################
+        #           Check response cache
+        ###################################################
+
+        _cache_key, _cached_res = yield self._get_cached_response(options, _query_builder, _backend)
+        if _cached_res is not None:
+            self._return_data_and_track(_cached_res, ga_event_data={'total': _cached_res.get('total', 0)})
+            return
+
         ###################################################
         #           Scroll request pipeline
         ###################################################
@@ -106,7 +117,7 @@ class QueryHandler(BaseESRequestHandler):
             ###################################################
 
             try:
-                res = _backend.scroll(_query)
+                res = yield self._execute_query(_backend.scroll, _query)
             except BiothingScrollError as e:
                 self._return_data_and_track({'success': False, 'error': '{}'.format(e)}, ga_event_data={'total': 0})
                 return
@@ -160,7 +171,7 @@ class QueryHandler(BaseESRequestHandler):
             ###################################################
 
             try:
-                res = _backend.query_GET_query(_query)
+                res = yield self._execute_query(_backend.query_GET_query, _query)
             except BiothingSearchError as e:
                 self._return_data_and_track({'success': False, 'error': '{0}'.format(e)}, ga_event_data={'total': 0})
                 return
@@ -194,6 +205,8 @@ class QueryHandler(BaseESRequestHandler):
 
         res = self._pre_finish_GET_hook(options, res)
 
+        self._cache_response(_cache_key, res)
+
         # return and track
         self.return_json(res)
         if options.control_kwargs.fetch_all:
@@ -203,6 +216,7 @@ class QueryHandler(BaseESRequestHandler):
 
     ###########################################################################
     
+    @gen.coroutine
     def post(self):
         ''' Handle a POST to the query endpoint.'''
         ###################################################
@@ -240,11 +254,20 @@ class QueryHandler(BaseESRequestHandler):
             index=self._get_es_index(options), doc_type=self._get_es_doc_type(options),
             es_options=options.es_kwargs, userquery_dir=self.web_settings.USERQUERY_DIR, 
             default_scopes=self.web_settings.DEFAULT_SCOPES)
-        _backend = self.web_settings.ES_QUERY(client=self.web_settings.es_client, options=options.es_kwargs)
+        _backend = self._get_es_backend(options)
         _result_transformer = self.web_settings.ES_RESULT_TRANSFORMER(options=options.transform_kwargs, host=self.request.host,
             doc_url_function=self.web_settings.doc_url,
             jsonld_context=self.web_settings._jsonld_context, output_aliases=self.web_settings.OUTPUT_KEY_ALIASES)
         
+        ###################################################
+        #           Check response cache
+        ###################################################
+
+        _cache_key, _cached_res = yield self._get_cached_response(options, _query_builder, _backend)
+        if _cached_res is not None:
+            self._return_data_and_track(_cached_res, ga_event_data={'qsize': len(options.control_kwargs.q)})
+            return
+
         ###################################################
         #                  Build query
         ###################################################
@@ -267,7 +290,7 @@ class QueryHandler(BaseESRequestHandler):
         ###################################################
         
         try:
-            res = _backend.query_POST_query(_query)
+            res = yield self._execute_query(_backend.query_POST_query, _query)
         except BiothingSearchError as e:
             self._return_data_and_track({'success': False, 'error': '{0}'.format(e)}, ga_event_data={'qsize': len(options.control_kwargs.q)})
             return
@@ -300,5 +323,10 @@ class QueryHandler(BaseESRequestHandler):
 
         res = self._pre_finish_POST_hook(options, res)
 
+        self._cache_response(_cache_key, res)
+
         # return and track
-        self._return_data_and_track(res, ga_event_data={'qsize': len(options.control_kwargs.q)})
+        if self._should_stream(res):
+            yield self._stream_data_and_track(res, ga_event_data={'qsize': len(options.control_kwargs.q)})
+        else:
+            self._return_data_and_track(res, ga_event_data={'qsize': len(options.control_kwargs.q)})
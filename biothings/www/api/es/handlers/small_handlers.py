@@ -13,4 +13,8 @@ class StatusHandler(BaseESRequestHandler):
 
     def get(self):
         self.head()
+        # response cache statistics, if enabled, with "?stats=true"
+        if self.web_settings.response_cache and self._boolify(self.get_argument('stats', '')):
+            self.return_json({'status': 'OK', 'response_cache': self.web_settings.response_cache.get_stats()})
+            return
         self.write('OK')
@@ -1,4 +1,4 @@
-from biothings.utils.common import dotdict
+from biothings.utils.common import dotdict, is_str
 import logging
 
 class BiothingScrollError(Exception):
@@ -14,10 +14,41 @@ class ESQuery(object):
     The inputs to it are an Elasticsearch client (from `BiothingESWebSettings`_), and any options
     from the URL string.  Each handler calls a different query function, though they all do essentially
     the same thing: get the query generated in the ESQueryBuilder stage of the pipeline (``query_kwargs``), and run it
-    using the supplied Elasticsearch client.'''
+    using the supplied Elasticsearch client.  Multiple queries (msearch) with more than ``msearch_chunk_size`` queries
+    are split in slices, sent concurrently using ``msearch_executor`` (if any).'''
+    # set by handlers from web settings, after instantiation
+    msearch_chunk_size = 0
+    msearch_executor = None
+
     def __init__(self, client, options=dotdict()):
         self.client = client
         self.options = options
+
+    def _msearch(self, query_kwargs):
+        ''' Run a multiple query (msearch), in slices of ``msearch_chunk_size`` queries. Responses
+        are merged back in input order. Query body is a list of (header, query) pairs (see
+        ``ESQueryBuilder._build_multiple_query``), or an already serialized string, sent as is. '''
+        _body = query_kwargs.get('body')
+        if is_str(_body):
+            return self.client.msearch(**query_kwargs)
+
+        def _msearch_slice(pairs):
+            _kwargs = dict(query_kwargs)
+            # client serializes each header and query on its own line
+            _kwargs['body'] = [obj for pair in pairs for obj in pair]
+            return self.client.msearch(**_kwargs)
+
+        if not self.msearch_chunk_size or len(_body) <= self.msearch_chunk_size:
+            return _msearch_slice(_body)
+        _slices = [_body[i:i + self.msearch_chunk_size] for i in range(0, len(_body), self.msearch_chunk_size)]
+        if self.msearch_executor:
+            _results = self.msearch_executor.map(_msearch_slice, _slices)
+        else:
+            _results = map(_msearch_slice, _slices)
+        _res = {'responses': []}
+        for _r in _results:
+            _res['responses'].extend(_r['responses'])
+        return _res
         
     def _scroll(self, query_kwargs):
         ''' Returns the next scroll batch for the given scroll id '''
@@ -35,7 +66,7 @@ class ESQuery(object):
             return self.client.search(**query_kwargs)
 
     def _annotation_POST_query(self, query_kwargs):
-        return self.client.msearch(**query_kwargs)
+        return self._msearch(query_kwargs)
     
     def _query_GET_query(self, query_kwargs):
         from elasticsearch import RequestError
@@ -51,7 +82,7 @@ class ESQuery(object):
     def _query_POST_query(self, query_kwargs):
         from elasticsearch import RequestError
         try:
-            return self.client.msearch(**query_kwargs)
+            return self._msearch(query_kwargs)
         except RequestError as e:
             if e.args[1] == 'search_phase_execution_exception' and "error" in e.args[2] and "root_cause" in e.args[2]["error"]:
                 _root_causes = ['{} {}'.format(c['type'], c['reason']) for c in e.args[2]['error']['root_cause'] if 'reason' in c and 'type' in c]
@@ -93,3 +124,40 @@ class ESQuery(object):
     def scroll(self, query_kwargs):
         ''' Given ``query_kwargs`` from ESQueryBuilder, return results of a scroll on ES client - returns next batch of results. '''
         return self._scroll(query_kwargs)
+
+
+class AsyncESQuery(ESQuery):
+    ''' `ESQuery`_ subclass running queries in a pool of threads (``executor``, from `BiothingESWebSettings`_),
+    so the IOLoop isn't blocked while waiting for Elasticsearch.  Query functions return a future, which
+    handlers yield.  Set ``ES_QUERY`` to this class (or a subclass) in the config module to use it, pool size
+    is set with ``ES_QUERY_POOL_SIZE``.'''
+    def __init__(self, client, options=dotdict(), executor=None):
+        super(AsyncESQuery, self).__init__(client, options)
+        self.executor = executor
+
+    def _submit(self, func, query_kwargs):
+        return self.executor.submit(func, query_kwargs)
+
+    def annotation_GET_query(self, query_kwargs):
+        ''' Given ``query_kwargs`` from ESQueryBuilder, return a future for the results of annotation lookup GET query on ES client.'''
+        return self._submit(self._annotation_GET_query, query_kwargs)
+
+    def annotation_POST_query(self, query_kwargs):
+        ''' Given ``query_kwargs`` from ESQueryBuilder, return a future for the results of annotation lookup POST query on ES client.'''
+        return self._submit(self._annotation_POST_query, query_kwargs)
+
+    def query_GET_query(self, query_kwargs):
+        ''' Given ``query_kwargs`` from ESQueryBuilder, return a future for the results of query GET on ES client.'''
+        return self._submit(self._query_GET_query, query_kwargs)
+
+    def query_POST_query(self, query_kwargs):
+        ''' Given ``query_kwargs`` from ESQueryBuilder, return a future for the results of query POST on ES client.'''
+        return self._submit(self._query_POST_query, query_kwargs)
+
+    def metadata_query(self, query_kwargs):
+        ''' Given ``query_kwargs`` from ESQueryBuilder, return a future for the results of metadata query on ES client.'''
+        return self._submit(self._metadata_query, query_kwargs)
+
+    def scroll(self, query_kwargs):
+        ''' Given ``query_kwargs`` from ESQueryBuilder, return a future for the next batch of results of a scroll on ES client. '''
+        return self._submit(self._scroll, query_kwargs)
@@ -99,8 +99,9 @@ class ESQueryBuilder(object):
         for term in terms:
             if _infer_scope:
                 scopes = self._get_term_scope(term)
-            _q.extend(['{}', json.dumps(self._build_single_query(term, scopes=scopes))])
-        return self._return_query_kwargs({'body': '\n'.join(_q)})
+            _q.append(({}, self._build_single_query(term, scopes=scopes)))
+        # (header, query) pairs, serialized when sent (see ESQuery._msearch)
+        return self._return_query_kwargs({'body': _q})
 
     def _default_query(self, q):
         ''' Override me '''
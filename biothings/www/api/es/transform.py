@@ -2,6 +2,7 @@ from biothings.utils.version import get_software_info
 from biothings.utils.common import is_seq
 from biothings.utils.www.es import flatten_doc
 from collections import OrderedDict
+from operator import itemgetter
 import logging
 
 class ScrollIterationDone(Exception):
@@ -30,52 +31,85 @@ class ESResultTransformer(object):
         self.output_aliases = output_aliases
         self.app_dir = app_dir
 
-    def _flatten_doc(self, doc, outfield_sep='.', context_sep='.'):
-        def _recursion_helper(d, ret, path, out):
+    def _flatten_doc(self, doc, outfield_sep='.', context_sep='.', sort=True):
+        ret = {}
+        # explicit stack, children are pushed in reverse order so leaves are
+        # visited (and multiple values collected) in document order
+        stack = [(doc, '', '')]
+        while stack:
+            (d, path, out) = stack.pop()
             if isinstance(d, dict):
+                _children = []
                 for key in d:
-                    new_path_key = key if not path else context_sep.join([path, key])
-                    new_out_key = self._alias_output_keys(new_path_key, key) if not out else outfield_sep.join(
-                                                            [out, self._alias_output_keys(new_path_key, key)])
-                    _recursion_helper(d[key], ret, new_path_key, new_out_key)
+                    new_path = key if not path else context_sep.join([path, key])
+                    new_out = self._alias_output_keys(new_path, key)
+                    new_out = new_out if not out else outfield_sep.join([out, new_out])
+                    _children.append((d[key], new_path, new_out))
+                stack.extend(reversed(_children))
             elif is_seq(d):
-                for obj in d:
-                    _recursion_helper(obj, ret, path, out)
-            else:
-                if out in ret:
-                    if isinstance(ret[out], list):
-                        ret[out].append(d)
-                    else:
-                        ret[out] = [ret[out], d]
+                if [obj for obj in d if isinstance(obj, (dict, list, tuple))]:
+                    stack.extend([(obj, path, out) for obj in reversed(d)])
+                    continue
+                # list of values, nothing to visit in between, collect them at once
+                if not d:
+                    continue
+                if out not in ret:
+                    ret[out] = list(d) if len(d) > 1 else d[0]
+                elif isinstance(ret[out], list):
+                    ret[out].extend(d)
                 else:
-                    ret[out] = d
-        ret = {}
-        _recursion_helper(doc, ret, '', '')
-        return OrderedDict([(k,v) for (k,v) in sorted(ret.items(), key=lambda x: x[0])])
-    
+                    ret[out] = [ret[out]] + list(d)
+            elif out in ret:
+                if isinstance(ret[out], list):
+                    ret[out].append(d)
+                else:
+                    ret[out] = [ret[out], d]
+            else:
+                ret[out] = d
+        if not sort:
+            return ret
+        return OrderedDict(sorted(ret.items(), key=itemgetter(0)))
+
     def _sort_and_annotate_doc(self, doc, sort=True, data_src=False, field_sep='.'):
-        def _recursion_helper(doc, path):
-            if is_seq(doc):
-                return [_recursion_helper(_doc, path) for _doc in doc]
-            elif isinstance(doc, dict):
+        _dict = OrderedDict if sort else dict
+        if isinstance(doc, dict):
+            ret = _dict()
+        elif is_seq(doc):
+            ret = []
+        else:
+            return doc
+        # explicit stack of (source object, context path, output container). Output
+        # containers are created (and inserted) by their parent, so key order only
+        # depends on the parent, not on the order the stack is processed in.
+        stack = [(doc, '', ret)]
+        while stack:
+            (d, path, out) = stack.pop()
+            if isinstance(d, dict):
                 if data_src and path in self.data_sources:
-                    doc['@sources'] = self.data_sources[path]['@sources']
-                if sort:
-                    _doc = sorted(doc)
-                else:
-                    _doc = doc.keys()
-                this_list = []
-                for key in _doc:
+                    d['@sources'] = self.data_sources[path]['@sources']
+                for key in (sorted(d) if sort else d):
                     new_path = key if not path else field_sep.join([path, key])
-                    this_list.append((self._alias_output_keys(new_path, key), _recursion_helper(doc[key], new_path)))
-                if sort:
-                    return OrderedDict(this_list)
-                else:
-                    return dict(this_list)
+                    out_key = self._alias_output_keys(new_path, key)
+                    val = d[key]
+                    if isinstance(val, dict):
+                        out[out_key] = _dict()
+                        stack.append((val, new_path, out[out_key]))
+                    elif is_seq(val):
+                        out[out_key] = []
+                        stack.append((val, new_path, out[out_key]))
+                    else:
+                        out[out_key] = val
             else:
-                return doc
-
-        return _recursion_helper(doc, '')
+                for val in d:
+                    if isinstance(val, dict):
+                        out.append(_dict())
+                        stack.append((val, path, out[-1]))
+                    elif is_seq(val):
+                        out.append([])
+                        stack.append((val, path, out[-1]))
+                    else:
+                        out.append(val)
+        return ret
 
     def _form_doc(self, doc, score=True):
         _doc = doc.get('_source', doc.get('fields', {}))
@@ -94,10 +128,10 @@ class ESResultTransformer(object):
         if self.options.jsonld:
             _d = OrderedDict([('@context', self.jsonld_context['@context']), 
                               ('@id', self.doc_url_function(_doc['_id']))])
-            _d.update(self._flatten_doc(_doc))
+            _d.update(self._flatten_doc(_doc, sort=self.options._sorted))
             return _d
         elif self.options.dotfield:
-            return self._flatten_doc(_doc)
+            return self._flatten_doc(_doc, sort=self.options._sorted)
         else:
             return self._sort_and_annotate_doc(_doc, sort=self.options._sorted, data_src=self.options.datasource)
 
@@ -1,6 +1,7 @@
 import json
 import datetime
 import tornado.web
+from tornado import gen
 import re
 from biothings.utils.www.analytics import GAMixIn
 from biothings.utils.common import is_str, is_seq
@@ -78,6 +79,11 @@ class BaseHandler(tornado.web.RequestHandler, GAMixIn, SentryMixin):
         ''' Subclass to implement custom parameter sanitization '''
         self.jsonp = args.pop(self.web_settings.JSONP_PARAMETER, None)
         self.use_msgpack = args.pop('msgpack', False) if SUPPORT_MSGPACK else False
+        _indent = args.pop('indent', None)
+        if _indent and _indent.isdigit():
+            self.json_indent = int(_indent)
+        elif _indent and self._boolify(_indent):
+            self.json_indent = 2
         return args
 
     def _typify(self, arg, argval, json_list_input=False):
@@ -162,8 +168,7 @@ class BaseHandler(tornado.web.RequestHandler, GAMixIn, SentryMixin):
         :param encode: if encode is False, assumes input data is already a JSON encoded string.
         :param indent: number of indents per level in JSON string
         '''    
-        # call the recursive function to sort the data by keys and add the json-ld information
-        indent = indent or 2   # tmp settings
+        indent = self._get_json_indent(indent)
         if SUPPORT_MSGPACK and self.web_settings.ENABLE_MSGPACK and getattr(self, 'use_msgpack', False):
             _json_data = msgpack.packb(data, use_bin_type=True, default=msgpack_encode_datetime)
             self.set_header("Content-Type", "application/x-msgpack")
@@ -180,6 +185,48 @@ class BaseHandler(tornado.web.RequestHandler, GAMixIn, SentryMixin):
         else:
             self.write(_json_data)
 
+    @gen.coroutine
+    def return_json_stream(self, data, indent=None):
+        '''Return passed list as JSON response, serializing and flushing it item by item (using chunked
+        transfer encoding), so the whole JSON string is never held in memory. Response body is the same
+        as with `return_json`. msgpack and JSONP responses are not streamed.
+
+        :param data: list to return as JSON
+        :param indent: number of indents per level in JSON string
+        '''
+        if (SUPPORT_MSGPACK and self.web_settings.ENABLE_MSGPACK and getattr(self, 'use_msgpack', False)) or \
+            getattr(self, 'jsonp', False) or not data:
+            self.return_json(data, indent=indent)
+            return
+        indent = self._get_json_indent(indent)
+        self.set_header("Content-Type", "application/json; charset=UTF-8")
+        if not self.web_settings.DISABLE_CACHING:
+            self.set_cacheable()
+        self.support_cors()
+        if indent:
+            _newline = '\n' + ' ' * indent
+            (_start, _sep, _end) = ('[' + _newline, ',' + _newline, '\n]')
+        else:
+            (_start, _sep, _end) = ('[', ', ', ']')
+        for (i, item) in enumerate(data):
+            _json_data = json.dumps(item, cls=DateTimeJSONEncoder, indent=indent)
+            if indent:
+                # nest item one level in the list (newlines in strings are escaped)
+                _json_data = _json_data.replace('\n', _newline)
+            self.write((_sep if i else _start) + _json_data)
+            yield self.flush()
+        self.write(_end)
+
+    def _get_json_indent(self, indent=None):
+        '''Return JSON indentation: ``indent`` if given, else from the **indent** URL parameter,
+        else from ``JSON_INDENT`` setting (``None``, no indentation, by default).  ``0`` is the same
+        as ``None``, so streamed and non-streamed bodies are identical.'''
+        if indent is None:
+            indent = getattr(self, 'json_indent', None)
+        if indent is None:
+            indent = self.web_settings.JSON_INDENT
+        return indent or None
+
     def set_cacheable(self, etag=None):
         '''set proper header to make the response cacheable.
            set etag if provided.
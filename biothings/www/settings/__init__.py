@@ -82,6 +82,11 @@ class BiothingESWebSettings(BiothingWebSettings):
 
         # get es client for web
         self.es_client = self.get_es_client()
+        # thread pool for async queries (see biothings.www.api.es.query.AsyncESQuery)
+        self.es_query_executor = self.get_es_query_executor()
+        self.es_msearch_executor = self.get_es_msearch_executor()
+        # in-process response cache, None if disabled
+        self.response_cache = self.get_response_cache()
 
     def doc_url(self, bid):
         return os.path.join(self.URL_BASE, self.API_VERSION, self.ES_DOC_TYPE, bid)
@@ -90,4 +95,30 @@ class BiothingESWebSettings(BiothingWebSettings):
         '''Get the `Elasticsearch client <https://elasticsearch-py.readthedocs.io/en/master/>`_
         for this app, only called once on invocation of server. '''
         from elasticsearch import Elasticsearch
-        return Elasticsearch(self.ES_HOST, timeout=getattr(self, 'ES_CLIENT_TIMEOUT', 120))
+        # one connection per query thread, so async queries don't wait for a connection
+        return Elasticsearch(self.ES_HOST, timeout=getattr(self, 'ES_CLIENT_TIMEOUT', 120),
+                             maxsize=getattr(self, 'ES_QUERY_POOL_SIZE', 10) + getattr(self, 'ES_MSEARCH_CONCURRENCY', 0))
+
+    def get_es_query_executor(self):
+        '''Get the thread pool used to run queries when ``ES_QUERY`` is asynchronous
+        (threads are only started when used).'''
+        from concurrent.futures import ThreadPoolExecutor
+        return ThreadPoolExecutor(max_workers=getattr(self, 'ES_QUERY_POOL_SIZE', 10))
+
+    def get_es_msearch_executor(self):
+        '''Get the thread pool used to send slices of msearch queries concurrently, None if
+        ``ES_MSEARCH_CONCURRENCY`` isn't set. This is a different pool than the query one, as
+        slices are submitted from query threads.'''
+        if not getattr(self, 'ES_MSEARCH_CONCURRENCY', 0):
+            return None
+        from concurrent.futures import ThreadPoolExecutor
+        return ThreadPoolExecutor(max_workers=self.ES_MSEARCH_CONCURRENCY)
+
+    def get_response_cache(self):
+        '''Get the response cache (``RESPONSE_CACHE`` instance) for this app, None if
+        ``RESPONSE_CACHE_SIZE`` isn't set.'''
+        if not getattr(self, 'RESPONSE_CACHE_SIZE', 0) or not getattr(self, 'RESPONSE_CACHE', None):
+            return None
+        return self.RESPONSE_CACHE(size=self.RESPONSE_CACHE_SIZE,
+                                   ttl=getattr(self, 'RESPONSE_CACHE_TTL', 300),
+                                   version_check_interval=getattr(self, 'RESPONSE_CACHE_VERSION_CHECK_INTERVAL', 60))
@@ -1,6 +1,7 @@
 from biothings.www.api.es.query import ESQuery as DefaultESQuery
 from biothings.www.api.es.query_builder import ESQueryBuilder as DefaultESQueryBuilder
 from biothings.www.api.es.transform import ESResultTransformer as DefaultESResultTransformer
+from biothings.utils.www.cache import ResponseCache as DefaultResponseCache
 import re
 
 # *****************************************************************************
@@ -42,12 +43,34 @@ ES_QUERY_BUILDER = DefaultESQueryBuilder
 # Subclass of biothings.www.api.es.query.ESQuery to execute queries for this app
 # *****************************************************************************
 ES_QUERY = DefaultESQuery
+# Number of threads (and ES connections) used to run queries when ES_QUERY is
+# biothings.www.api.es.query.AsyncESQuery (or a subclass), so queries don't
+# block the IOLoop
+ES_QUERY_POOL_SIZE = 10
+# POST queries (msearch) with more than this number of inputs are split in slices
+# of this size, sent concurrently, 0 to disable (default)
+ES_MSEARCH_CHUNK_SIZE = 0
+# Number of threads (and ES connections) used to send msearch slices, 0 to send
+# them one after the other
+ES_MSEARCH_CONCURRENCY = 0
 # *****************************************************************************
 # Subclass of biothings.www.api.es.transform.ESResultTransformer to transform
 # ES results for this app
 # *****************************************************************************
 ES_RESULT_TRANSFORMER = DefaultESResultTransformer
 
+# *****************************************************************************
+# In-process response cache, subclass of biothings.utils.www.cache.ResponseCache.
+# Responses are cached per index build version (from _meta), set RESPONSE_CACHE_SIZE
+# to a positive number of responses to enable it
+# *****************************************************************************
+RESPONSE_CACHE = DefaultResponseCache
+RESPONSE_CACHE_SIZE = 0
+# number of seconds a response is kept in cache
+RESPONSE_CACHE_TTL = 300
+# number of seconds between two checks of index build version
+RESPONSE_CACHE_VERSION_CHECK_INTERVAL = 60
+
 OUTPUT_KEY_ALIASES = {}
 #OUTPUT_KEY_ALIASES = {'cadd':'schmadd', 'cadd/gene/ccds_id': 'cces_id'}
 
@@ -174,6 +197,14 @@ SENTRY_CLIENT_KEY = ''
 # JSON-LD PATH
 JSONLD_CONTEXT_PATH = ''
 
+# JSON responses indentation, None to disable (indentation can also be set per request
+# with the "indent" URL parameter)
+JSON_INDENT = None
+
+# POST responses with at least this number of results are serialized and sent
+# result by result (chunked transfer encoding), 0 to disable
+STREAM_RESPONSE_MIN_SIZE = 100
+
 # Can turn msgpack functionality off here, will still load msgpack module if available, just won't
 # use it to compress requests
 ENABLE_MSGPACK = True